@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark the scalar vs NumPy projection paths of complete_missing_stops.py
+on the real bundle (routes from assets/transport_lines/core, stops from
+assets/osm_bus_stops_tana.json), and check both give identical results.
+
+Runs offline: no Overpass or OSRM call is made.
+
+Usage:
+    python3 scripts/bench_projection.py
+    python3 scripts/bench_projection.py --repeat 3
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+
+import complete_missing_stops as cms
+
+STOPS_PATH = "assets/osm_bus_stops_tana.json"
+
+
+def load_routes():
+    routes = []
+    for path in sorted(glob.glob(os.path.join(cms.GEOJSON_DIR, "*.geojson"))):
+        with open(path) as f:
+            gj = json.load(f)
+        for feat in gj.get("features", []):
+            if feat.get("geometry", {}).get("type") == "LineString":
+                coords = feat["geometry"]["coordinates"]
+                if len(coords) >= 2:
+                    routes.append((os.path.basename(path), coords))
+                break
+    return routes
+
+
+def load_stops():
+    with open(STOPS_PATH) as f:
+        data = json.load(f)
+    return [{"id": s["id"], "lon": s["lng"], "lat": s["lat"], "name": s["name"]}
+            for s in data["stops"]]
+
+
+def run(routes, stops, use_numpy, repeat):
+    """Best-of-`repeat` wall time for filtering + synthetic stops on every route."""
+    cms.HAVE_NUMPY = use_numpy
+    stop_index = cms.build_stop_index(stops)
+    best, results = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        results = [
+            (cms.filter_stops_for_route(stops, coords, stop_index),
+             cms.generate_synthetic_stops(coords, 20))
+            for _, coords in routes
+        ]
+        best = min(best, time.perf_counter() - t0)
+    return best, results
+
+
+def main():
+    args = sys.argv[1:]
+    repeat = 1
+    if "--repeat" in args:
+        idx = args.index("--repeat")
+        if idx + 1 < len(args):
+            repeat = max(1, int(args[idx + 1]))
+
+    if not cms.HAVE_NUMPY:
+        print("NumPy is not installed: only the scalar path can run.")
+        return 1
+
+    routes = load_routes()
+    stops = load_stops()
+    segments = sum(len(c) - 1 for _, c in routes)
+    print(f"{len(routes)} routes ({segments} segments), {len(stops)} stops, best of {repeat}")
+
+    scalar_t, scalar_res = run(routes, stops, False, repeat)
+    numpy_t, numpy_res = run(routes, stops, True, repeat)
+    cms.HAVE_NUMPY = True
+
+    candidates = sum(len(f) for f, _ in scalar_res)
+    identical = scalar_res == numpy_res
+    print(f"  scalar : {scalar_t * 1000:8.1f} ms")
+    print(f"  numpy  : {numpy_t * 1000:8.1f} ms  ({scalar_t / numpy_t:.1f}x)")
+    print(f"  {candidates} corridor candidates, results identical: {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Benchmark road snapping end to end: snap_routes_to_roads.py and
+complete_missing_stops.py run over a scratch copy of the real bundle
+(assets/transport_lines) against a local fake OSRM server, and the
+results (wall time, OSRM requests / bytes, cache hits, Hausdorff deviation
+of each output route from its input) are written to a JSON file so runs
+on two commits can be compared.
+
+The fake server replays responses recorded in an OsrmCache database
+(--recording). A request that was never recorded is either forwarded to
+a real OSRM and recorded (--record URL), or answered with a synthetic
+route: the straight waypoint-to-waypoint polyline, densified every
+SYNTH_STEP_M meters. Synthetic answers keep runs reproducible offline;
+their count is part of the results.
+
+To exercise every file, the scratch copy has the road_snapped flag
+cleared (snap_routes_to_roads) and the stop features removed
+(complete_missing_stops). Stops come from assets/osm_bus_stops_tana.json;
+no Overpass call is made. Each script gets an empty OSRM cache, so cache
+hits are requests repeated within the run.
+
+Usage:
+    python3 scripts/bench_snapping.py
+    python3 scripts/bench_snapping.py --lines 20 --workers 4
+    python3 scripts/bench_snapping.py --waypoints 200      # chunked snapping
+    python3 scripts/bench_snapping.py --record https://osrm2.misy.app
+    python3 scripts/bench_snapping.py --out build/bench/snapping.json --baseline old.json
+"""
+
+import contextlib
+import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import complete_missing_stops as cms
+import polyline_projection
+import snap_routes_to_roads as snap
+import transport_bundle
+from geo_index import SegmentGrid
+from osrm_cache import OsrmCache, cache_key
+from osrm_client import OsrmClient
+
+BUNDLE_DIR = "assets/transport_lines"
+STOPS_PATH = "assets/osm_bus_stops_tana.json"
+RECORDING_PATH = "build/bench/osrm_recording.sqlite"
+RESULTS_PATH = "build/bench/snapping.json"
+SYNTH_STEP_M = 25      # vertex spacing of synthetic routes (meters)
+HAUSDORFF_CELL_M = 50  # grid cell / exact-search margin of the deviation index
+
+
+# ── Fake OSRM ──────────────────────────────────────────────────────────────
+
+def synthetic_route(coords: list, steps: bool) -> dict:
+    """OSRM-shaped /route response following straight lines between the
+    waypoints, one leg per waypoint pair."""
+    geometry, legs = [], []
+    for (ax, ay), (bx, by) in zip(coords, coords[1:]):
+        dist = cms.meters_between(ax, ay, bx, by)
+        n = max(1, int(math.ceil(dist / SYNTH_STEP_M)))
+        leg = [[round(ax + (bx - ax) * k / n, 6), round(ay + (by - ay) * k / n, 6)]
+               for k in range(n + 1)]
+        geometry.extend(leg[1:] if geometry else leg)
+        legs.append({
+            "distance": round(dist, 1),
+            "duration": round(dist / 8.0, 1),
+            "steps": [{"geometry": {"type": "LineString", "coordinates": leg}}]
+            if steps else [],
+        })
+    return {
+        "code": "Ok",
+        "routes": [{
+            "geometry": {"type": "LineString", "coordinates": geometry},
+            "legs": legs,
+            "distance": round(sum(leg["distance"] for leg in legs), 1),
+            "duration": round(sum(leg["duration"] for leg in legs), 1),
+        }],
+        "waypoints": [{"location": c, "name": ""} for c in coords],
+    }
+
+
+class FakeOsrm:
+    """Local HTTP server answering /route/v1/{profile}/{coords}?{options}
+    from a recording, an upstream OSRM, or synthetic_route()."""
+
+    def __init__(self, recording_path: str, upstream: str = None):
+        self.recording = OsrmCache(recording_path, ttl_days=36500,
+                                   max_entries=10 ** 9)
+        self.upstream = OsrmClient(upstream, rate=5, user_agent="MisyBench/1.0") \
+            if upstream else None
+        self.stats = {"requests": 0, "replayed": 0, "recorded": 0, "synthesized": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self.upstream is not None:
+            self.upstream.close()
+        self.recording.close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def respond(self, path: str) -> dict:
+        parts = urllib.parse.urlsplit(path)
+        segments = parts.path.strip("/").split("/")
+        if len(segments) != 4 or segments[0] != "route":
+            return {"code": "InvalidUrl"}
+        profile = segments[2]
+        coords = [[float(v) for v in pair.split(",")]
+                  for pair in urllib.parse.unquote(segments[3]).split(";")]
+        self._count("requests")
+        # No base URL in the key: a recording is replayed with or without
+        # the upstream it was recorded from
+        key = cache_key(coords, profile, parts.query)
+        recorded = self.recording.get(key)
+        if recorded is not None:
+            self._count("replayed")
+            return recorded
+        if self.upstream is not None:
+            try:
+                result = self.upstream.get_json(path)
+            except RuntimeError as e:
+                return {"code": "UpstreamError", "message": str(e)}
+            if result.get("code") == "Ok":
+                self.recording.put(key, result)
+                self._count("recorded")
+            return result
+        self._count("synthesized")
+        return synthetic_route(coords, "steps=true" in parts.query)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = json.dumps(fake.respond(self.path),
+                                  separators=(",", ":")).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ── Deviation ──────────────────────────────────────────────────────────────
+
+def _directed_hausdorff(a: list, b: list) -> float:
+    """Largest distance (m) from a vertex of `a` to the polyline `b`."""
+    if len(b) < 2:
+        b = b * 2
+    if polyline_projection.HAVE_NUMPY:
+        return float(polyline_projection.project_points(a, b)["dist"].max())
+    grid = SegmentGrid(b, HAUSDORFF_CELL_M, HAUSDORFF_CELL_M)
+    worst = 0.0
+    for lon, lat in a:
+        best = float("inf")
+        for i in grid.candidates(lon, lat):
+            d = cms.point_to_segment(lon, lat, *b[i], *b[i + 1])[0]
+            if d < best:
+                best = d
+        if best > HAUSDORFF_CELL_M:
+            # Nothing within the indexed margin: exact scan
+            best = cms.find_nearest_segment(lon, lat, b)[0]
+        worst = max(worst, best)
+    return worst
+
+
+def hausdorff_m(a: list, b: list) -> float:
+    """Symmetric Hausdorff distance between two polylines (vertices
+    against segments, local meters)."""
+    if not a or not b:
+        return float("inf")
+    return max(_directed_hausdorff(a, b), _directed_hausdorff(b, a))
+
+
+def _deviation_summary(values: list) -> dict:
+    if not values:
+        return {"max": None, "mean": None, "p95": None}
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(math.ceil(0.95 * len(ordered))) - 1)]
+    return {"max": round(ordered[-1], 2),
+            "mean": round(sum(ordered) / len(ordered), 2),
+            "p95": round(p95, 2)}
+
+
+# ── Drivers ────────────────────────────────────────────────────────────────
+
+def _route_coords(path: str) -> list:
+    transport_bundle.forget(path)
+    return transport_bundle.route_coords(transport_bundle.load_json(path))
+
+
+def _scratch_copy(source: str, workdir: str, lines: int, prepare) -> dict:
+    """Copy the bundle at `source` to BUNDLE_DIR under `workdir` (the
+    layout the scripts expect), keeping the first `lines` line numbers,
+    and let `prepare(gj)` edit each GeoJSON.
+    Returns {path relative to workdir: input route coordinates}."""
+    shutil.copytree(source, os.path.join(workdir, BUNDLE_DIR))
+    paths = sorted(glob.glob(os.path.join(workdir, BUNDLE_DIR, "core", "*.geojson")))
+    if lines:
+        keep = sorted({os.path.basename(p).rsplit("_", 1)[0] for p in paths})[:lines]
+        for path in paths:
+            if os.path.basename(path).rsplit("_", 1)[0] not in keep:
+                os.unlink(path)
+        paths = [p for p in paths if os.path.basename(p).rsplit("_", 1)[0] in keep]
+    inputs = {}
+    for path in paths:
+        with open(path) as f:
+            gj = json.load(f)
+        prepare(gj)
+        transport_bundle.write_geojson(path, gj)
+        inputs[os.path.relpath(path, workdir)] = transport_bundle.route_coords(
+            transport_bundle.load_json(path))   # as written (quantised)
+    return inputs
+
+
+def _client(fake: FakeOsrm, workdir: str, name: str) -> OsrmClient:
+    return OsrmClient(fake.url, rate=0, user_agent="MisyBench/1.0",
+                      cache=OsrmCache(os.path.join(workdir, f"{name}.sqlite")))
+
+
+def _measure(client: OsrmClient, inputs: dict, wall: float, counts: dict) -> dict:
+    deviations, vertices_out = [], 0
+    for rel, before in inputs.items():
+        after = _route_coords(rel)
+        vertices_out += len(after)
+        if after != before:
+            deviations.append(hausdorff_m(before, after))
+    cache = client.cache.stats
+    return {
+        **counts,
+        "wall_s": round(wall, 3),
+        "requests": client.stats["requests"],
+        "bytes": client.stats["bytes"],
+        "errors": client.stats["errors"],
+        "cache_hits": cache["hits"],
+        "cache_misses": cache["misses"],
+        "vertices_in": sum(len(c) for c in inputs.values()),
+        "vertices_out": vertices_out,
+        "hausdorff_m": _deviation_summary(deviations),
+    }
+
+
+def bench_snap(fake: FakeOsrm, source: str, workdir: str, lines: int,
+               workers: int, waypoints: int) -> dict:
+    """snap_routes_to_roads.process_geojson over every file, as its main()."""
+    def prepare(gj):
+        gj.get("properties", {}).pop("road_snapped", None)
+
+    inputs = _scratch_copy(source, workdir, lines, prepare)
+    client = _client(fake, workdir, "snap_cache")
+    counts = {"files": len(inputs), "snapped": 0, "failed": 0}
+    t0 = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for status, _, _ in pool.map(
+                lambda path: snap.process_geojson(client, path, waypoints), list(inputs)):
+            counts["snapped" if status == "snapped" else "failed"] += 1
+    wall = time.perf_counter() - t0
+    client.close()
+    return _measure(client, inputs, wall, counts)
+
+
+def bench_stops(fake: FakeOsrm, source: str, workdir: str, lines: int,
+                stops: list) -> dict:
+    """complete_missing_stops phases 2-3 over every file, stops removed."""
+    def prepare(gj):
+        gj["features"] = [f for f in gj.get("features", [])
+                          if f.get("properties", {}).get("type") != "stop"]
+
+    inputs = _scratch_copy(source, workdir, lines, prepare)
+    osrm = _client(fake, workdir, "stops_cache")
+    t0 = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        needed, _ = cms.identify_files_needing_stops(cms.open_bundle())
+        by_line = {}
+        for entry in needed:
+            by_line.setdefault(entry["line_number"], {})[entry["direction"]] = entry
+        processed, failed, _ = cms.process_lines(
+            by_line, stops, osrm, stop_index=cms.build_stop_index(stops))
+    wall = time.perf_counter() - t0
+    osrm.close()
+    counts = {"files": len(inputs), "processed": processed, "failed": failed}
+    return _measure(osrm, inputs, wall, counts)
+
+
+# ── Main ───────────────────────────────────────────────────────────────────
+
+def load_stops() -> list:
+    with open(STOPS_PATH) as f:
+        data = json.load(f)
+    return [{"id": s["id"], "lon": s["lng"], "lat": s["lat"], "name": s["name"]}
+            for s in data["stops"]]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(args: list) -> dict:
+    opts = {"lines": 0, "workers": snap.DEFAULT_WORKERS,
+            "waypoints": snap.WAYPOINT_BUDGET, "record": None,
+            "recording": RECORDING_PATH, "out": RESULTS_PATH, "baseline": None}
+    for flag, key, cast in (("--lines", "lines", int), ("--workers", "workers", int),
+                            ("--waypoints", "waypoints", int),
+                            ("--record", "record", str),
+                            ("--recording", "recording", str),
+                            ("--out", "out", str), ("--baseline", "baseline", str)):
+        if flag in args:
+            idx = args.index(flag)
+            if idx + 1 < len(args):
+                opts[key] = cast(args[idx + 1])
+    return opts
+
+
+def _print_run(name: str, run: dict, baseline: dict):
+    dev = run["hausdorff_m"]
+    print(f"  {name}: {run['files']} files, {run['wall_s']:.2f} s, "
+          f"{run['requests']} requests ({run['bytes'] / 1024:.0f} KB), "
+          f"cache {run['cache_hits']} hits / {run['cache_misses']} misses, "
+          f"{run['vertices_in']} -> {run['vertices_out']} vertices, "
+          f"Hausdorff max {dev['max']} m / p95 {dev['p95']} m / mean {dev['mean']} m")
+    old = (baseline or {}).get(name)
+    if not old:
+        return
+    for key in ("wall_s", "requests", "bytes", "cache_hits", "vertices_out"):
+        if old.get(key) != run[key]:
+            print(f"      {key}: {old.get(key)} -> {run[key]}")
+    for key, value in dev.items():
+        if old.get("hausdorff_m", {}).get(key) != value:
+            print(f"      hausdorff {key}: {old['hausdorff_m'].get(key)} -> {value}")
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    out_path = os.path.abspath(opts["out"])
+    baseline = None
+    if opts["baseline"]:
+        with open(opts["baseline"]) as f:
+            baseline = json.load(f)
+    stops = load_stops()
+    fake = FakeOsrm(os.path.abspath(opts["recording"]), opts["record"]).start()
+    repo = os.getcwd()
+    source = os.path.abspath(BUNDLE_DIR)
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "params": {"lines": opts["lines"] or None, "workers": opts["workers"],
+                   "waypoints": opts["waypoints"],
+                   "synth_step_m": SYNTH_STEP_M},
+    }
+    try:
+        for name, bench in (
+                ("snap_routes_to_roads",
+                 lambda d: bench_snap(fake, source, d, opts["lines"], opts["workers"],
+                                   max(2, opts["waypoints"]))),
+                ("complete_missing_stops",
+                 lambda d: bench_stops(fake, source, d, opts["lines"], stops))):
+            with tempfile.TemporaryDirectory(prefix="bench_snapping.") as workdir:
+                os.chdir(workdir)
+                try:
+                    results[name] = bench(workdir)
+                finally:
+                    os.chdir(repo)
+                    transport_bundle.forget()
+    finally:
+        fake.stop()
+    results["osrm_server"] = fake.stats
+
+    print(f"Snapping benchmark ({results['commit'] or 'no commit'}), fake OSRM: "
+          f"{fake.stats['replayed']} replayed, {fake.stats['recorded']} recorded, "
+          f"{fake.stats['synthesized']} synthesized")
+    for name in ("snap_routes_to_roads", "complete_missing_stops"):
+        _print_run(name, results[name], baseline)
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    transport_bundle.write_json(out_path, results)
+    print(f"Results written to {opts['out']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Build the binary form (route_codec.py, MRB1) of every line GeoJSON of the
+public bundle, check that each one decodes back to its GeoJSON, and report
+download size (raw and gzip) and parse time against the JSON.
+
+Only files whose encoding changed are rewritten. The round-trip check
+compares the decoded collection with the source GeoJSON, coordinates
+snapped to the 10**-precision grid; any difference fails the build.
+
+Usage:
+    python3 scripts/build_route_binaries.py
+    python3 scripts/build_route_binaries.py --src assets/transport_lines/core
+    python3 scripts/build_route_binaries.py --out build/transport_lines_bin --precision 6
+
+Output:
+    build/transport_lines_bin/{line}_{aller|retour}.mrb
+"""
+
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+
+import route_codec
+from transport_bundle import atomic_open
+
+SRC_DIR = "assets/transport_lines_public/core"
+OUT_DIR = "build/transport_lines_bin"
+
+
+def parse_args(args: list) -> dict:
+    opts = {"src": SRC_DIR, "out": OUT_DIR, "precision": route_codec.DEFAULT_PRECISION}
+    for flag, key, cast in (("--src", "src", str), ("--out", "out", str),
+                            ("--precision", "precision", int)):
+        if flag in args:
+            idx = args.index(flag)
+            if idx + 1 < len(args):
+                opts[key] = cast(args[idx + 1])
+    return opts
+
+
+def expected_roundtrip(gj: dict, precision: int) -> dict:
+    """What decode(encode(gj)) must return: the source, coordinates on the
+    codec's integer grid."""
+    expected = json.loads(json.dumps(gj))
+    scale = 10 ** precision
+    for feat in expected.get("features", []):
+        geom = feat.get("geometry")
+        if geom:
+            geom["coordinates"] = _on_grid(geom["coordinates"], scale)
+    return expected
+
+
+def _on_grid(c, scale):
+    if c and isinstance(c[0], (int, float)):
+        return [round(v * scale) / scale for v in c]
+    return [_on_grid(part, scale) for part in c]
+
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """Atomically write `data` unless the file holds it already."""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    with atomic_open(path) as f:
+        f.write(data)
+    return True
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    precision = opts["precision"]
+    paths = sorted(glob.glob(os.path.join(opts["src"], "*.geojson")))
+    if not paths:
+        print(f"No GeoJSON files in {opts['src']}")
+        return 1
+    os.makedirs(opts["out"], exist_ok=True)
+
+    json_bytes = json_gz = bin_bytes = bin_gz = 0
+    json_parse = bin_parse = 0.0
+    written = 0
+    failures = []
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        t0 = time.perf_counter()
+        gj = json.loads(raw)
+        json_parse += time.perf_counter() - t0
+
+        data = route_codec.encode(gj, precision)
+        t0 = time.perf_counter()
+        decoded = route_codec.decode(data)
+        bin_parse += time.perf_counter() - t0
+        if decoded != expected_roundtrip(gj, precision):
+            failures.append(os.path.basename(path))
+            continue
+
+        name = os.path.splitext(os.path.basename(path))[0] + ".mrb"
+        written += write_if_changed(os.path.join(opts["out"], name), data)
+        json_bytes += len(raw)
+        json_gz += len(gzip.compress(raw))
+        bin_bytes += len(data)
+        bin_gz += len(gzip.compress(data))
+
+    ok = len(paths) - len(failures)
+    print(f"{ok}/{len(paths)} routes encoded (precision {precision}), "
+          f"{written} written to {opts['out']}")
+    if ok:
+        print(f"  GeoJSON : {json_bytes / 1e6:7.2f} MB raw, {json_gz / 1e6:6.2f} MB gzip, "
+              f"parse {json_parse * 1000:6.0f} ms")
+        print(f"  MRB1    : {bin_bytes / 1e6:7.2f} MB raw, {bin_gz / 1e6:6.2f} MB gzip, "
+              f"decode {bin_parse * 1000:6.0f} ms (pure Python)")
+        print(f"  download: {json_gz / bin_gz:.1f}x smaller gzipped, "
+              f"{json_bytes / bin_bytes:.1f}x raw")
+    for name in failures:
+        print(f"  ROUND-TRIP MISMATCH: {name}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
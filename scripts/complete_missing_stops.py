@@ -16,16 +16,37 @@ Method:
 Usage:
     python3 scripts/complete_missing_stops.py          # Process missing lines
     python3 scripts/complete_missing_stops.py --audit   # Audit all 95 lines
+    python3 scripts/complete_missing_stops.py --audit --report audit.json  # + JSON/CSV report
+    python3 scripts/complete_missing_stops.py --audit --workers 4  # Audit process pool size
     python3 scripts/complete_missing_stops.py --line 009 # Process single line
+    python3 scripts/complete_missing_stops.py --per-leg  # One OSRM call per stop pair
+    python3 scripts/complete_missing_stops.py --offline  # Stops from the OSM store only
+    python3 scripts/complete_missing_stops.py --restart  # Ignore the journal of an interrupted run
+
+Each finished line direction is journaled (run_journal.py) and saved in
+the manifest as it completes; an interrupted run picks up where it stopped.
+--line runs are not journaled, so they leave a full run's journal alone.
 """
 
+import bisect
+import csv
 import json
 import math
 import os
 import sys
 import time
-import urllib.request
 import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import osm_store
+import transport_bundle
+from geo_index import PointGrid, SegmentGrid
+from osrm_cache import open_default_cache
+from osrm_client import OSRM_URL, OsrmClient
+from overpass_client import read_overpass_json
+from polyline_projection import HAVE_NUMPY, cumulative_lengths, project_points
+from run_journal import open_journal, unit_name
 
 # ── Configuration ──────────────────────────────────────────────────────────
 
@@ -33,7 +54,6 @@ OVERPASS_URLS = [
     "https://maps.mail.ru/osm/tools/overpass/api/interpreter",
     "https://overpass-api.de/api/interpreter",
 ]
-OSRM_URL = "https://osrm2.misy.app"
 GEOJSON_DIR = "assets/transport_lines/core"
 MANIFEST_PATH = "assets/transport_lines/manifest.json"
 
@@ -46,13 +66,29 @@ LAT_SCALE = 111000   # meters per degree latitude
 BUFFER_M = 100       # search corridor width (meters)
 MIN_SPACING_M = 30   # minimum spacing between stops (meters)
 CENTERLINE_TOL_M = 5 # centerline tolerance (meters)
-OSRM_DELAY = 0.3     # delay between OSRM requests (seconds)
+OSRM_DELAY = 0.3     # minimum spacing between OSRM network requests (seconds)
+OSRM_BATCH_WAYPOINTS = 25  # waypoints per multi-waypoint /route call
+
+
+def open_bundle():
+    """Bundle (manifest + line GeoJSONs) this script reads and completes."""
+    return transport_bundle.Bundle(MANIFEST_PATH, GEOJSON_DIR)
+
+
+def make_osrm_client():
+    """Cached, rate-limited OSRM client: cache hits skip both network and
+    delay. Built by main(), so importing this module (audit workers,
+    benchmarks) opens no cache."""
+    return OsrmClient(OSRM_URL, rate=1 / OSRM_DELAY, burst=1, timeout=15,
+                      user_agent="MisyTransportStops/1.0",
+                      cache=open_default_cache())
 
 
 # ── Network helpers ────────────────────────────────────────────────────────
 
-def fetch_overpass(query: str, timeout: int = 180) -> dict:
-    """Execute an Overpass API query, trying multiple servers."""
+def fetch_overpass(query: str, timeout: int = 180, on_element=None) -> dict:
+    """Execute an Overpass API query, trying multiple servers.
+    With on_element, elements are streamed to it instead of returned."""
     data = urllib.parse.urlencode({"data": query}).encode("utf-8")
 
     for server_url in OVERPASS_URLS:
@@ -61,7 +97,7 @@ def fetch_overpass(query: str, timeout: int = 180) -> dict:
                 req = urllib.request.Request(server_url, data=data)
                 req.add_header("User-Agent", "MisyTransportFetcher/2.0")
                 with urllib.request.urlopen(req, timeout=timeout) as resp:
-                    return json.loads(resp.read().decode("utf-8"))
+                    return read_overpass_json(resp, on_element)
             except Exception as e:
                 print(f"  {server_url} attempt {attempt+1} failed: {e}")
                 if attempt < 1:
@@ -70,30 +106,16 @@ def fetch_overpass(query: str, timeout: int = 180) -> dict:
     raise RuntimeError("Failed to fetch from all Overpass API servers")
 
 
-def osrm_route(from_lon, from_lat, to_lon, to_lat, retries=3):
+def osrm_route(osrm, from_lon, from_lat, to_lon, to_lat):
     """Get a road route between two points via OSRM.
     Returns list of [lon, lat] coordinates or None."""
-    url = (
-        f"{OSRM_URL}/route/v1/driving/"
-        f"{from_lon},{from_lat};{to_lon},{to_lat}"
-        f"?overview=full&geometries=geojson"
-    )
+    return osrm.route([[from_lon, from_lat], [to_lon, to_lat]])
 
-    for attempt in range(retries):
-        try:
-            req = urllib.request.Request(url)
-            req.add_header("User-Agent", "MisyTransportStops/1.0")
-            with urllib.request.urlopen(req, timeout=15) as resp:
-                result = json.loads(resp.read().decode("utf-8"))
-
-            if result.get("code") == "Ok" and result.get("routes"):
-                return result["routes"][0]["geometry"]["coordinates"]
-        except Exception as e:
-            if attempt < retries - 1:
-                time.sleep(2)
-            else:
-                print(f"    OSRM error: {e}")
-    return None
+
+def osrm_route_legs(osrm, waypoints):
+    """Route through a waypoint sequence in one OSRM call.
+    Returns one [lon, lat] list per leg (len(waypoints) - 1), or None."""
+    return osrm.route_legs(waypoints)
 
 
 # ── Geometry helpers ───────────────────────────────────────────────────────
@@ -125,8 +147,10 @@ def point_to_segment(px, py, ax, ay, bx, by):
     return dist, t, proj_lon, proj_lat
 
 
-def find_nearest_segment(stop_lon, stop_lat, route_coords):
+def find_nearest_segment(stop_lon, stop_lat, route_coords, seg_grid=None):
     """Find the nearest route segment to a stop.
+    With a SegmentGrid, only segments within its margin are tested (a stop
+    farther than that from the route gets distance inf).
     Returns (distance_m, segment_index, t, proj_lon, proj_lat)."""
     best_dist = float('inf')
     best_seg = 0
@@ -134,7 +158,12 @@ def find_nearest_segment(stop_lon, stop_lat, route_coords):
     best_proj_lon = route_coords[0][0]
     best_proj_lat = route_coords[0][1]
 
-    for i in range(len(route_coords) - 1):
+    if seg_grid is not None:
+        seg_indices = seg_grid.candidates(stop_lon, stop_lat)
+    else:
+        seg_indices = range(len(route_coords) - 1)
+
+    for i in seg_indices:
         ax, ay = route_coords[i]
         bx, by = route_coords[i + 1]
         dist, t, plon, plat = point_to_segment(stop_lon, stop_lat, ax, ay, bx, by)
@@ -181,25 +210,32 @@ def is_right_side(stop_lon, stop_lat, seg_start, seg_end):
 
 # ── OSM data fetching ──────────────────────────────────────────────────────
 
-def fetch_all_bus_stops():
-    """Fetch all bus stops in Antananarivo area from OSM."""
-    query = f"""
-    [out:json][timeout:120];
-    (
+def fetch_all_bus_stops(offline=False):
+    """Fetch all bus stops in Antananarivo area from OSM.
+    The stop set is synced into the local OSM store (only stops edited
+    since the last run are downloaded); offline it is read from the store."""
+    store = osm_store.OsmStore(osm_store.STORE_PATH)
+    key = f"bus_stops:{BBOX}"
+    if offline:
+        print("Loading all bus stops from the OSM store (offline)...")
+        ids = osm_store.stored_id_set(store, key)
+    else:
+        print("Fetching all bus stops from OSM...")
+        ids = osm_store.sync_node_set(store, key, f"""
       node["highway"="bus_stop"]({BBOX});
       node["public_transport"="stop_position"]({BBOX});
       node["public_transport"="platform"]({BBOX});
-    );
-    out body;
-    """
-    print("Fetching all bus stops from OSM...")
-    result = fetch_overpass(query, timeout=150)
+    """, fetch_overpass, timeout=150)
+
+    by_id = {el["id"]: el for el in store.elements("node", ids)}
+    store.close()
 
     stops = []
     seen_ids = set()
-    for el in result.get("elements", []):
-        if el["type"] == "node" and el["id"] not in seen_ids:
-            seen_ids.add(el["id"])
+    for node_id in ids:
+        el = by_id.get(node_id)
+        if el is not None and node_id not in seen_ids:
+            seen_ids.add(node_id)
             tags = el.get("tags", {})
             stops.append({
                 "id": el["id"],
@@ -214,25 +250,51 @@ def fetch_all_bus_stops():
 
 # ── Core logic ─────────────────────────────────────────────────────────────
 
-def filter_stops_for_route(all_stops, route_coords):
+def build_stop_index(all_stops):
+    """Grid index over OSM stops, built once and reused for every line."""
+    return PointGrid([(s["lon"], s["lat"]) for s in all_stops], BUFFER_M,
+                     LON_SCALE, LAT_SCALE)
+
+
+def filter_stops_for_route(all_stops, route_coords, stop_index=None):
     """Filter OSM stops within corridor and on the right side of the route.
+    Candidates are the stops in the grid cells the route's BUFFER_M
+    corridor covers (stop_index, from build_stop_index; every stop when
+    not given). With NumPy they are projected in one batched call
+    (polyline_projection.py), otherwise one by one with exact
+    point_to_segment tests against the nearby segments. Both paths give
+    the same result as a full scan.
     Returns list of dicts with stop info + projection data."""
     candidates = []
-
-    for stop in all_stops:
-        dist, seg_idx, t, proj_lon, proj_lat = find_nearest_segment(
-            stop["lon"], stop["lat"], route_coords
+    if not all_stops or len(route_coords) < 2:
+        return candidates
+
+    # +1 m keeps float rounding at the corridor edge on the safe side
+    seg_grid = SegmentGrid(route_coords, BUFFER_M, BUFFER_M + 1,
+                           LON_SCALE, LAT_SCALE)
+    if stop_index is not None:
+        nearby = [all_stops[i] for i in stop_index.in_cells(seg_grid.covered_cells())]
+    else:
+        nearby = all_stops
+    if not nearby:
+        return candidates
+
+    if HAVE_NUMPY:
+        # Vectorized: every candidate against every nearby run of segments
+        proj = project_points([(s["lon"], s["lat"]) for s in nearby], route_coords,
+                              LON_SCALE, LAT_SCALE, max_dist=BUFFER_M + 1)
+        projections = zip(
+            proj["dist"].tolist(), proj["seg"].tolist(), proj["t"].tolist(),
+            proj["proj_lon"].tolist(), proj["proj_lat"].tolist(),
+            (proj["cross"] < 0).tolist(), proj["cross_dist"].tolist(),
         )
+    else:
+        projections = (project_stop(stop, route_coords, seg_grid) for stop in nearby)
 
+    for stop, (dist, seg_idx, t, proj_lon, proj_lat, right, cross_dist) in zip(nearby, projections):
         if dist > BUFFER_M:
             continue
 
-        right, cross_dist = is_right_side(
-            stop["lon"], stop["lat"],
-            route_coords[seg_idx],
-            route_coords[min(seg_idx + 1, len(route_coords) - 1)]
-        )
-
         # Keep if right side OR very close to centerline
         if right or cross_dist < CENTERLINE_TOL_M:
             candidates.append({
@@ -250,6 +312,23 @@ def filter_stops_for_route(all_stops, route_coords):
     return candidates
 
 
+def project_stop(stop, route_coords, seg_grid=None):
+    """Scalar projection of one stop (fallback when NumPy is missing).
+    Returns (dist, seg_idx, t, proj_lon, proj_lat, is_right, cross_dist)."""
+    dist, seg_idx, t, proj_lon, proj_lat = find_nearest_segment(
+        stop["lon"], stop["lat"], route_coords, seg_grid
+    )
+    if dist > BUFFER_M:
+        return dist, seg_idx, t, proj_lon, proj_lat, False, float('inf')
+
+    right, cross_dist = is_right_side(
+        stop["lon"], stop["lat"],
+        route_coords[seg_idx],
+        route_coords[min(seg_idx + 1, len(route_coords) - 1)]
+    )
+    return dist, seg_idx, t, proj_lon, proj_lat, right, cross_dist
+
+
 def order_and_deduplicate(candidates):
     """Order candidates along route and remove duplicates within MIN_SPACING_M."""
     # Sort by position along route
@@ -277,13 +356,16 @@ def generate_synthetic_stops(route_coords, target_count):
         return []
 
     # Calculate cumulative distances along route
-    cum_dist = [0.0]
-    for i in range(1, len(route_coords)):
-        d = meters_between(
-            route_coords[i-1][0], route_coords[i-1][1],
-            route_coords[i][0], route_coords[i][1]
-        )
-        cum_dist.append(cum_dist[-1] + d)
+    if HAVE_NUMPY and route_coords:
+        cum_dist = cumulative_lengths(route_coords, LON_SCALE, LAT_SCALE).tolist()
+    else:
+        cum_dist = [0.0]
+        for i in range(1, len(route_coords)):
+            d = meters_between(
+                route_coords[i-1][0], route_coords[i-1][1],
+                route_coords[i][0], route_coords[i][1]
+            )
+            cum_dist.append(cum_dist[-1] + d)
 
     total_dist = cum_dist[-1]
     if total_dist == 0:
@@ -296,41 +378,62 @@ def generate_synthetic_stops(route_coords, target_count):
     for i in range(1, target_count + 1):
         target_d = spacing * i
 
-        # Find the segment containing this distance
-        for j in range(1, len(cum_dist)):
-            if cum_dist[j] >= target_d:
-                seg_frac = (target_d - cum_dist[j-1]) / (cum_dist[j] - cum_dist[j-1]) if cum_dist[j] > cum_dist[j-1] else 0
-                lon = route_coords[j-1][0] + seg_frac * (route_coords[j][0] - route_coords[j-1][0])
-                lat = route_coords[j-1][1] + seg_frac * (route_coords[j][1] - route_coords[j-1][1])
-                stops.append({
-                    "id": 0,
-                    "lon": round(lon, 7),
-                    "lat": round(lat, 7),
-                    "name": "",
-                    "snap_distance": 0.0,
-                    "seg_idx": j - 1,
-                    "t": seg_frac,
-                    "synthetic": True,
-                })
-                break
+        # Find the segment containing this distance (first vertex at or past it)
+        j = max(1, bisect.bisect_left(cum_dist, target_d))
+        if j < len(cum_dist):
+            seg_frac = (target_d - cum_dist[j-1]) / (cum_dist[j] - cum_dist[j-1]) if cum_dist[j] > cum_dist[j-1] else 0
+            lon = route_coords[j-1][0] + seg_frac * (route_coords[j][0] - route_coords[j-1][0])
+            lat = route_coords[j-1][1] + seg_frac * (route_coords[j][1] - route_coords[j-1][1])
+            stops.append({
+                "id": 0,
+                "lon": round(lon, 7),
+                "lat": round(lat, 7),
+                "name": "",
+                "snap_distance": 0.0,
+                "seg_idx": j - 1,
+                "t": seg_frac,
+                "synthetic": True,
+            })
 
     return stops
 
 
-def build_route_through_stops(primus, stops, terminus):
+def build_route_through_stops(osrm, primus, stops, terminus, batched=True):
     """Build a complete route by OSRM routing between consecutive points.
-    primus/terminus: [lon, lat], stops: list of dicts with lon/lat.
+    osrm: OsrmClient, primus/terminus: [lon, lat], stops: list of dicts
+    with lon/lat.
+
+    In batched mode the waypoint sequence is sent as multi-waypoint /route
+    calls of OSRM_BATCH_WAYPOINTS points, consecutive chunks sharing their
+    boundary waypoint, and split back per leg. A chunk OSRM cannot route
+    falls back to per-leg requests so only the failing leg becomes a
+    straight line.
     Returns list of [lon, lat] coordinates."""
     waypoints = [primus] + [[s["lon"], s["lat"]] for s in stops] + [terminus]
-    all_coords = []
 
-    for i in range(len(waypoints) - 1):
+    # One geometry (or None) per consecutive waypoint pair
+    legs = [None] * (len(waypoints) - 1)
+    if batched:
+        step = max(1, OSRM_BATCH_WAYPOINTS - 1)
+        for start in range(0, len(legs), step):
+            chunk = waypoints[start:start + step + 1]
+            chunk_legs = osrm_route_legs(osrm, chunk)
+            if chunk_legs is not None:
+                legs[start:start + len(chunk_legs)] = chunk_legs
+            else:
+                for i in range(start, start + len(chunk) - 1):
+                    legs[i] = osrm_route(osrm, waypoints[i][0], waypoints[i][1],
+                                         waypoints[i + 1][0], waypoints[i + 1][1])
+    else:
+        for i in range(len(legs)):
+            legs[i] = osrm_route(osrm, waypoints[i][0], waypoints[i][1],
+                                 waypoints[i + 1][0], waypoints[i + 1][1])
+
+    all_coords = []
+    for i, segment in enumerate(legs):
         from_pt = waypoints[i]
         to_pt = waypoints[i + 1]
 
-        segment = osrm_route(from_pt[0], from_pt[1], to_pt[0], to_pt[1])
-        time.sleep(OSRM_DELAY)
-
         if segment:
             if all_coords:
                 # Skip first point to avoid duplicates at junctions
@@ -372,57 +475,42 @@ def build_stop_features(stops, start_index=1):
 
 # ── File processing ────────────────────────────────────────────────────────
 
-def identify_files_needing_stops():
+def identify_files_needing_stops(bundle):
     """Read manifest and identify lines/directions that need stops."""
-    with open(MANIFEST_PATH) as f:
-        manifest = json.load(f)
-
     needed = []
 
-    for line in manifest["lines"]:
-        ln = line["line_number"]
-
-        for direction in ["aller", "retour"]:
-            d = line.get(direction)
-            if not d:
-                continue
-
-            filepath = d.get("asset_path", f"{GEOJSON_DIR}/{ln}_{direction}.geojson")
-            if not os.path.exists(filepath):
-                continue
-
-            # Check if file already has stops
-            with open(filepath) as f:
-                gj = json.load(f)
-
-            has_stops = any(
-                feat.get("geometry", {}).get("type") == "Point" and
-                feat.get("properties", {}).get("type") == "stop"
-                for feat in gj.get("features", [])
-            )
+    for lf in bundle.files():
+        if not lf.exists:
+            continue
 
-            if not has_stops:
-                declared_stops = d.get("num_stops", 0)
-                needed.append({
-                    "line_number": ln,
-                    "direction": direction,
-                    "direction_name": d.get("direction", ""),
-                    "filepath": filepath,
-                    "declared_stops": declared_stops,
-                    "geojson": gj,
-                })
+        # Check if file already has stops
+        gj = lf.geojson
+        if transport_bundle.count_stops(gj) == 0:
+            needed.append({
+                "line_number": lf.line_number,
+                "direction": lf.direction,
+                "direction_name": lf.entry.get("direction", ""),
+                "filepath": lf.path,
+                "declared_stops": lf.entry.get("num_stops", 0),
+                "geojson": gj,
+            })
 
-    return needed, manifest
+    return needed, bundle.manifest
 
 
-def process_line_direction(entry, all_osm_stops, paired_stops=None):
+def process_line_direction(entry, all_osm_stops, osrm, paired_stops=None,
+                           batched=True, stop_index=None):
     """Process a single line+direction: find stops, rebuild route.
 
     Args:
         entry: dict from identify_files_needing_stops
         all_osm_stops: list of all OSM stops
+        osrm: OsrmClient (see make_osrm_client)
         paired_stops: if provided (for retour), use these stops reversed
                       instead of searching OSM again
+        batched: route through multi-waypoint OSRM calls (see
+                 build_route_through_stops)
+        stop_index: PointGrid over all_osm_stops (see build_stop_index)
 
     Returns:
         (stops_found, stop_features) or None on failure
@@ -452,7 +540,7 @@ def process_line_direction(entry, all_osm_stops, paired_stops=None):
         print(f"    Using {len(stops)} stops from aller (reversed)")
     else:
         # Filter OSM stops along route, right side
-        candidates = filter_stops_for_route(all_osm_stops, route_coords)
+        candidates = filter_stops_for_route(all_osm_stops, route_coords, stop_index)
         stops = order_and_deduplicate(candidates)
         print(f"    Found {len(stops)} OSM stops (right side, ordered)")
 
@@ -468,7 +556,7 @@ def process_line_direction(entry, all_osm_stops, paired_stops=None):
 
     # Build route through stops via OSRM
     print(f"    Routing via OSRM: Primus → {len(stops)} stops → Terminus...")
-    new_coords = build_route_through_stops(primus, stops, terminus)
+    new_coords = build_route_through_stops(osrm, primus, stops, terminus, batched=batched)
 
     if not new_coords or len(new_coords) < 2:
         print(f"    OSRM routing failed, keeping original route")
@@ -504,106 +592,181 @@ def process_line_direction(entry, all_osm_stops, paired_stops=None):
     }
 
     # Write
-    with open(filepath, "w") as f:
-        json.dump(updated_gj, f, indent=2)
+    transport_bundle.write_geojson(filepath, updated_gj)
 
     print(f"    ✓ Written {filepath}: {len(stop_features)} stops, {len(new_coords)} coords")
     return stops
 
 
-def update_manifest(manifest, processed_lines=None):
-    """Update manifest.json with actual stop counts from GeoJSON files.
-    If processed_lines is given, only update those lines (set of (line_number, direction))."""
-    for line in manifest["lines"]:
-        ln = line["line_number"]
-
-        for direction in ["aller", "retour"]:
-            d = line.get(direction)
-            if not d:
-                continue
+def checkpoint(journal, bundle, manifest, entry, stops):
+    """Journal a finished line direction, then save its stop count in the
+    manifest right away (the final update_manifest also covers journaled
+    units, should the run stop in between)."""
+    ln, direction = entry["line_number"], entry["direction"]
+    if journal is not None:
+        journal.record(unit_name(ln, direction), output=entry["filepath"],
+                       line_number=ln, direction=direction, stops=stops)
+    if bundle is not None and manifest is not None:
+        for lf in transport_bundle.line_files(manifest, GEOJSON_DIR, ln):
+            if lf.direction == direction and lf.exists:
+                lf.entry["num_stops"] = lf.num_stops
+        bundle.save_manifest(manifest)
+
+
+def process_lines(by_line, all_osm_stops, osrm, batched=True, stop_index=None,
+                  journal=None, bundle=None, manifest=None):
+    """Process every line of `by_line` ({line_number: {direction: entry}}),
+    aller first so retour can reuse its stops reversed (from the journal
+    when the aller was done by an earlier run). With a journal / a bundle
+    and its manifest, each finished direction is checkpointed as it
+    completes.
+    Returns (processed count, failed count, set of (line_number, direction))."""
+    processed = 0
+    failed = 0
+    processed_lines = set()  # Track (line_number, direction) pairs
 
-            # Skip lines not in processed set
-            if processed_lines and (ln, direction) not in processed_lines:
-                continue
+    for ln, directions in sorted(by_line.items()):
+        print(f"\n{'─' * 50}")
+        print(f"Line {ln}")
 
-            filepath = d.get("asset_path", f"{GEOJSON_DIR}/{ln}_{direction}.geojson")
-            if not os.path.exists(filepath):
-                continue
+        aller_stops = None
 
-            with open(filepath) as f:
-                gj = json.load(f)
+        # Process aller first
+        if "aller" in directions:
+            print(f"  Processing aller...")
+            result = process_line_direction(directions["aller"], all_osm_stops, osrm,
+                                            batched=batched, stop_index=stop_index)
+            if result is not None:
+                aller_stops = result
+                processed += 1
+                processed_lines.add((ln, "aller"))
+                checkpoint(journal, bundle, manifest, directions["aller"], result)
+            else:
+                failed += 1
+        elif journal is not None:
+            done = journal.get(unit_name(ln, "aller"))
+            if done is not None:
+                aller_stops = done["stops"]
+                print(f"  aller done by a previous run, reusing its {len(aller_stops)} stops")
 
-            actual_stops = sum(
-                1 for feat in gj.get("features", [])
-                if feat.get("geometry", {}).get("type") == "Point" and
-                feat.get("properties", {}).get("type") == "stop"
+        # Process retour (using aller stops reversed if available)
+        if "retour" in directions:
+            print(f"  Processing retour...")
+            result = process_line_direction(
+                directions["retour"],
+                all_osm_stops,
+                osrm,
+                paired_stops=aller_stops,
+                batched=batched,
+                stop_index=stop_index,
             )
+            if result is not None:
+                processed += 1
+                processed_lines.add((ln, "retour"))
+                checkpoint(journal, bundle, manifest, directions["retour"], result)
+            else:
+                failed += 1
 
-            d["num_stops"] = actual_stops
+    return processed, failed, processed_lines
 
-    with open(MANIFEST_PATH, "w") as f:
-        json.dump(manifest, f, indent=2)
+
+def update_manifest(bundle, manifest, processed_lines=None):
+    """Update manifest.json with actual stop counts from GeoJSON files.
+    If processed_lines is given, only update those lines (set of (line_number, direction))."""
+    for lf in transport_bundle.line_files(manifest, GEOJSON_DIR):
+        # Skip lines not in processed set
+        if processed_lines and (lf.line_number, lf.direction) not in processed_lines:
+            continue
+        if not lf.exists:
+            continue
+        lf.entry["num_stops"] = lf.num_stops
+
+    bundle.save_manifest(manifest)
 
     print(f"\n✓ Manifest updated: {MANIFEST_PATH}")
 
 
 # ── Audit ──────────────────────────────────────────────────────────────────
 
-def audit_all_lines():
-    """Audit all 95 lines for consistency."""
-    with open(MANIFEST_PATH) as f:
-        manifest = json.load(f)
+AUDIT_CSV_FIELDS = [
+    "line", "direction", "path", "exists", "stops", "manifest_stops",
+    "coords", "length_m", "largest_gap_m", "largest_gap_index",
+    "min_lon", "min_lat", "max_lon", "max_lat",
+]
+
+
+def write_audit_report(path, report):
+    """Write the audit report as CSV (one row per file) if `path` ends in
+    .csv, as JSON otherwise."""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=AUDIT_CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in report["files"]:
+                bbox = row.get("bbox") or [None] * 4
+                writer.writerow(dict(row, min_lon=bbox[0], min_lat=bbox[1],
+                                     max_lon=bbox[2], max_lat=bbox[3]))
+    else:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Audit report written: {path}")
+
+
+def audit_all_lines(bundle, report_path=None, workers=None):
+    """Audit all 95 lines for consistency.
+
+    File checks (transport_bundle.audit_file) run in a process pool of
+    `workers` processes (default: CPU count; 1 runs in-process). With
+    report_path, a JSON or CSV report is written as well."""
+    t0 = time.perf_counter()
+    files = list(bundle.files())
+    paths = [lf.path for lf in files]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(transport_bundle.audit_file, paths,
+                                    chunksize=max(1, len(paths) // (workers * 4))))
+    else:
+        results = [transport_bundle.audit_file(p) for p in paths]
 
     total_files = 0
     files_with_stops = 0
     files_without_stops = 0
     mismatches = []
     total_stops = 0
+    rows = []
 
     print("\n" + "=" * 60)
     print("AUDIT REPORT - All Transport Lines")
     print("=" * 60)
 
-    for line in manifest["lines"]:
-        ln = line["line_number"]
-
-        for direction in ["aller", "retour"]:
-            d = line.get(direction)
-            if not d:
-                continue
-
-            filepath = d.get("asset_path", f"{GEOJSON_DIR}/{ln}_{direction}.geojson")
-            total_files += 1
-
-            if not os.path.exists(filepath):
-                print(f"  MISSING: {filepath}")
-                continue
-
-            with open(filepath) as f:
-                gj = json.load(f)
-
-            actual_stops = sum(
-                1 for feat in gj.get("features", [])
-                if feat.get("geometry", {}).get("type") == "Point" and
-                feat.get("properties", {}).get("type") == "stop"
-            )
+    for lf, result in zip(files, results):
+        ln, direction = lf.line_number, lf.direction
+        total_files += 1
+        manifest_stops = lf.entry.get("num_stops", 0)
+        rows.append({"line": ln, "direction": direction, "path": lf.path,
+                     "manifest_stops": manifest_stops, **result})
 
-            manifest_stops = d.get("num_stops", 0)
-            total_stops += actual_stops
+        if not result["exists"]:
+            print(f"  MISSING: {lf.path}")
+            continue
 
-            if actual_stops > 0:
-                files_with_stops += 1
-            else:
-                files_without_stops += 1
-                print(f"  NO STOPS: {ln} {direction} (manifest says {manifest_stops})")
+        actual_stops = result["stops"]
+        total_stops += actual_stops
 
-            if actual_stops != manifest_stops:
-                mismatches.append({
-                    "line": ln,
-                    "direction": direction,
-                    "manifest": manifest_stops,
-                    "actual": actual_stops,
-                })
+        if actual_stops > 0:
+            files_with_stops += 1
+        else:
+            files_without_stops += 1
+            print(f"  NO STOPS: {ln} {direction} (manifest says {manifest_stops})")
+
+        if actual_stops != manifest_stops:
+            mismatches.append({
+                "line": ln,
+                "direction": direction,
+                "manifest": manifest_stops,
+                "actual": actual_stops,
+            })
 
     print(f"\n{'─' * 40}")
     print(f"Total files:          {total_files}")
@@ -617,7 +780,25 @@ def audit_all_lines():
         for m in mismatches:
             print(f"  {m['line']} {m['direction']}: manifest={m['manifest']}, actual={m['actual']}")
 
+    elapsed = time.perf_counter() - t0
+    print(f"Audit time:           {elapsed:.2f} s ({workers} worker(s))")
     print("=" * 60)
+
+    if report_path:
+        write_audit_report(report_path, {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed_s": round(elapsed, 3),
+            "workers": workers,
+            "summary": {
+                "total_files": total_files,
+                "files_with_stops": files_with_stops,
+                "files_without_stops": files_without_stops,
+                "total_stops": total_stops,
+                "manifest_mismatches": len(mismatches),
+            },
+            "mismatches": mismatches,
+            "files": rows,
+        })
     return files_without_stops == 0
 
 
@@ -625,10 +806,21 @@ def audit_all_lines():
 
 def main():
     args = sys.argv[1:]
+    bundle = open_bundle()
 
     # Audit mode
     if "--audit" in args:
-        ok = audit_all_lines()
+        report_path = None
+        workers = None
+        if "--report" in args:
+            idx = args.index("--report")
+            if idx + 1 < len(args):
+                report_path = args[idx + 1]
+        if "--workers" in args:
+            idx = args.index("--workers")
+            if idx + 1 < len(args):
+                workers = max(1, int(args[idx + 1]))
+        ok = audit_all_lines(bundle, report_path, workers)
         sys.exit(0 if ok else 1)
 
     # Single line mode
@@ -638,18 +830,38 @@ def main():
         if idx + 1 < len(args):
             target_line = args[idx + 1]
 
+    batched = "--per-leg" not in args
+    offline = "--offline" in args or osm_store.OFFLINE
+    # Full runs only: a --line run must not resume from, or finish, the
+    # journal of an interrupted full run.
+    journal = None
+    resumed = []
+    if target_line is None:
+        journal = open_journal("complete_missing_stops", restart="--restart" in args)
+        resumed = journal.entries()
+    if resumed:
+        print(f"Resuming: {len(resumed)} line directions done by the previous run "
+              f"({journal.path}, --restart to ignore)")
+
     # Phase 1: Fetch all OSM bus stops
-    all_osm_stops = fetch_all_bus_stops()
+    try:
+        all_osm_stops = fetch_all_bus_stops(offline)
+    except osm_store.OfflineMissError as e:
+        print(f"  {e}")
+        sys.exit(1)
+    stop_index = build_stop_index(all_osm_stops)
 
     # Phase 2: Identify files needing stops
-    needed, manifest = identify_files_needing_stops()
+    needed, manifest = identify_files_needing_stops(bundle)
 
     if target_line:
         needed = [n for n in needed if n["line_number"] == target_line]
 
     if not needed:
         print("No files need processing!")
-        audit_all_lines()
+        if journal is not None:
+            journal.finish()
+        audit_all_lines(bundle)
         return
 
     print(f"\n{len(needed)} files need stops across {len(set(n['line_number'] for n in needed))} lines")
@@ -663,49 +875,29 @@ def main():
         by_line[ln][entry["direction"]] = entry
 
     # Phase 3: Process each line
-    processed = 0
-    failed = 0
-    processed_lines = set()  # Track (line_number, direction) pairs
-
-    for ln, directions in sorted(by_line.items()):
-        print(f"\n{'─' * 50}")
-        print(f"Line {ln}")
-
-        aller_stops = None
-
-        # Process aller first
-        if "aller" in directions:
-            print(f"  Processing aller...")
-            result = process_line_direction(directions["aller"], all_osm_stops)
-            if result is not None:
-                aller_stops = result
-                processed += 1
-                processed_lines.add((ln, "aller"))
-            else:
-                failed += 1
-
-        # Process retour (using aller stops reversed if available)
-        if "retour" in directions:
-            print(f"  Processing retour...")
-            result = process_line_direction(
-                directions["retour"],
-                all_osm_stops,
-                paired_stops=aller_stops,
-            )
-            if result is not None:
-                processed += 1
-                processed_lines.add((ln, "retour"))
-            else:
-                failed += 1
+    osrm = make_osrm_client()
+    processed, failed, processed_lines = process_lines(
+        by_line, all_osm_stops, osrm, batched=batched, stop_index=stop_index,
+        journal=journal, bundle=bundle, manifest=manifest)
+    processed_lines |= {(e["line_number"], e["direction"]) for e in resumed}
 
     # Phase 4: Update manifest (only processed lines)
     print(f"\n{'─' * 50}")
-    update_manifest(manifest, processed_lines)
+    update_manifest(bundle, manifest, processed_lines)
 
     print(f"\n✓ Done: {processed} files processed, {failed} failures")
+    if journal is not None:
+        if failed:
+            print(f"  Journal kept for the next run: {journal.path}")
+        else:
+            journal.finish()
+    print(f"  OSRM: {osrm.stats['requests']} network requests"
+          + (f", {osrm.cache.summary()}" if osrm.cache is not None else ""))
+    print(f"  Bundle: {transport_bundle.stats['parsed']} JSON files parsed, "
+          f"{transport_bundle.stats['reused']} reads served from memory")
 
     # Phase 5: Audit
-    audit_all_lines()
+    audit_all_lines(bundle)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Iterative Douglas-Peucker on index ranges.
+
+The polyline is read through two coordinate sequences (xs, ys) already in
+a metric space (local metres, canvas pixels...); spans are (lo, hi) index
+pairs on an explicit stack and kept vertices are marked in a bytearray, so
+nothing is sliced or copied and long polylines cannot hit the recursion
+limit. Same splits as the textbook recursive version: a span is split at
+its first vertex of maximum distance to the chord segment while that
+distance exceeds the tolerance, with the same arithmetic as the former
+recursive octi2json.dp (distance from p to a + t*(b - a)).
+
+farthest() is the per-span step, also used on its own by
+snap_routes_to_roads.sample_coords. With NumPy installed, spans of more
+than NUMPY_MIN_SPAN vertices are measured in one array operation (same
+arithmetic; results may differ from the scalar path by float rounding
+only).
+
+Used by tools/schema/octi2json.py and scripts/snap_routes_to_roads.py.
+"""
+
+import math
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+    HAVE_NUMPY = False
+
+NUMPY_MIN_SPAN = 64   # interior vertices below which the scalar loop is faster
+
+
+def farthest(xs, ys, lo: int, hi: int) -> tuple:
+    """(distance, index) of the vertex strictly between lo and hi farthest
+    from the segment (lo, hi); the first one on ties. (-1.0, lo + 1) when
+    the span has no interior vertex."""
+    if HAVE_NUMPY and hi - lo > NUMPY_MIN_SPAN and isinstance(xs, np.ndarray):
+        return _farthest_np(xs, ys, lo, hi)
+    ax, ay = xs[lo], ys[lo]
+    dx, dy = xs[hi] - ax, ys[hi] - ay
+    len_sq = dx * dx + dy * dy
+    best, best_i = -1.0, lo + 1
+    for i in range(lo + 1, hi):
+        px, py = xs[i], ys[i]
+        t = 0.0 if len_sq == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / len_sq))
+        d = math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+        if d > best:
+            best, best_i = d, i
+    return best, best_i
+
+
+def _farthest_np(xs, ys, lo, hi):
+    ax, ay = xs[lo], ys[lo]
+    dx, dy = xs[hi] - ax, ys[hi] - ay
+    len_sq = dx * dx + dy * dy
+    px = xs[lo + 1:hi]   # views, not copies
+    py = ys[lo + 1:hi]
+    if len_sq == 0:
+        d = np.hypot(px - ax, py - ay)
+    else:
+        t = np.clip(((px - ax) * dx + (py - ay) * dy) / len_sq, 0.0, 1.0)
+        d = np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+    i = int(np.argmax(d))
+    return float(d[i]), lo + 1 + i
+
+
+def dp_mask(n: int, span_error, tol: float) -> bytearray:
+    """Keep-bitmap of n vertices: first and last kept, then every span
+    (lo, hi) whose span_error(lo, hi) = (error, index) exceeds tol is split
+    at that index."""
+    keep = bytearray(n)
+    if n == 0:
+        return keep
+    keep[0] = keep[n - 1] = 1
+    stack = [(0, n - 1)]
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo < 2:
+            continue
+        err, k = span_error(lo, hi)
+        if err > tol:
+            keep[k] = 1
+            stack.append((k, hi))
+            stack.append((lo, k))
+    return keep
+
+
+def simplify_mask(xs, ys, tol: float) -> bytearray:
+    """Douglas-Peucker keep-bitmap of the polyline (xs, ys)."""
+    if HAVE_NUMPY and len(xs) > NUMPY_MIN_SPAN:
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+    return dp_mask(len(xs), lambda lo, hi: farthest(xs, ys, lo, hi), tol)
+
+
+def simplify(pts: list, tol: float) -> list:
+    """Kept points of a [[x, y], ...] polyline (coordinates in the metric
+    of tol); polylines of fewer than 3 points come back unchanged."""
+    if len(pts) < 3:
+        return pts
+    keep = simplify_mask([p[0] for p in pts], [p[1] for p in pts], tol)
+    return [p for p, k in zip(pts, keep) if k]
@@ -14,7 +14,6 @@ sont fusionnés. Les stops sans nom sont gardés mais avec name = "" (l'app
 peut les afficher comme "Arrêt non nommé").
 """
 
-import json
 import math
 import os
 import sys
@@ -22,6 +21,10 @@ import time
 import urllib.parse
 import urllib.request
 
+from geo_index import PointGrid
+from overpass_client import read_overpass_json
+from transport_bundle import write_json
+
 OVERPASS_URLS = [
     "https://overpass.kumi.systems/api/interpreter",
     "https://z.overpass-api.de/api/interpreter",
@@ -34,6 +37,14 @@ CENTER_LAT = -18.8792
 CENTER_LNG = 47.5079
 RADIUS_METERS = 40000
 
+# Neighbour grid in local metres. Both scales UNDER-estimate the haversine
+# metres per degree anywhere in the 40 km disc, so every pair closer than
+# r is found within r of each other on the grid (exact test follows).
+GRID_CELL_M = 25.0
+GRID_LAT_SCALE = 110000.0
+GRID_LON_SCALE = GRID_LAT_SCALE * math.cos(
+    math.radians(abs(CENTER_LAT) + RADIUS_METERS / 110000.0 + 0.1))
+
 OVERPASS_QUERY = f"""
 [out:json][timeout:120];
 (
@@ -45,7 +56,9 @@ out;
 """.strip()
 
 
-def fetch_overpass(query: str, timeout: int = 180) -> dict:
+def fetch_overpass(query: str, timeout: int = 180, on_element=None) -> dict:
+    """Execute an Overpass API query, trying multiple servers.
+    With on_element, elements are streamed to it instead of returned."""
     data = urllib.parse.urlencode({"data": query}).encode("utf-8")
     for server_url in OVERPASS_URLS:
         for attempt in range(2):
@@ -53,7 +66,7 @@ def fetch_overpass(query: str, timeout: int = 180) -> dict:
                 req = urllib.request.Request(server_url, data=data)
                 req.add_header("User-Agent", "MisyBusStopsFetcher/1.0")
                 with urllib.request.urlopen(req, timeout=timeout) as resp:
-                    return json.loads(resp.read().decode("utf-8"))
+                    return read_overpass_json(resp, on_element)
             except Exception as e:
                 print(f"  {server_url} attempt {attempt+1} failed: {e}")
                 if attempt < 1:
@@ -84,62 +97,81 @@ def pick_name(tags: dict) -> str:
     return ""
 
 
+def stop_grid():
+    """Empty neighbour grid over stops, filled with PointGrid.add()."""
+    return PointGrid([], GRID_CELL_M, GRID_LON_SCALE, GRID_LAT_SCALE)
+
+
+def named_stop_grid(stops):
+    """Neighbour grid over the NAMED stops (indices = positions in `stops`)."""
+    grid = stop_grid()
+    for i, s in enumerate(stops):
+        if s["name"]:
+            grid.add(i, s["lng"], s["lat"])
+    return grid
+
+
 def main():
     print(f"Overpass query : bus stops around ({CENTER_LAT}, {CENTER_LNG})"
           f" r={RADIUS_METERS // 1000} km ...")
-    result = fetch_overpass(OVERPASS_QUERY)
-    elements = result.get("elements", [])
-    print(f"  → {len(elements)} éléments bruts reçus")
-
-    raw_stops = []
-    for el in elements:
+    # Les éléments sont traités au fil du flux : la réponse complète n'est
+    # jamais gardée en mémoire. Indexé par id pour qu'un essai relancé sur
+    # un autre serveur ne duplique rien.
+    received = set()
+    stops_by_id = {}
+
+    def on_element(el):
+        received.add((el.get("type"), el.get("id")))
         if el.get("type") != "node":
-            continue
+            return
         lat = el.get("lat")
         lng = el.get("lon")
         if lat is None or lng is None:
-            continue
+            return
         tags = el.get("tags") or {}
-        raw_stops.append(
-            {
-                "id": f"node/{el['id']}",
-                "name": pick_name(tags),
-                "lat": round(lat, 6),
-                "lng": round(lng, 6),
-                "tags": {
-                    k: v
-                    for k, v in tags.items()
-                    if k
-                    in (
-                        "highway",
-                        "public_transport",
-                        "network",
-                        "operator",
-                        "shelter",
-                        "bench",
-                        "name",
-                        "name:fr",
-                        "name:mg",
-                        "ref",
-                    )
-                },
-            }
-        )
+        stops_by_id[el["id"]] = {
+            "id": f"node/{el['id']}",
+            "name": pick_name(tags),
+            "lat": round(lat, 6),
+            "lng": round(lng, 6),
+            "tags": {
+                k: v
+                for k, v in tags.items()
+                if k
+                in (
+                    "highway",
+                    "public_transport",
+                    "network",
+                    "operator",
+                    "shelter",
+                    "bench",
+                    "name",
+                    "name:fr",
+                    "name:mg",
+                    "ref",
+                )
+            },
+        }
+
+    fetch_overpass(OVERPASS_QUERY, on_element=on_element)
+    print(f"  → {len(received)} éléments bruts reçus")
+    raw_stops = list(stops_by_id.values())
 
     print(f"  → {len(raw_stops)} nodes géolocalisés")
 
     # Étape 1 : les stops SANS nom proches (≤ 40 m) d'un stop nommé héritent
     # du nom du stop nommé le plus proche. Ça couvre le cas « OSM a un node
     # platform sans name à côté d'un stop_position nommé ».
+    t0 = time.perf_counter()
+    named_grid = named_stop_grid(raw_stops)
     inherited = 0
-    for s in raw_stops:
+    for si, s in enumerate(raw_stops):
         if s["name"]:
             continue
         closest = None
         closest_d = 40.0
-        for t in raw_stops:
-            if not t["name"]:
-                continue
+        for ti in named_grid.near(s["lng"], s["lat"], closest_d):
+            t = raw_stops[ti]
             d = haversine_m(s["lat"], s["lng"], t["lat"], t["lng"])
             if d < closest_d:
                 closest_d = d
@@ -148,7 +180,10 @@ def main():
             s["name"] = closest["name"]
             s["tags"] = dict(s.get("tags") or {}, inherited_name="true")
             inherited += 1
-    print(f"  → {inherited} stops non nommés ont hérité d'un nom proche (≤ 40 m)")
+            # Named from now on: later unnamed stops may inherit from it
+            named_grid.add(si, s["lng"], s["lat"])
+    print(f"  → {inherited} stops non nommés ont hérité d'un nom proche (≤ 40 m)"
+          f" [{(time.perf_counter() - t0) * 1000:.0f} ms]")
 
     # Étape 2 : clustering union-find des stops nommés à ≤ 25 m, puis
     # renommage de chaque cluster avec un nom commun.
@@ -171,11 +206,13 @@ def main():
         if ra != rb:
             parent[ra] = rb
 
+    t0 = time.perf_counter()
+    named_grid = named_stop_grid(raw_stops)
     for i in range(len(raw_stops)):
         if not raw_stops[i]["name"]:
             continue
-        for j in range(i + 1, len(raw_stops)):
-            if not raw_stops[j]["name"]:
+        for j in named_grid.near(raw_stops[i]["lng"], raw_stops[i]["lat"], 25):
+            if j <= i:
                 continue
             d = haversine_m(
                 raw_stops[i]["lat"], raw_stops[i]["lng"],
@@ -234,7 +271,8 @@ def main():
             if raw_stops[k]["name"] != common:
                 raw_stops[k]["name"] = common
                 composed += 1
-    print(f"  → {composed} stops ont reçu un nom composé (clusters proches)")
+    print(f"  → {composed} stops ont reçu un nom composé (clusters proches)"
+          f" [{(time.perf_counter() - t0) * 1000:.0f} ms]")
 
     # Étape 2b : nettoyage final des noms — collapse les mots dupliqués
     # consécutifs (ex: "Sampanana Sampanana Andoh…" → "Sampanana Andoh…"),
@@ -266,15 +304,17 @@ def main():
     # (même node OSM tagué à la fois bus_stop et platform, typiquement).
     # Au-delà, on GARDE les 2 stops : paire aller/retour de chaque côté de
     # la route.
+    t0 = time.perf_counter()
     dedup = []
+    kept_named = []           # stops nommés gardés, indexés par kept_grid
+    kept_grid = stop_grid()
     skipped = 0
     for stop in raw_stops:
         matched = None
         if stop["name"]:
             norm = normalize_name(stop["name"])
-            for kept in dedup:
-                if not kept["name"]:
-                    continue
+            for k in kept_grid.near(stop["lng"], stop["lat"], 10):
+                kept = kept_named[k]
                 if normalize_name(kept["name"]) != norm:
                     continue
                 d = haversine_m(stop["lat"], stop["lng"], kept["lat"], kept["lng"])
@@ -283,26 +323,29 @@ def main():
                     break
         if matched is None:
             dedup.append(stop)
+            if stop["name"]:
+                kept_grid.add(len(kept_named), stop["lng"], stop["lat"])
+                kept_named.append(stop)
         else:
             skipped += 1
-    print(f"  → {len(dedup)} après dédup stricte ({skipped} vrais doublons fusionnés)")
+    print(f"  → {len(dedup)} après dédup stricte ({skipped} vrais doublons fusionnés)"
+          f" [{(time.perf_counter() - t0) * 1000:.0f} ms]")
 
     dedup.sort(key=lambda s: (s["name"] == "", s["name"].lower(), s["lat"], s["lng"]))
 
     os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(
-            {
-                "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-                "center": {"lat": CENTER_LAT, "lng": CENTER_LNG},
-                "radius_m": RADIUS_METERS,
-                "count": len(dedup),
-                "stops": dedup,
-            },
-            f,
-            ensure_ascii=False,
-            indent=2,
-        )
+    write_json(
+        OUTPUT_PATH,
+        {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "center": {"lat": CENTER_LAT, "lng": CENTER_LNG},
+            "radius_m": RADIUS_METERS,
+            "count": len(dedup),
+            "stops": dedup,
+        },
+        ensure_ascii=False,
+        indent=2,
+    )
 
     size_kb = os.path.getsize(OUTPUT_PATH) / 1024
     named = sum(1 for s in dedup if s["name"])
@@ -3,19 +3,42 @@
 Fetch all bus route data from OpenStreetMap for Antananarivo
 and generate GeoJSON files compatible with the Misy transport app.
 
+Relations, ways and nodes are kept in the local OSM store (osm_store.py):
+later runs only download what changed since the last sync, and --offline
+runs entirely from the store snapshot. Geometry is fetched in adaptive
+batches, several at a time, across both Overpass mirrors
+(overpass_client.py).
+
 Usage:
     python3 scripts/fetch_osm_transport_lines.py
+    python3 scripts/fetch_osm_transport_lines.py --offline
+    python3 scripts/fetch_osm_transport_lines.py --restart   # ignore the journal
+
+Each generated line direction is journaled (run_journal.py), with its
+manifest row, and saved in the manifest as soon as it is written. A rerun
+after an interruption skips the journaled line directions and restores
+their manifest rows from the journal. As before, an existing GeoJSON is
+never overwritten, even if edited since (snapping, stops): only a
+journaled output that is gone is generated again.
 
 Output:
     assets/transport_lines/core/{line}_{aller|retour}.geojson
 """
 
-import json
+import functools
+import math
 import os
 import sys
 import time
-import urllib.request
-import urllib.parse
+from collections import deque
+
+import osm_store
+from geo_index import LAT_SCALE, LON_SCALE
+from osm_store import OsmStore, OfflineMissError
+from osm_tables import NodeTable, WayTable
+from overpass_client import AdaptiveBatcher, OverpassPool
+from run_journal import open_journal, unit_name
+from transport_bundle import load_json, write_geojson, write_json
 
 OVERPASS_URLS = [
     "https://maps.mail.ru/osm/tools/overpass/api/interpreter",
@@ -27,27 +50,25 @@ OUTPUT_DIR = "assets/transport_lines/core"
 BBOX = "-19.1,47.3,-18.7,47.7"
 
 
-def fetch_overpass(query: str, timeout: int = 180) -> dict:
-    """Execute an Overpass API query, trying multiple servers."""
-    data = urllib.parse.urlencode({"data": query}).encode("utf-8")
+overpass = OverpassPool(OVERPASS_URLS, user_agent="MisyTransportFetcher/1.0")
+
 
-    for server_url in OVERPASS_URLS:
-        for attempt in range(2):
-            try:
-                req = urllib.request.Request(server_url, data=data)
-                req.add_header("User-Agent", "MisyTransportFetcher/1.0")
-                with urllib.request.urlopen(req, timeout=timeout) as resp:
-                    return json.loads(resp.read().decode("utf-8"))
-            except Exception as e:
-                print(f"  {server_url} attempt {attempt+1} failed: {e}")
-                if attempt < 1:
-                    time.sleep(5)
-        print(f"  Switching server...")
-    raise RuntimeError("Failed to fetch from all Overpass API servers")
+def fetch_overpass(query: str, timeout: int = 180, on_element=None) -> dict:
+    """Execute an Overpass API query on the fastest available mirror.
+    With on_element, elements are streamed to it instead of returned."""
+    return overpass.fetch(query, timeout=timeout, on_element=on_element)
 
 
-def fetch_all_relation_tags() -> list:
+def fetch_all_relation_tags(store: OsmStore, offline: bool = False) -> list:
     """Fetch all bus route relation tags (without geometry) in Antananarivo."""
+    key = f"route_relations:{BBOX}"
+    if offline:
+        print("Loading bus route relation tags from the OSM store (offline)...")
+        ids = osm_store.stored_id_set(store, key)
+        relations = store.elements("relation", ids)
+        print(f"  Found {len(relations)} route relations")
+        return relations
+
     query = f"""
     [out:json][timeout:60];
     (
@@ -60,57 +81,63 @@ def fetch_all_relation_tags() -> list:
     print("Fetching all bus route relation tags from OSM...")
     result = fetch_overpass(query, timeout=90)
     relations = [el for el in result["elements"] if el["type"] == "relation"]
+    store.ingest(relations)
+    store.set_sync(key, osm_store.osm_base_timestamp(result) or "unknown",
+                   [rel["id"] for rel in relations])
     print(f"  Found {len(relations)} route relations")
     return relations
 
 
-def fetch_relation_geometry(relation_id: int) -> dict:
-    """Fetch full geometry (ways + nodes) for a single relation."""
-    query = f"""
-    [out:json][timeout:120];
-    relation({relation_id});
-    out body;
-    >;
-    out skel qt;
-    """
-    return fetch_overpass(query, timeout=150)
+def sync_relations_geometry(store: OsmStore, relation_ids: list) -> int:
+    """Bring relation geometry (ways + nodes) up to date in the store.
+    Returns the number of elements downloaded. Timeouts are raised rather
+    than retried so the batcher can split the batch."""
+    fetch = functools.partial(overpass.fetch, retry_timeouts=False)
+    return osm_store.sync_relations(store, relation_ids, fetch, timeout=240)
 
 
-def fetch_relations_geometry(relation_ids: list) -> dict:
-    """Fetch full geometry for a batch of relations."""
-    ids_str = ",".join(str(rid) for rid in relation_ids)
-    query = f"""
-    [out:json][timeout:180];
-    (
-      relation(id:{ids_str});
-    );
-    out body;
-    >;
-    out skel qt;
-    """
-    return fetch_overpass(query, timeout=240)
-
-
-def parse_elements(elements: list) -> tuple:
-    """Parse OSM elements into nodes, ways, and relations."""
-    nodes = {}
-    ways = {}
+def parse_elements(elements) -> tuple:
+    """Parse OSM elements (any iterable, e.g. a store closure) into compact
+    node and way tables plus the list of relations."""
+    nodes = NodeTable()
+    ways = WayTable()
     relations = []
 
     for el in elements:
         if el["type"] == "node":
-            nodes[el["id"]] = (el["lon"], el["lat"])
+            nodes.add(el["id"], el["lon"], el["lat"])
         elif el["type"] == "way":
-            ways[el["id"]] = el.get("nodes", [])
+            ways.add(el["id"], el.get("nodes", []))
         elif el["type"] == "relation":
             relations.append(el)
 
+    nodes.freeze()
+    ways.freeze()
     return nodes, ways, relations
 
 
-def extract_route_coords(relation: dict, ways: dict, nodes: dict) -> list:
-    """Extract ordered coordinates from a route relation's way members."""
-    coords = []
+def _gap_m(a, b) -> float:
+    """Approximate distance in meters between two [lon, lat] points (local
+    equirectangular, geo_index scales)."""
+    return math.hypot((a[0] - b[0]) * LON_SCALE, (a[1] - b[1]) * LAT_SCALE)
+
+
+def extract_route_coords(relation: dict, ways: WayTable, nodes: NodeTable,
+                         gaps: list = None) -> list:
+    """Extract ordered coordinates from a route relation's way members.
+
+    `ways` maps way id -> node ids and `nodes` node id -> (lon, lat)
+    (osm_tables; any mapping with `in` and `[]` works the same).
+
+    Ways are stitched onto either end of a deque, reversed as needed, so
+    the cost is linear in the route length. A way that touches neither
+    end is attached by its endpoint closest to an end of the route; each
+    such jump is appended to `gaps` (if given) as
+    {"way": way_id, "index": first point after the jump, "meters": length}.
+    """
+    coords = deque()
+    joins = []   # (way_id, signed offset from the initial head, meters)
+    head = 0     # number of coords prepended so far
     for member in relation.get("members", []):
         if member["type"] == "way" and member.get("role", "") in ("", "forward", "backward"):
             way_id = member["ref"]
@@ -127,18 +154,46 @@ def extract_route_coords(relation: dict, ways: dict, nodes: dict) -> list:
                     elif coords[-1] == way_coords[-1]:
                         coords.extend(reversed(way_coords[:-1]))
                     elif coords[0] == way_coords[-1]:
-                        coords = way_coords[:-1] + coords
+                        coords.extendleft(reversed(way_coords[:-1]))
+                        head += len(way_coords) - 1
                     elif coords[0] == way_coords[0]:
-                        coords = list(reversed(way_coords[1:])) + coords
+                        coords.extendleft(way_coords[1:])
+                        head += len(way_coords) - 1
                     else:
-                        coords.extend(way_coords)
+                        # Disconnected: attach by the closest endpoint pair
+                        options = (
+                            (_gap_m(coords[-1], way_coords[0]), 0),
+                            (_gap_m(coords[-1], way_coords[-1]), 1),
+                            (_gap_m(coords[0], way_coords[-1]), 2),
+                            (_gap_m(coords[0], way_coords[0]), 3),
+                        )
+                        meters, option = min(options)
+                        if option == 0:
+                            joins.append((way_id, len(coords) - head, meters))
+                            coords.extend(way_coords)
+                        elif option == 1:
+                            joins.append((way_id, len(coords) - head, meters))
+                            coords.extend(reversed(way_coords))
+                        elif option == 2:
+                            coords.extendleft(reversed(way_coords))
+                            head += len(way_coords)
+                            joins.append((way_id, -head + len(way_coords), meters))
+                        else:
+                            coords.extendleft(way_coords)
+                            head += len(way_coords)
+                            joins.append((way_id, -head + len(way_coords), meters))
                 else:
                     coords.extend(way_coords)
-    return coords
+    if gaps is not None:
+        for way_id, offset, meters in joins:
+            gaps.append({"way": way_id, "index": offset + head,
+                         "meters": round(meters, 1)})
+    return list(coords)
 
 
-def extract_stops(relation: dict, nodes: dict) -> list:
-    """Extract stop positions from a route relation."""
+def extract_stops(relation: dict, nodes: NodeTable) -> list:
+    """Extract stop positions from a route relation; `nodes` maps node id
+    -> (lon, lat) (a NodeTable, or any mapping with `in` and `[]`)."""
     stops = []
     seen_positions = set()
     stop_index = 0
@@ -294,31 +349,96 @@ def detect_direction(tags: dict) -> str:
     return "unknown"
 
 
+def sync_manifest_entry(line: dict, direction: str) -> bool:
+    """Point a manifest line direction at its generated GeoJSON (if any)
+    and copy the file's stop count. Returns True if asset_path changed."""
+    ln = line["line_number"]
+    d = line[direction]
+    filepath = os.path.join(OUTPUT_DIR, f"{ln}_{direction}.geojson")
+    if not os.path.exists(filepath):
+        return False
+    changed = False
+    asset_path = f"assets/transport_lines/core/{ln}_{direction}.geojson"
+    if d.get("asset_path") != asset_path:
+        d["asset_path"] = asset_path
+        changed = True
+    # Update num_stops from actual file
+    gj = load_json(filepath)
+    actual_stops = len([ft for ft in gj.get("features", []) if ft.get("properties", {}).get("type") == "stop"])
+    if actual_stops > 0:
+        d["num_stops"] = actual_stops
+    return changed
+
+
 def main():
+    offline = "--offline" in sys.argv[1:] or osm_store.OFFLINE
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    store = OsmStore(osm_store.STORE_PATH)
+    journal = open_journal("fetch_osm_transport_lines", restart="--restart" in sys.argv[1:])
 
     # Read manifest to know which lines we need
     manifest_path = "assets/transport_lines/manifest.json"
-    with open(manifest_path) as f:
-        manifest = json.load(f)
+    manifest = load_json(manifest_path)
+    lines_by_number = {line["line_number"]: line for line in manifest["lines"]}
+    bundled_now = set()   # lines pointed at their generated GeoJSON by this run
+
+    # Resume: line directions done by the interrupted run (output still in
+    # place, possibly edited by a later step) are skipped and their manifest
+    # rows restored, in case the manifest save after them was lost;
+    # journaled outputs gone since are redone.
+    resumed = {entry["unit"]: entry for entry in journal.entries()}
+    redo = journal.missing()
+    if resumed or redo:
+        print(f"Resuming: {len(resumed)} line directions done by the previous run, "
+              f"{len(redo)} to redo ({journal.path}, --restart to ignore)")
+    for line in manifest["lines"]:
+        for direction in ["aller", "retour"]:
+            entry = resumed.get(unit_name(line["line_number"], direction))
+            if entry and entry.get("row") and line.get(direction):
+                line[direction].update(entry["row"])
+                line["is_bundled"] = True
+                bundled_now.add(line["line_number"])
+    if resumed:
+        write_json(manifest_path, manifest, ensure_ascii=False)
+
+    def pending(ln, direction):
+        """Whether the GeoJSON of a line direction is still to generate."""
+        if unit_name(ln, direction) in resumed:
+            return False
+        return not os.path.exists(os.path.join(OUTPUT_DIR, f"{ln}_{direction}.geojson"))
+
+    def checkpoint(ln, direction, filepath, relation_id=None):
+        """Journal a written line direction with its manifest row, then save
+        the manifest."""
+        line = lines_by_number.get(ln)
+        row = None
+        if line and line.get(direction):
+            if sync_manifest_entry(line, direction):
+                line["is_bundled"] = True
+                bundled_now.add(ln)
+            row = {k: line[direction][k] for k in ("asset_path", "num_stops")
+                   if k in line[direction]}
+        journal.record(unit_name(ln, direction), output=filepath,
+                       relation=relation_id, row=row)
+        write_json(manifest_path, manifest, ensure_ascii=False)
 
     # Find lines that need GeoJSON
-    existing_files = set(os.listdir(OUTPUT_DIR))
     needed_lines = set()
     for line in manifest["lines"]:
         ln = line["line_number"]
         for direction in ["aller", "retour"]:
-            d = line.get(direction)
-            if d:
-                filename = f"{ln}_{direction}.geojson"
-                if filename not in existing_files:
-                    needed_lines.add(ln)
+            if line.get(direction) and pending(ln, direction):
+                needed_lines.add(ln)
 
     print(f"Lines needing GeoJSON: {len(needed_lines)}")
     print(f"  {', '.join(sorted(needed_lines))}")
 
     # Step 1: Fetch all relation tags (lightweight, no geometry)
-    all_relations = fetch_all_relation_tags()
+    try:
+        all_relations = fetch_all_relation_tags(store, offline)
+    except OfflineMissError as e:
+        print(f"  {e}")
+        sys.exit(1)
 
     # Group by normalized line number AND by base line number
     line_relations = {}  # exact osm key -> list of (direction, relation_id, tags)
@@ -459,44 +579,29 @@ def main():
 
     print(f"\nNeed to fetch geometry for {len(needed_relation_ids)} relations")
 
-    # Step 3: Fetch geometry in batches of 5
-    BATCH_SIZE = 5
-    all_nodes = {}
-    all_ways = {}
-    all_full_relations = []
-
-    for i in range(0, len(needed_relation_ids), BATCH_SIZE):
-        batch = needed_relation_ids[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(needed_relation_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-        print(f"\nFetching batch {batch_num}/{total_batches} ({len(batch)} relations)...")
-
-        try:
-            result = fetch_relations_geometry(batch)
-            nodes, ways, relations = parse_elements(result["elements"])
-            all_nodes.update(nodes)
-            all_ways.update(ways)
-            all_full_relations.extend(relations)
-            print(f"  Got {len(nodes)} nodes, {len(ways)} ways, {len(relations)} relations")
-        except Exception as e:
-            print(f"  Batch failed: {e}")
-            # Try one by one
-            for rid in batch:
-                try:
-                    print(f"  Retrying relation {rid} individually...")
-                    result = fetch_relation_geometry(rid)
-                    nodes, ways, relations = parse_elements(result["elements"])
-                    all_nodes.update(nodes)
-                    all_ways.update(ways)
-                    all_full_relations.extend(relations)
-                    print(f"    Got {len(nodes)} nodes, {len(ways)} ways")
-                except Exception as e2:
-                    print(f"    Failed: {e2}")
-
-        # Respect Overpass rate limits
-        if i + BATCH_SIZE < len(needed_relation_ids):
-            time.sleep(3)
-
+    # Step 3: Sync geometry into the OSM store (only what changed since the
+    # last run is downloaded), then read it back. Batches start at 5
+    # relations and adapt to response times; several run at once across
+    # the Overpass mirrors.
+    if offline:
+        print("\nOffline: using relation geometry from the OSM store")
+    elif needed_relation_ids:
+        print(f"\nSyncing geometry ({overpass.capacity} queries in flight max)...")
+        t0 = time.monotonic()
+        batcher = AdaptiveBatcher(
+            functools.partial(sync_relations_geometry, store),
+            workers=overpass.capacity, initial=5)
+        results, failed = batcher.run(needed_relation_ids)
+        for batch, count, elapsed in results:
+            print(f"  {len(batch)} relations: {count} changed elements in {elapsed:.1f} s")
+        print(f"  Synced {len(needed_relation_ids) - len(failed)}/{len(needed_relation_ids)} "
+              f"relations in {time.monotonic() - t0:.1f} s "
+              f"(final batch size {batcher.size})")
+        for line in overpass.summary():
+            print(f"  {line}")
+
+    all_nodes, all_ways, all_full_relations = parse_elements(
+        store.relation_closure(needed_relation_ids))
     print(f"\nTotal: {len(all_nodes)} nodes, {len(all_ways)} ways, {len(all_full_relations)} relations")
 
     # Build index of fetched relations by ID
@@ -510,20 +615,25 @@ def main():
             continue
 
         rel = rel_by_id[rid]
-        coords = extract_route_coords(rel, all_ways, all_nodes)
+        gaps = []
+        coords = extract_route_coords(rel, all_ways, all_nodes, gaps)
         stops = extract_stops(rel, all_nodes)
 
         if not coords:
             print(f"  {ln} (relation {rid}): no coordinates extracted")
             continue
+        if gaps:
+            largest = max(g["meters"] for g in gaps)
+            print(f"  {ln} (relation {rid}): {len(gaps)} disconnected way(s), "
+                  f"largest gap {largest} m")
 
         if role == "single":
             # Save as aller
             geojson = build_geojson(ln, rel.get("tags", {}).get("name", ""), coords, stops)
             filepath = os.path.join(OUTPUT_DIR, f"{ln}_aller.geojson")
-            if not os.path.exists(filepath):
-                with open(filepath, "w") as f:
-                    json.dump(geojson, f, indent=2)
+            if pending(ln, "aller"):
+                write_geojson(filepath, geojson)
+                checkpoint(ln, "aller", filepath, rid)
                 generated += 1
                 print(f"  {ln}_aller: {len(coords)} coords, {len(stops)} stops")
 
@@ -532,9 +642,9 @@ def main():
             retour_stops = list(reversed(stops))
             geojson_r = build_geojson(ln, "retour", retour_coords, retour_stops)
             filepath_r = os.path.join(OUTPUT_DIR, f"{ln}_retour.geojson")
-            if not os.path.exists(filepath_r):
-                with open(filepath_r, "w") as f:
-                    json.dump(geojson_r, f, indent=2)
+            if pending(ln, "retour"):
+                write_geojson(filepath_r, geojson_r)
+                checkpoint(ln, "retour", filepath_r, rid)
                 generated += 1
                 print(f"  {ln}_retour: {len(retour_coords)} coords, {len(retour_stops)} stops (reversed)")
         else:
@@ -542,9 +652,9 @@ def main():
             direction = role
             geojson = build_geojson(ln, rel.get("tags", {}).get("name", ""), coords, stops)
             filepath = os.path.join(OUTPUT_DIR, f"{ln}_{direction}.geojson")
-            if not os.path.exists(filepath):
-                with open(filepath, "w") as f:
-                    json.dump(geojson, f, indent=2)
+            if pending(ln, direction):
+                write_geojson(filepath, geojson)
+                checkpoint(ln, direction, filepath, rid)
                 generated += 1
                 print(f"  {ln}_{direction}: {len(coords)} coords, {len(stops)} stops")
 
@@ -555,47 +665,32 @@ def main():
         ln = line["line_number"]
         aller_path = os.path.join(OUTPUT_DIR, f"{ln}_aller.geojson")
         retour_path = os.path.join(OUTPUT_DIR, f"{ln}_retour.geojson")
-        if os.path.exists(aller_path) and not os.path.exists(retour_path) and line.get("retour"):
-            with open(aller_path) as f:
-                aller_gj = json.load(f)
+        if os.path.exists(aller_path) and line.get("retour") and pending(ln, "retour"):
+            aller_gj = load_json(aller_path)
             route_feature = aller_gj["features"][0]
             retour_coords = list(reversed(route_feature["geometry"]["coordinates"]))
             stop_features = [ft for ft in aller_gj["features"] if ft.get("properties", {}).get("type") == "stop"]
             retour_stops = list(reversed(stop_features))
             retour_gj = build_geojson(ln, "retour", retour_coords, retour_stops)
-            with open(retour_path, "w") as f:
-                json.dump(retour_gj, f, indent=2)
+            write_geojson(retour_path, retour_gj)
+            checkpoint(ln, "retour", retour_path)
             generated += 1
             print(f"  {ln}_retour: generated by reversing aller ({len(retour_coords)} coords)")
 
     # Step 6: Update manifest to mark lines as bundled
-    updated = 0
     for line in manifest["lines"]:
-        ln = line["line_number"]
         changed = False
         for direction in ["aller", "retour"]:
-            d = line.get(direction)
-            if d:
-                filepath = os.path.join(OUTPUT_DIR, f"{ln}_{direction}.geojson")
-                if os.path.exists(filepath):
-                    asset_path = f"assets/transport_lines/core/{ln}_{direction}.geojson"
-                    if d.get("asset_path") != asset_path:
-                        d["asset_path"] = asset_path
-                        changed = True
-                    # Update num_stops from actual file
-                    with open(filepath) as f:
-                        gj = json.load(f)
-                    actual_stops = len([ft for ft in gj.get("features", []) if ft.get("properties", {}).get("type") == "stop"])
-                    actual_coords = len(gj.get("features", [{}])[0].get("geometry", {}).get("coordinates", []))
-                    if actual_stops > 0:
-                        d["num_stops"] = actual_stops
+            if line.get(direction) and sync_manifest_entry(line, direction):
+                changed = True
 
         if changed:
             line["is_bundled"] = True
-            updated += 1
+            bundled_now.add(line["line_number"])
+    updated = len(bundled_now)
 
-    with open(manifest_path, "w") as f:
-        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    write_json(manifest_path, manifest, ensure_ascii=False)
+    journal.finish()
 
     print(f"\nUpdated {updated} lines in manifest (now bundled)")
 
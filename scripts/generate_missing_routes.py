@@ -16,7 +16,10 @@ import urllib.request
 import urllib.parse
 import re
 
-OSRM_URL = "https://osrm2.misy.app"
+from osrm_cache import open_default_cache
+from osrm_client import OSRM_URL, OsrmClient
+from transport_bundle import load_json, write_geojson, write_json
+
 # 🚫 Jamais l'instance publique d'OSM (sa politique d'usage interdit le trafic
 # automatisé) : on passe par la nôtre. Le Bearer vient de
 # `setting/geocoding_config` (Firestore) ou de la variable d'environnement.
@@ -151,30 +154,19 @@ def geocode_place(name: str) -> tuple:
         return None
 
 
-def osrm_route(from_coords: tuple, to_coords: tuple) -> list:
+def make_osrm_client() -> OsrmClient:
+    """Cached, rate-limited OSRM client, built by main() so that importing
+    this module opens no cache."""
+    return OsrmClient(OSRM_URL, rate=1 / 0.3, burst=1, timeout=15,
+                      user_agent="MisyTransportGeocoder/1.0",
+                      cache=open_default_cache())
+
+
+def osrm_route(osrm: OsrmClient, from_coords: tuple, to_coords: tuple) -> list:
     """Get a road route between two points via OSRM."""
     from_lat, from_lon = from_coords
     to_lat, to_lon = to_coords
-
-    url = (
-        f"{OSRM_URL}/route/v1/driving/"
-        f"{from_lon},{from_lat};{to_lon},{to_lat}"
-        f"?overview=full&geometries=geojson"
-    )
-
-    for attempt in range(3):
-        try:
-            req = urllib.request.Request(url)
-            req.add_header("User-Agent", "MisyTransportGeocoder/1.0")
-            with urllib.request.urlopen(req, timeout=15) as resp:
-                result = json.loads(resp.read().decode("utf-8"))
-
-            if result.get("code") == "Ok" and result.get("routes"):
-                return result["routes"][0]["geometry"]["coordinates"]
-        except Exception as e:
-            if attempt < 2:
-                time.sleep(2)
-    return None
+    return osrm.route([[from_lon, from_lat], [to_lon, to_lat]])
 
 
 def build_geojson(line_number: str, direction: str, coords: list) -> dict:
@@ -207,8 +199,8 @@ def build_geojson(line_number: str, direction: str, coords: list) -> dict:
 def main():
     os.makedirs(GEOJSON_DIR, exist_ok=True)
 
-    with open(MANIFEST_PATH) as f:
-        manifest = json.load(f)
+    manifest = load_json(MANIFEST_PATH)
+    osrm = make_osrm_client()
 
     generated = 0
     failed = 0
@@ -255,7 +247,7 @@ def main():
         print(f"    FROM: {from_coords} -> TO: {to_coords}")
 
         # Route via OSRM
-        route_coords = osrm_route(from_coords, to_coords)
+        route_coords = osrm_route(osrm, from_coords, to_coords)
         if not route_coords or len(route_coords) < 2:
             print(f"    OSRM routing failed!")
             failed += 1
@@ -263,8 +255,7 @@ def main():
 
         # Generate aller
         aller_gj = build_geojson(ln, from_name, route_coords)
-        with open(aller_path, "w") as f:
-            json.dump(aller_gj, f, indent=2)
+        write_geojson(aller_path, aller_gj)
         generated += 1
         print(f"    {ln}_aller: {len(route_coords)} coords")
 
@@ -272,13 +263,10 @@ def main():
         if retour_data:
             retour_coords = list(reversed(route_coords))
             retour_gj = build_geojson(ln, to_name or "retour", retour_coords)
-            with open(retour_path, "w") as f:
-                json.dump(retour_gj, f, indent=2)
+            write_geojson(retour_path, retour_gj)
             generated += 1
             print(f"    {ln}_retour: {len(retour_coords)} coords (reversed)")
 
-        time.sleep(0.3)
-
     # Update manifest
     updated = 0
     for line in manifest["lines"]:
@@ -297,11 +285,12 @@ def main():
             line["is_bundled"] = True
             updated += 1
 
-    with open(MANIFEST_PATH, "w") as f:
-        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    write_json(MANIFEST_PATH, manifest, ensure_ascii=False)
 
     print(f"\n\nGenerated {generated} GeoJSON files, {failed} failed")
     print(f"Updated {updated} lines in manifest")
+    print(f"OSRM: {osrm.stats['requests']} network requests"
+          + (f", {osrm.cache.summary()}" if osrm.cache is not None else ""))
 
     # Final check
     total = len(manifest["lines"])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Uniform-grid spatial indexes in local metres for the transport scripts.
+
+Coordinates are [lon, lat] degrees, projected to metres with a fixed
+equirectangular scale (LON_SCALE/LAT_SCALE at latitude ~-18.9, the same
+constants complete_missing_stops.py uses). Queries return *candidates*
+in ascending item order: callers still run their exact distance test,
+so results are identical to a full scan, just without visiting far items.
+
+- PointGrid   : stops (or any points) bucketed by cell
+- SegmentGrid : polyline segments registered in every cell their bbox,
+                grown by a search margin, overlaps
+"""
+
+import math
+from collections import defaultdict
+
+LON_SCALE = 105600   # meters per degree longitude (lat ~-18.9)
+LAT_SCALE = 111000   # meters per degree latitude
+
+
+class PointGrid:
+    """Grid bucket index over points, queried by radius in metres."""
+
+    def __init__(self, points, cell_m, lon_scale=LON_SCALE, lat_scale=LAT_SCALE):
+        self.cell_m = float(cell_m)
+        self.lon_scale = lon_scale
+        self.lat_scale = lat_scale
+        self.cells = defaultdict(list)
+        for i, (lon, lat) in enumerate(points):
+            self.cells[self.cell_of(lon, lat)].append(i)
+
+    def cell_of(self, lon, lat):
+        return (math.floor(lon * self.lon_scale / self.cell_m),
+                math.floor(lat * self.lat_scale / self.cell_m))
+
+    def add(self, index, lon, lat):
+        """Register one more point under `index`."""
+        self.cells[self.cell_of(lon, lat)].append(index)
+
+    def near(self, lon, lat, radius_m):
+        """Indices of points possibly within radius_m of (lon, lat)."""
+        cx, cy = self.cell_of(lon, lat)
+        r = int(math.ceil(radius_m / self.cell_m))
+        found = []
+        for gx in range(cx - r, cx + r + 1):
+            for gy in range(cy - r, cy + r + 1):
+                bucket = self.cells.get((gx, gy))
+                if bucket:
+                    found.extend(bucket)
+        found.sort()
+        return found
+
+    def in_cells(self, cells):
+        """Indices of points lying in any of the given cells."""
+        found = []
+        for cell in cells:
+            bucket = self.cells.get(cell)
+            if bucket:
+                found.extend(bucket)
+        found.sort()
+        return found
+
+
+class SegmentGrid:
+    """Grid index over the segments of one polyline.
+
+    Segment i (coords[i] -> coords[i+1]) is registered in every cell its
+    bounding box, grown by margin_m, overlaps; candidates(p) is then a
+    superset of the segments within margin_m of p.
+    """
+
+    def __init__(self, coords, cell_m, margin_m,
+                 lon_scale=LON_SCALE, lat_scale=LAT_SCALE):
+        self.cell_m = float(cell_m)
+        self.lon_scale = lon_scale
+        self.lat_scale = lat_scale
+        self.cells = defaultdict(list)
+        for i in range(len(coords) - 1):
+            ax, ay = coords[i][0] * lon_scale, coords[i][1] * lat_scale
+            bx, by = coords[i + 1][0] * lon_scale, coords[i + 1][1] * lat_scale
+            x0 = math.floor((min(ax, bx) - margin_m) / self.cell_m)
+            x1 = math.floor((max(ax, bx) + margin_m) / self.cell_m)
+            y0 = math.floor((min(ay, by) - margin_m) / self.cell_m)
+            y1 = math.floor((max(ay, by) + margin_m) / self.cell_m)
+            for gx in range(x0, x1 + 1):
+                for gy in range(y0, y1 + 1):
+                    self.cells[(gx, gy)].append(i)
+
+    def cell_of(self, lon, lat):
+        return (math.floor(lon * self.lon_scale / self.cell_m),
+                math.floor(lat * self.lat_scale / self.cell_m))
+
+    def candidates(self, lon, lat):
+        """Segment indices (ascending) that may lie within the margin."""
+        return self.cells.get(self.cell_of(lon, lat), [])
+
+    def covered_cells(self):
+        """Every cell touched by the grown segment boxes (the corridor)."""
+        return self.cells.keys()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Local OSM element store (SQLite) for the Overpass-based pipeline scripts.
+
+Nodes, ways and relations from Overpass responses are kept keyed by
+(type, id) together with their version, so later runs only ask Overpass
+for what changed:
+
+- every synced unit (a route relation, the bus stop set of a bbox…) keeps
+  the `timestamp_osm_base` of the response that filled it;
+- the next run sends a `(newer:"<timestamp>")` query for that unit and
+  only re-downloads elements edited since, then fills in any element that
+  became referenced but is not in the store yet (fetched by id);
+- in offline mode nothing is fetched: the store is a snapshot the whole
+  pipeline can run from without network.
+
+Responses are streamed into the store as they are parsed (the `fetch`
+callables take an `on_element` sink, see overpass_client.read_overpass_json),
+so a full-city download never sits in memory as one document.
+
+Elements come back Overpass-shaped ({"type", "id", "lon", "lat", "nodes",
+"members", "tags"}), so parse_elements / extract_route_coords consume
+them unchanged.
+
+The database lives at MISY_OSM_STORE (default ~/.misy/osm_store.sqlite);
+MISY_OSM_OFFLINE=1 (or the scripts' --offline flag) forbids network use.
+
+Usage:
+    python3 scripts/osm_store.py            # print store contents summary
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+STORE_PATH = os.environ.get("MISY_OSM_STORE",
+                            os.path.expanduser("~/.misy/osm_store.sqlite"))
+OFFLINE = os.environ.get("MISY_OSM_OFFLINE", "").strip() in ("1", "true", "yes")
+ID_BATCH = 500   # ids per by-id gap-filling query
+
+
+class OfflineMissError(RuntimeError):
+    """The store snapshot lacks data needed in offline mode."""
+
+
+class OsmStore:
+    """Thread-safe SQLite store of OSM elements keyed by (type, id), with
+    versions."""
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS elements ("
+            " type TEXT NOT NULL,"
+            " id INTEGER NOT NULL,"
+            " version INTEGER,"
+            " lon REAL, lat REAL,"
+            " body TEXT,"          # JSON: way node ids / relation members
+            " tags TEXT,"          # JSON object
+            " PRIMARY KEY (type, id))")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sync ("
+            " key TEXT PRIMARY KEY,"
+            " timestamp TEXT NOT NULL,"
+            " ids TEXT)")          # JSON list of member ids, when relevant
+        self._db.commit()
+
+    # ── Writing ────────────────────────────────────────────────────────────
+
+    def ingest(self, elements) -> int:
+        """Upsert Overpass elements. Complete (`out meta`) elements replace
+        the stored row unless it holds a newer version; partial outputs
+        (`out tags`, `out skel`) only overwrite the parts they carry.
+        Returns the number of rows written."""
+        with self._lock:
+            written = 0
+            for el in elements:
+                etype, eid = el.get("type"), el.get("id")
+                if etype not in ("node", "way", "relation") or eid is None:
+                    continue
+                version = el.get("version")
+                if etype == "node":
+                    body = None
+                elif etype == "way":
+                    body = json.dumps(el["nodes"]) if "nodes" in el else None
+                else:
+                    body = json.dumps(el["members"]) if "members" in el else None
+                tags = json.dumps(el["tags"], ensure_ascii=False) if "tags" in el else None
+                lon, lat = el.get("lon"), el.get("lat")
+                if (version is None and body is None and tags is None
+                        and lon is None):
+                    continue   # `out ids` element: nothing to store
+
+                row = self._db.execute(
+                    "SELECT version FROM elements WHERE type = ? AND id = ?",
+                    (etype, eid)).fetchone()
+                if row is not None and version is not None and row[0] is not None \
+                        and version < row[0]:
+                    continue
+                if row is None or version is not None:
+                    # New element, or a complete (`out meta`) one: replace
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO elements (type, id, version, lon, lat, body, tags)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (etype, eid, version, lon, lat, body, tags))
+                else:
+                    # Partial output (`out tags`, `out skel`): merge
+                    self._db.execute(
+                        "UPDATE elements SET"
+                        " lon = COALESCE(?, lon), lat = COALESCE(?, lat),"
+                        " body = COALESCE(?, body),"
+                        " tags = COALESCE(?, tags)"
+                        " WHERE type = ? AND id = ?",
+                        (lon, lat, body, tags, etype, eid))
+                written += 1
+            self._db.commit()
+            return written
+
+    def set_sync(self, key: str, timestamp: str, ids=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync (key, timestamp, ids) VALUES (?, ?, ?)",
+                (key, timestamp, json.dumps(ids) if ids is not None else None))
+            self._db.commit()
+
+    # ── Reading ────────────────────────────────────────────────────────────
+
+    def sync_state(self, key: str):
+        """(timestamp, ids) of the last sync of `key`, or (None, None)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT timestamp, ids FROM sync WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, None
+            return row[0], (json.loads(row[1]) if row[1] is not None else None)
+
+    def get(self, etype: str, eid: int) -> dict:
+        """One Overpass-shaped element, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, lon, lat, body, tags FROM elements"
+                " WHERE type = ? AND id = ?", (etype, eid)).fetchone()
+            return _element(etype, eid, row) if row else None
+
+    def elements(self, etype: str, ids) -> list:
+        """Overpass-shaped elements for the ids present in the store."""
+        with self._lock:
+            out = []
+            for chunk in _chunks(list(ids), ID_BATCH):
+                marks = ",".join("?" * len(chunk))
+                for row in self._db.execute(
+                        f"SELECT id, version, lon, lat, body, tags FROM elements"
+                        f" WHERE type = ? AND id IN ({marks})", (etype, *chunk)):
+                    out.append(_element(etype, row[0], row[1:]))
+            return out
+
+    def missing(self, etype: str, ids) -> list:
+        """Ids without a usable body (coordinates for nodes) in the store."""
+        with self._lock:
+            have = set()
+            column = "lon" if etype == "node" else "body"
+            for chunk in _chunks(list(ids), ID_BATCH):
+                marks = ",".join("?" * len(chunk))
+                have.update(r[0] for r in self._db.execute(
+                    f"SELECT id FROM elements WHERE type = ? AND id IN ({marks})"
+                    f" AND {column} IS NOT NULL", (etype, *chunk)))
+            return [i for i in ids if i not in have]
+
+    def relation_closure(self, relation_ids):
+        """Relations + member ways + their nodes + member nodes, i.e. what
+        `relation(...); out body; >; out skel qt;` returns. Yields the
+        elements; ways and nodes come in increasing id order, one chunk
+        of ids at a time."""
+        relations = self.elements("relation", relation_ids)
+        way_ids, node_ids = _member_ids(relations)
+        yield from relations
+        for chunk in _chunks(sorted(way_ids), ID_BATCH):
+            for w in sorted(self.elements("way", chunk), key=lambda el: el["id"]):
+                node_ids.update(w.get("nodes", []))
+                yield w
+        for chunk in _chunks(sorted(node_ids), ID_BATCH):
+            yield from sorted(self.elements("node", chunk), key=lambda el: el["id"])
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT type, COUNT(*) FROM elements GROUP BY type").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _element(etype, eid, row) -> dict:
+    version, lon, lat, body, tags = row
+    el = {"type": etype, "id": eid}
+    if version is not None:
+        el["version"] = version
+    if etype == "node":
+        el["lon"] = lon
+        el["lat"] = lat
+    elif etype == "way":
+        el["nodes"] = json.loads(body) if body else []
+    else:
+        el["members"] = json.loads(body) if body else []
+    if tags:
+        el["tags"] = json.loads(tags)
+    return el
+
+
+def _member_ids(relations) -> tuple:
+    way_ids, node_ids = set(), set()
+    for rel in relations:
+        for m in rel.get("members", []):
+            if m["type"] == "way":
+                way_ids.add(m["ref"])
+            elif m["type"] == "node":
+                node_ids.add(m["ref"])
+    return way_ids, node_ids
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _StreamIngest:
+    """on_element sink for fetch(): ingests streamed elements in batches,
+    counting them and remembering node ids in arrival order."""
+
+    def __init__(self, store: OsmStore):
+        self.store = store
+        self.pending = []
+        self.count = 0
+        self.node_ids = {}
+
+    def __call__(self, el):
+        self.count += 1
+        if el.get("type") == "node":
+            self.node_ids[el["id"]] = None
+        self.pending.append(el)
+        if len(self.pending) >= ID_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.store.ingest(self.pending)
+            self.pending = []
+
+
+def _fetch_into(store: OsmStore, fetch, query: str, timeout) -> tuple:
+    """Run a query streaming its elements into the store.
+    Returns (response header, sink)."""
+    sink = _StreamIngest(store)
+    result = fetch(query, timeout=timeout, on_element=sink)
+    sink.flush()
+    return result, sink
+
+
+def osm_base_timestamp(result: dict) -> str:
+    """Data timestamp of an Overpass response (what `newer:` compares to)."""
+    return result.get("osm3s", {}).get("timestamp_osm_base", "")
+
+
+# ── Incremental sync ───────────────────────────────────────────────────────
+
+def relations_query(relation_ids, since=None) -> str:
+    """Overpass query for relation geometry: full, or only what changed
+    since `since` (relations themselves are always returned with meta)."""
+    ids_str = ",".join(str(rid) for rid in relation_ids)
+    if since is None:
+        return f"""
+    [out:json][timeout:180];
+    relation(id:{ids_str});
+    out meta;
+    >;
+    out meta qt;
+    """
+    return f"""
+    [out:json][timeout:180];
+    relation(id:{ids_str})->.rels;
+    .rels out meta;
+    way(r.rels)->.ways;
+    way.ways(newer:"{since}");
+    out meta;
+    (
+      node(r.rels)(newer:"{since}");
+      node(w.ways)(newer:"{since}");
+    );
+    out meta qt;
+    """
+
+
+def fill_gaps(store: OsmStore, relation_ids, fetch, timeout=240):
+    """Fetch by id the ways/nodes referenced by stored relations but absent
+    from the store (members added to a relation, nodes added to a way)."""
+    way_ids, node_ids = _member_ids(store.elements("relation", relation_ids))
+    missing_ways = store.missing("way", way_ids)
+    for chunk in _chunks(missing_ways, ID_BATCH):
+        _fetch_into(store, fetch, f"""
+    [out:json][timeout:180];
+    way(id:{",".join(map(str, chunk))});
+    out meta;
+    node(w);
+    out meta qt;
+    """, timeout)
+    for w in store.elements("way", way_ids):
+        node_ids.update(w.get("nodes", []))
+    for chunk in _chunks(store.missing("node", node_ids), ID_BATCH):
+        _fetch_into(store, fetch, f"""
+    [out:json][timeout:180];
+    node(id:{",".join(map(str, chunk))});
+    out meta qt;
+    """, timeout)
+
+
+def relation_sync_since(store: OsmStore, relation_ids):
+    """Oldest sync timestamp of the relations, or None if any never synced."""
+    stamps = [store.sync_state(f"relation:{rid}")[0] for rid in relation_ids]
+    if not stamps or any(s is None for s in stamps):
+        return None
+    return min(stamps)
+
+
+def sync_relations(store: OsmStore, relation_ids, fetch, timeout=240) -> int:
+    """Bring the store up to date for a batch of relations (full fetch if
+    one was never synced, `newer:` query otherwise). Returns the number of
+    elements downloaded."""
+    since = relation_sync_since(store, relation_ids)
+    result, sink = _fetch_into(store, fetch, relations_query(relation_ids, since), timeout)
+    fill_gaps(store, relation_ids, fetch, timeout)
+    stamp = osm_base_timestamp(result)
+    if stamp:
+        for rid in relation_ids:
+            store.set_sync(f"relation:{rid}", stamp)
+    return sink.count
+
+
+def sync_node_set(store: OsmStore, key: str, selector: str, fetch,
+                  timeout=150) -> list:
+    """Keep a tag-selected node set (e.g. every bus stop of a bbox) in the
+    store. `selector` is an Overpass union body such as
+    'node["highway"="bus_stop"](S,W,N,E);'. The first sync downloads the
+    set with meta; later ones list current ids and download only nodes
+    edited since (plus ids the store lacks). Returns the current ids."""
+    since, _ = store.sync_state(key)
+    if since is None:
+        query = f"""
+    [out:json][timeout:120];
+    ({selector});
+    out meta;
+    """
+    else:
+        query = f"""
+    [out:json][timeout:120];
+    ({selector})->.s;
+    .s out ids;
+    node.s(newer:"{since}");
+    out meta;
+    """
+    result, sink = _fetch_into(store, fetch, query, timeout)
+    ids = list(sink.node_ids)
+    for chunk in _chunks(store.missing("node", ids), ID_BATCH):
+        _fetch_into(store, fetch, f"""
+    [out:json][timeout:120];
+    node(id:{",".join(map(str, chunk))});
+    out meta;
+    """, timeout)
+    stamp = osm_base_timestamp(result)
+    if stamp:
+        store.set_sync(key, stamp, ids)
+    return ids
+
+
+def stored_id_set(store: OsmStore, key: str) -> list:
+    """Offline counterpart of sync_node_set (or any synced id list): the ids
+    recorded at the last sync of `key`."""
+    _, ids = store.sync_state(key)
+    if ids is None:
+        raise OfflineMissError(f"{key} was never synced into {store.path}")
+    return ids
+
+
+def main():
+    store = OsmStore(STORE_PATH)
+    counts = store.counts()
+    print(f"{store.path}: " + ", ".join(
+        f"{counts.get(t, 0)} {t}s" for t in ("node", "way", "relation")))
+    rows = store._db.execute(
+        "SELECT key, timestamp FROM sync WHERE key NOT LIKE 'relation:%'"
+        " ORDER BY key").fetchall()
+    nrel = store._db.execute(
+        "SELECT COUNT(*), MIN(timestamp) FROM sync WHERE key LIKE 'relation:%'").fetchone()
+    for key, stamp in rows:
+        print(f"  {key}: synced {stamp}")
+    if nrel[0]:
+        print(f"  {nrel[0]} relations synced (oldest {nrel[1]})")
+
+
+if __name__ == "__main__":
+    main()
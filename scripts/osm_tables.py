@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Compact array-backed OSM node and way tables.
+
+A dict of (lon, lat) tuples costs ~200 bytes per node (boxed id, tuple,
+two boxed floats, hash slot); a dict of node-id lists is worse for ways.
+These tables keep the same data in flat `array.array` buffers:
+
+- NodeTable : sorted int64 ids + float64 lon / lat columns (24 B/node)
+- WayTable  : sorted int64 ids + int64 offsets into one flattened int64
+              buffer of node ids (8 B per way node + 16 B per way)
+
+Rows are appended in any order, then sorted once (freeze(), done lazily
+on first lookup, and free when rows arrive in id order as they do from
+OsmStore.relation_closure); lookups are a binary search on the id column.
+NumPy, when installed, does the sort without boxing every row. Both
+tables behave like the read-only dicts they replace (`id in table`,
+`table[id]`, len()), so extract_route_coords / extract_stops use them
+unchanged. When an id is added twice, the last row wins, as in a dict.
+"""
+
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+    HAVE_NUMPY = False
+
+
+def _sort_order(ids: array):
+    """Row order sorting `ids`, keeping only the last row of each id."""
+    if HAVE_NUMPY:
+        keys = np.frombuffer(ids, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        last = np.append(sorted_keys[1:] != sorted_keys[:-1], True)
+        return order[last]
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    keep = []
+    for k, row in enumerate(order):
+        if k + 1 < len(order) and ids[order[k + 1]] == ids[row]:
+            continue   # a later row (stable sort) has the same id
+        keep.append(row)
+    return keep
+
+
+def _take(column: array, order) -> array:
+    """New array of column[i] for i in order."""
+    if HAVE_NUMPY:
+        out = array(column.typecode)
+        out.frombytes(np.frombuffer(column, dtype=column.typecode)[order].tobytes())
+        return out
+    return array(column.typecode, (column[i] for i in order))
+
+
+class NodeTable:
+    """Node id -> (lon, lat), stored as three parallel arrays."""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lon = array("d")
+        self.lat = array("d")
+        self._sorted = True
+
+    def add(self, node_id: int, lon: float, lat: float):
+        if self._sorted and self.ids and node_id <= self.ids[-1]:
+            self._sorted = False
+        self.ids.append(node_id)
+        self.lon.append(lon)
+        self.lat.append(lat)
+
+    def freeze(self):
+        """Sort rows by id (no-op when appended in increasing order)."""
+        if self._sorted:
+            return
+        order = _sort_order(self.ids)
+        self.ids = _take(self.ids, order)
+        self.lon = _take(self.lon, order)
+        self.lat = _take(self.lat, order)
+        self._sorted = True
+
+    def index(self, node_id: int) -> int:
+        """Row of `node_id`, or -1."""
+        self.freeze()
+        i = bisect_left(self.ids, node_id)
+        return i if i < len(self.ids) and self.ids[i] == node_id else -1
+
+    def __contains__(self, node_id) -> bool:
+        return self.index(node_id) >= 0
+
+    def __getitem__(self, node_id) -> tuple:
+        i = self.index(node_id)
+        if i < 0:
+            raise KeyError(node_id)
+        return self.lon[i], self.lat[i]
+
+    def __len__(self) -> int:
+        self.freeze()
+        return len(self.ids)
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.ids, self.lon, self.lat))
+
+
+class WayTable:
+    """Way id -> list of node ids, flattened into offsets + one id buffer."""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.offsets = array("q", [0])
+        self.refs = array("q")
+        self._sorted = True
+
+    def add(self, way_id: int, node_ids):
+        if self._sorted and self.ids and way_id <= self.ids[-1]:
+            self._sorted = False
+        self.ids.append(way_id)
+        self.refs.extend(node_ids)
+        self.offsets.append(len(self.refs))
+
+    def freeze(self):
+        """Sort rows by id, rewriting the flattened buffer in that order."""
+        if self._sorted:
+            return
+        order = _sort_order(self.ids)
+        ids, offsets, refs = array("q"), array("q", [0]), array("q")
+        for i in order:
+            ids.append(self.ids[i])
+            refs.extend(self.refs[self.offsets[i]:self.offsets[i + 1]])
+            offsets.append(len(refs))
+        self.ids, self.offsets, self.refs = ids, offsets, refs
+        self._sorted = True
+
+    def index(self, way_id: int) -> int:
+        """Row of `way_id`, or -1."""
+        self.freeze()
+        i = bisect_left(self.ids, way_id)
+        return i if i < len(self.ids) and self.ids[i] == way_id else -1
+
+    def __contains__(self, way_id) -> bool:
+        return self.index(way_id) >= 0
+
+    def __getitem__(self, way_id) -> list:
+        i = self.index(way_id)
+        if i < 0:
+            raise KeyError(way_id)
+        return self.refs[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def __len__(self) -> int:
+        self.freeze()
+        return len(self.ids)
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.ids, self.offsets, self.refs))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk cache of OSRM /route responses (SQLite).
+
+Entries are content-addressed: the key is a hash of the OSRM server's
+base URL, the profile, the request options and the waypoint sequence
+rounded to COORD_PRECISION decimals (~10 cm), so the same stop-to-stop
+legs shared by aller/retour pairs or by lines on a common trunk are
+fetched once, and responses from a local or stand-in server (--osrm-url,
+bench_snapping's fake) are never replayed for another one.
+
+Eviction is by age (ttl_days) and by size (max_entries, least recently
+used first). Hit/miss counters are kept per process in `stats`.
+
+The database lives at MISY_OSRM_CACHE (default ~/.misy/osrm_cache.sqlite);
+set MISY_OSRM_CACHE=off to disable caching.
+
+Usage:
+    python3 scripts/osrm_cache.py            # print cache stats
+    python3 scripts/osrm_cache.py --clear    # drop every entry
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+CACHE_PATH = os.environ.get("MISY_OSRM_CACHE",
+                            os.path.expanduser("~/.misy/osrm_cache.sqlite"))
+COORD_PRECISION = 6
+DEFAULT_TTL_DAYS = 90
+DEFAULT_MAX_ENTRIES = 200000
+EVICT_EVERY = 500      # puts between two eviction passes
+
+
+def cache_key(coords: list, profile: str = "driving", options: str = "",
+              base_url: str = "") -> str:
+    """Content address of a waypoint sequence for a given server (base URL,
+    without trailing slash), profile and options."""
+    seq = ";".join(f"{c[0]:.{COORD_PRECISION}f},{c[1]:.{COORD_PRECISION}f}"
+                   for c in coords)
+    return hashlib.sha256(
+        f"{base_url}|{profile}|{options}|{seq}".encode("utf-8")).hexdigest()
+
+
+class OsrmCache:
+    """Thread-safe SQLite store of OSRM responses keyed by cache_key()."""
+
+    def __init__(self, path: str = CACHE_PATH, ttl_days: float = DEFAULT_TTL_DAYS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._puts = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS routes ("
+            " key TEXT PRIMARY KEY,"
+            " body BLOB NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS routes_accessed ON routes (accessed)")
+        self._db.commit()
+
+    def get(self, key: str) -> dict:
+        """Cached response for `key`, or None (expired entries count as misses)."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, created FROM routes WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE routes SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.stats["hits"] += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, key: str, response: dict):
+        """Store a response, evicting stale/excess entries periodically."""
+        body = zlib.compress(json.dumps(response, separators=(",", ":")).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO routes (key, body, created, accessed)"
+                " VALUES (?, ?, ?, ?)", (key, body, now, now))
+            self._db.commit()
+            self.stats["writes"] += 1
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        cur = self._db.execute("DELETE FROM routes WHERE created < ?", (now - self.ttl,))
+        evicted = cur.rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+        if count > self.max_entries:
+            cur = self._db.execute(
+                "DELETE FROM routes WHERE key IN ("
+                " SELECT key FROM routes ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_entries,))
+            evicted += cur.rowcount
+        self._db.commit()
+        self.stats["evicted"] += evicted
+
+    def evict(self):
+        """Run an eviction pass now."""
+        with self._lock:
+            self._evict(time.time())
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM routes")
+            self._db.commit()
+
+    def size(self) -> tuple:
+        """(entry count, total compressed bytes)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM routes").fetchone()
+        return row[0], row[1]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def summary(self) -> str:
+        s = self.stats
+        total = s["hits"] + s["misses"]
+        rate = 100.0 * s["hits"] / total if total else 0.0
+        return (f"cache {s['hits']} hits / {s['misses']} misses ({rate:.0f}%), "
+                f"{s['writes']} writes, {s['evicted']} evicted")
+
+
+def open_default_cache():
+    """The shared cache at CACHE_PATH, or None when disabled."""
+    if CACHE_PATH.strip().lower() in ("", "off", "0", "none"):
+        return None
+    return OsrmCache(CACHE_PATH)
+
+
+def main():
+    cache = open_default_cache()
+    if cache is None:
+        print("OSRM cache disabled (MISY_OSRM_CACHE=off)")
+        return
+    if "--clear" in sys.argv[1:]:
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    else:
+        cache.evict()
+    count, size = cache.size()
+    print(f"{cache.path}: {count} entries, {size / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Shared OSRM HTTP client for the transport pipeline scripts.
+
+Keeps one keep-alive HTTP connection per worker thread to OSRM_URL and
+spaces requests with a token-bucket rate limiter (no fixed sleeps), so the
+scripts can route from a bounded thread pool. Successful /route responses
+are memoised in the persistent OsrmCache (osrm_cache.py) when one is
+attached; cache hits cost neither a request nor a token.
+
+The base URL can be overridden with MISY_OSRM_URL (or the scripts'
+--osrm-url flag) to run against a local stand-in OSRM server, e.g.
+`python3 -m http.server`-style fakes replaying recorded responses.
+"""
+
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+from osrm_cache import cache_key
+
+OSRM_URL = os.environ.get("MISY_OSRM_URL", "https://osrm2.misy.app")
+DEFAULT_RATE = 20.0   # sustained requests per second
+DEFAULT_BURST = 10    # requests allowed back-to-back before throttling
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/s, at most `burst` stored."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until one token is available, then consume it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class OsrmClient:
+    """Pooled, rate-limited OSRM client (one connection per thread)."""
+
+    def __init__(self, base_url: str = OSRM_URL, rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST, timeout: float = 30,
+                 retries: int = 3, user_agent: str = "MisyTransport/1.0",
+                 cache=None):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url.rstrip("/")
+        self._scheme = parsed.scheme or "http"
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.user_agent = user_agent
+        self.limiter = TokenBucket(rate, burst)
+        self.cache = cache
+        self._local = threading.local()
+        self._conns = []
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "bytes": 0}
+
+    # ── Connection pool ────────────────────────────────────────────────────
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = (http.client.HTTPSConnection if self._scheme == "https"
+                   else http.client.HTTPConnection)
+            conn = cls(self._host, self._port, timeout=self.timeout)
+            self._local.conn = conn
+            with self._stats_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def close(self):
+        """Close every pooled connection."""
+        with self._stats_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    # ── Requests ───────────────────────────────────────────────────────────
+
+    def get_json(self, path: str) -> dict:
+        """GET `path` (relative to the base URL) and decode the JSON body.
+        Retries on network errors, reconnecting each time."""
+        last_error = None
+        for attempt in range(self.retries):
+            self.limiter.acquire()
+            conn = self._connection()
+            try:
+                conn.request("GET", self._prefix + path,
+                             headers={"User-Agent": self.user_agent})
+                resp = conn.getresponse()
+                body = resp.read()
+                self._count("requests")
+                self._count("bytes", len(body))
+                if resp.getheader("Connection", "").lower() == "close":
+                    self._drop_connection()
+                return json.loads(body.decode("utf-8"))
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                last_error = e
+                self._count("errors")
+                self._drop_connection()
+                if attempt < self.retries - 1:
+                    time.sleep(2)
+        raise RuntimeError(f"OSRM request failed: {last_error}")
+
+    def route_response(self, coords: list, profile: str = "driving",
+                       steps: bool = False) -> dict:
+        """Raw /route response for a [lon, lat] waypoint sequence."""
+        options = f"overview=full&geometries=geojson{'&steps=true' if steps else ''}"
+        key = None
+        if self.cache is not None:
+            key = cache_key(coords, profile, options, self.base_url)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        coords_str = ";".join(f"{c[0]},{c[1]}" for c in coords)
+        result = self.get_json(f"/route/v1/{profile}/{coords_str}?{options}")
+        if key is not None and result.get("code") == "Ok":
+            self.cache.put(key, result)
+        return result
+
+    def route(self, coords: list, profile: str = "driving") -> list:
+        """Route through `coords` and return the snapped [lon, lat] list,
+        or None when OSRM has no route or the request fails."""
+        try:
+            result = self.route_response(coords, profile)
+        except RuntimeError as e:
+            print(f"    OSRM error: {e}")
+            return None
+        if result.get("code") == "Ok" and result.get("routes"):
+            return result["routes"][0]["geometry"]["coordinates"]
+        print(f"    OSRM returned: {result.get('code', 'unknown')}")
+        return None
+
+    def route_legs(self, coords: list, profile: str = "driving") -> list:
+        """Route through `coords` in one request and return one [lon, lat]
+        list per leg (len(coords) - 1), split exactly at the waypoints
+        using the steps geometry, or None when OSRM has no route or the
+        request fails."""
+        try:
+            result = self.route_response(coords, profile, steps=True)
+        except RuntimeError as e:
+            print(f"    OSRM error: {e}")
+            return None
+        if result.get("code") != "Ok" or not result.get("routes"):
+            return None
+
+        legs = result["routes"][0].get("legs", [])
+        if len(legs) != len(coords) - 1:
+            return None
+
+        leg_coords = []
+        for leg in legs:
+            points = []
+            for step in leg.get("steps", []):
+                for c in step["geometry"]["coordinates"]:
+                    if not points or points[-1] != c:
+                        points.append(c)
+            if len(points) < 2:
+                points = points * 2 if points else []
+            leg_coords.append(points)
+        return leg_coords
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Overpass API client spreading queries over several mirrors.
+
+OverpassPool keeps per-mirror statistics (requests, failures, timeouts,
+bytes, smoothed latency) and sends each query to the mirror expected to
+answer first: the fastest one recently, penalised by its in-flight
+requests and failure rate. At most MAX_IN_FLIGHT queries run on one
+mirror at a time (public Overpass instances grant about two slots per
+client); extra callers wait for a slot.
+
+Responses are parsed incrementally (read_overpass_json): the body is read
+in chunks and each object of the "elements" array is decoded on its own,
+so a caller passing `on_element` receives elements as they arrive and
+never holds the raw bytes, the decoded text and the full document at
+once.
+
+AdaptiveBatcher runs id-batched queries (relation geometry syncs) a few at
+a time through a pool. The batch size grows while responses come back
+fast and is halved when a query times out, the failed batch being split
+and retried.
+"""
+
+import codecs
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+MAX_IN_FLIGHT = 2        # concurrent queries per mirror
+LATENCY_SMOOTHING = 0.3  # weight of the newest sample in the latency EWMA
+RATE_LIMIT_BACKOFF = 10  # seconds to rest a mirror after HTTP 429
+
+FAST_RESPONSE_S = 30     # batch answered faster than this: grow the batch
+SLOW_RESPONSE_S = 120    # slower than this: shrink it a little
+MIN_BATCH = 1
+MAX_BATCH = 40
+
+READ_CHUNK = 1 << 16     # bytes read from the response at a time
+_DECODER = json.JSONDecoder()
+_WS = " \t\n\r"
+_AFTER_VALUE = _WS + ",:]}"   # what may follow a complete value
+
+
+class OverpassTimeout(RuntimeError):
+    """The query exceeded the client or server time/memory limits."""
+
+
+class Mirror:
+    """One Overpass endpoint and its running statistics."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.bytes = 0
+        self.busy_s = 0.0
+        self.latency = None       # EWMA of successful response times (s)
+        self.in_flight = 0
+        self.resting_until = 0.0
+
+    def score(self) -> float:
+        """Expected wait for a new query here (lower is better)."""
+        latency = self.latency if self.latency is not None else 0.0
+        fail_rate = self.failures / self.requests if self.requests else 0.0
+        return (latency + 1.0) * (1 + self.in_flight) / max(0.1, 1.0 - fail_rate)
+
+    def record(self, elapsed: float, nbytes: int = 0, error=None):
+        self.requests += 1
+        self.busy_s += elapsed
+        if error is None:
+            self.bytes += nbytes
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += LATENCY_SMOOTHING * (elapsed - self.latency)
+        else:
+            self.failures += 1
+            if isinstance(error, OverpassTimeout):
+                self.timeouts += 1
+
+
+class _TextStream:
+    """Chunked UTF-8 text buffer over a binary stream, for raw_decode."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.nbytes = 0
+
+    def _fill(self):
+        raw = self.stream.read(READ_CHUNK)
+        if self.pos > READ_CHUNK:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        if not raw:
+            self.buf += self.decoder.decode(b"", final=True)
+            self.eof = True
+            return
+        self.nbytes += len(raw)
+        self.buf += self.decoder.decode(raw)
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at end of stream)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def take(self, allowed: str) -> str:
+        c = self.peek()
+        if not c or c not in allowed:
+            raise ValueError(f"Malformed Overpass JSON: expected one of {allowed!r}, "
+                             f"got {c!r} at byte ~{self.nbytes}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+                # A value cut by the chunk boundary can still decode
+                # ("12" of "123", "0" of "0.5"): only trust it when a
+                # delimiter follows
+                if self.eof or (end < len(self.buf) and self.buf[end] in _AFTER_VALUE):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _read_json(stream, on_element=None) -> tuple:
+    text = _TextStream(stream)
+    result = {}
+    text.take("{")
+    if text.peek() == "}":
+        text.pos += 1
+        return result, text.nbytes
+    while True:
+        key = text.value()
+        text.take(":")
+        if key == "elements" and text.peek() == "[":
+            text.pos += 1
+            elements = []
+            if text.peek() == "]":
+                text.pos += 1
+            else:
+                while True:
+                    el = text.value()
+                    if on_element is None:
+                        elements.append(el)
+                    else:
+                        on_element(el)
+                    if text.take(",]") == "]":
+                        break
+            result["elements"] = elements
+        else:
+            result[key] = text.value()
+        if text.take(",}") == "}":
+            break
+    return result, text.nbytes
+
+
+def read_overpass_json(stream, on_element=None) -> dict:
+    """Parse an Overpass JSON response incrementally from a binary stream.
+
+    Without `on_element` this returns the same dict as json.load. With it,
+    each element is passed to on_element(el) as soon as it is decoded and
+    result["elements"] stays empty; the other keys (osm3s, remark…) are
+    returned as usual.
+    """
+    return _read_json(stream, on_element)[0]
+
+
+def _is_timeout(exc) -> bool:
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return True
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code == 504
+    if isinstance(exc, urllib.error.URLError):
+        return isinstance(exc.reason, (socket.timeout, TimeoutError))
+    return False
+
+
+class OverpassPool:
+    """Latency-aware Overpass client over a list of mirror URLs."""
+
+    def __init__(self, urls, user_agent: str = "MisyTransportFetcher/1.0",
+                 max_in_flight: int = MAX_IN_FLIGHT, attempts: int = None):
+        self.mirrors = [Mirror(url) for url in urls]
+        self.user_agent = user_agent
+        self.max_in_flight = max_in_flight
+        self.attempts = attempts if attempts is not None else 2 * len(self.mirrors)
+        self._cond = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        """Queries that can run at once over all mirrors."""
+        return self.max_in_flight * len(self.mirrors)
+
+    def _acquire(self, avoid) -> Mirror:
+        """Reserve a slot on the best mirror, preferring ones not in `avoid`."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                free = [m for m in self.mirrors
+                        if m.in_flight < self.max_in_flight and m.resting_until <= now]
+                fresh = [m for m in free if m.url not in avoid]
+                pick = min(fresh or free, key=Mirror.score, default=None)
+                if pick is not None:
+                    pick.in_flight += 1
+                    return pick
+                rest = [m.resting_until - now for m in self.mirrors
+                        if m.resting_until > now]
+                self._cond.wait(timeout=min(rest) if rest else None)
+
+    def _release(self, mirror: Mirror, elapsed: float, nbytes=0, error=None):
+        with self._cond:
+            mirror.in_flight -= 1
+            mirror.record(elapsed, nbytes, error)
+            if isinstance(error, urllib.error.HTTPError) and error.code == 429:
+                mirror.resting_until = time.monotonic() + RATE_LIMIT_BACKOFF
+            self._cond.notify_all()
+
+    def _post(self, url: str, query: str, timeout: float, on_element=None) -> tuple:
+        data = urllib.parse.urlencode({"data": query}).encode("utf-8")
+        req = urllib.request.Request(url, data=data)
+        req.add_header("User-Agent", self.user_agent)
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            result, nbytes = _read_json(resp, on_element)
+        remark = result.get("remark", "")
+        if "runtime error" in remark:
+            # Overpass answers 200 with a remark when a query runs out of
+            # time or memory; the elements are then incomplete
+            if "timed out" in remark or "out of memory" in remark:
+                raise OverpassTimeout(remark)
+            raise RuntimeError(remark)
+        return result, nbytes
+
+    def fetch(self, query: str, timeout: float = 180,
+              retry_timeouts: bool = True, on_element=None) -> dict:
+        """Run `query` on the best available mirror, failing over to the
+        others. With retry_timeouts=False a timeout is raised at once as
+        OverpassTimeout, so batching callers can split the query instead.
+
+        `on_element` streams the elements (see read_overpass_json); a
+        retried query streams them again, so the sink must tolerate
+        elements it has already seen."""
+        tried = set()
+        last_error = None
+        for _ in range(self.attempts):
+            if len(tried) == len(self.mirrors):
+                tried.clear()
+            mirror = self._acquire(tried)
+            t0 = time.monotonic()
+            try:
+                result, nbytes = self._post(mirror.url, query, timeout, on_element)
+            except Exception as e:
+                if _is_timeout(e):
+                    e = OverpassTimeout(f"{mirror.url}: {e}")
+                self._release(mirror, time.monotonic() - t0, error=e)
+                print(f"  {mirror.url} failed: {e}")
+                if isinstance(e, OverpassTimeout) and not retry_timeouts:
+                    raise e
+                tried.add(mirror.url)
+                last_error = e
+                continue
+            self._release(mirror, time.monotonic() - t0, nbytes)
+            return result
+        raise RuntimeError(f"Failed to fetch from all Overpass API servers: {last_error}")
+
+    def summary(self) -> list:
+        """One line of statistics per mirror."""
+        lines = []
+        for m in self.mirrors:
+            ok = m.requests - m.failures
+            mean = m.busy_s / m.requests if m.requests else 0.0
+            lines.append(
+                f"{m.url}: {m.requests} requests ({ok} ok, {m.failures} failed, "
+                f"{m.timeouts} timeouts), mean {mean:.1f} s, "
+                f"{m.bytes / 1e6:.1f} MB")
+        return lines
+
+
+class AdaptiveBatcher:
+    """Run `work(batch)` over id batches whose size adapts to response time.
+
+    Up to `workers` batches are in flight. A batch answered within
+    FAST_RESPONSE_S grows the size by half, one slower than
+    SLOW_RESPONSE_S shrinks it by a quarter, and an OverpassTimeout caps
+    it at half the failed batch and puts that batch back split in two.
+    Other errors retry the batch as singletons; a singleton failing
+    `retries` times is given up.
+    """
+
+    def __init__(self, work, workers: int, initial: int = 5,
+                 min_size: int = MIN_BATCH, max_size: int = MAX_BATCH,
+                 retries: int = 2):
+        self.work = work
+        self.workers = max(1, workers)
+        self.size = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.retries = retries
+
+    def _adapt(self, elapsed: float, failed_size: int = 0):
+        if failed_size:
+            # Several in-flight batches may time out together: size on the
+            # failed batch, not on the current size, so they halve it once
+            self.size = max(self.min_size, min(self.size, failed_size // 2))
+        elif elapsed < FAST_RESPONSE_S:
+            self.size = min(self.max_size, self.size + max(1, self.size // 2))
+        elif elapsed > SLOW_RESPONSE_S:
+            self.size = max(self.min_size, self.size - max(1, self.size // 4))
+
+    def _timed(self, batch):
+        t0 = time.monotonic()
+        return self.work(batch), time.monotonic() - t0
+
+    def run(self, ids) -> tuple:
+        """Process every id. Returns (results per successful batch, failed ids)."""
+        pending = [[i] for i in ids]   # queue of unit batches, refilled by splits
+        attempts = {}
+        results = []
+        failed = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                while pending and len(running) < self.workers:
+                    batch = []
+                    while pending and len(batch) < self.size:
+                        batch.extend(pending.pop(0))
+                    running[pool.submit(self._timed, batch)] = batch
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = running.pop(future)
+                    try:
+                        value, elapsed = future.result()
+                    except Exception as e:
+                        timed_out = isinstance(e, OverpassTimeout)
+                        if timed_out:
+                            self._adapt(0, failed_size=len(batch))
+                        if len(batch) > 1:
+                            if timed_out:
+                                half = len(batch) // 2
+                                pending[:0] = [batch[:half], batch[half:]]
+                            else:
+                                pending[:0] = [[i] for i in batch]
+                            print(f"  Batch of {len(batch)} failed ({e}); "
+                                  f"retrying smaller (batch size now {self.size})")
+                            continue
+                        rid = batch[0]
+                        attempts[rid] = attempts.get(rid, 0) + 1
+                        if attempts[rid] < self.retries:
+                            pending.insert(0, batch)
+                        else:
+                            print(f"  {rid} failed: {e}")
+                            failed.append(rid)
+                        continue
+                    self._adapt(elapsed)
+                    results.append((batch, value, elapsed))
+        return results, failed
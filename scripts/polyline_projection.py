@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+NumPy-vectorized point-to-polyline projection.
+
+Batched equivalent of point_to_segment / find_nearest_segment /
+is_right_side from complete_missing_stops.py: every point is projected on
+every segment of the polyline in one array operation (by blocks of
+BLOCK_POINTS points to bound memory, and optionally pruned by bbox to the
+points within a search distance). The arithmetic mirrors the scalar
+functions operation for operation, so results are bit-identical.
+
+NumPy is optional: HAVE_NUMPY is False when it is not installed and
+callers keep their scalar path.
+"""
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+    HAVE_NUMPY = False
+
+LON_SCALE = 105600   # meters per degree longitude (lat ~-18.9)
+LAT_SCALE = 111000   # meters per degree latitude
+BLOCK_POINTS = 128   # points projected per array block
+CHUNK_SEGMENTS = 96  # segments per pruned run when max_dist is given
+
+
+def project_points(points, polyline, lon_scale=LON_SCALE, lat_scale=LAT_SCALE,
+                   max_dist=None):
+    """Project [lon, lat] points onto a polyline of >= 2 [lon, lat] vertices.
+
+    With max_dist (meters), the polyline is cut in runs of CHUNK_SEGMENTS
+    segments and each run is only tested against the points inside its
+    bbox grown by max_dist; points farther than max_dist from every
+    segment then come back with dist = inf.
+
+    Returns a dict of arrays, one entry per point:
+        dist      distance to the nearest segment (meters)
+        seg       index of that segment (first one on ties)
+        t         position along it, clamped to [0, 1]
+        proj_lon, proj_lat   projected point
+        cross     signed cross product against that segment
+                  (< 0 right side, > 0 left side)
+        cross_dist           perpendicular distance |cross| / seg length
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    line = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+    ax, ay = line[:-1, 0], line[:-1, 1]
+    bx, by = line[1:, 0], line[1:, 1]
+    seg_dlon = bx - ax
+    seg_dlat = by - ay
+    dx = seg_dlon * lon_scale
+    dy = seg_dlat * lat_scale
+    len_sq = dx * dx + dy * dy
+    degenerate = len_sq == 0
+    safe_len_sq = np.where(degenerate, 1.0, len_sq)
+
+    n = len(pts)
+    n_seg = len(ax)
+    out = {
+        "dist": np.full(n, np.inf), "seg": np.zeros(n, dtype=np.int64),
+        "t": np.zeros(n), "proj_lon": np.full(n, line[0, 0]),
+        "proj_lat": np.full(n, line[0, 1]),
+    }
+    chunk = n_seg if max_dist is None else CHUNK_SEGMENTS
+
+    for c0 in range(0, n_seg, chunk):
+        c1 = min(n_seg, c0 + chunk)
+        if max_dist is None:
+            idx = np.arange(n)
+        else:
+            run = line[c0:c1 + 1]
+            lo = run.min(axis=0)
+            hi = run.max(axis=0)
+            mlon = max_dist / lon_scale
+            mlat = max_dist / lat_scale
+            idx = np.nonzero((pts[:, 0] >= lo[0] - mlon) & (pts[:, 0] <= hi[0] + mlon)
+                             & (pts[:, 1] >= lo[1] - mlat) & (pts[:, 1] <= hi[1] + mlat))[0]
+        sl = slice(c0, c1)
+
+        for b0 in range(0, len(idx), BLOCK_POINTS):
+            rows = idx[b0:b0 + BLOCK_POINTS]
+            px = pts[rows, 0][:, None]
+            py = pts[rows, 1][:, None]
+            t = ((px - ax[sl]) * lon_scale * dx[sl] + (py - ay[sl]) * lat_scale * dy[sl]) / safe_len_sq[sl]
+            t = np.where(degenerate[sl], 0.0, np.clip(t, 0.0, 1.0))
+            proj_lon = ax[sl] + t * seg_dlon[sl]
+            proj_lat = ay[sl] + t * seg_dlat[sl]
+            ex = (proj_lon - px) * lon_scale
+            ey = (proj_lat - py) * lat_scale
+            dist = np.sqrt(ex * ex + ey * ey)
+
+            local = np.argmin(dist, axis=1)
+            r = np.arange(len(rows))
+            best = dist[r, local]
+            # Strict < keeps the earlier run on ties, like a sequential scan
+            better = best < out["dist"][rows]
+            upd = rows[better]
+            out["dist"][upd] = best[better]
+            out["seg"][upd] = local[better] + c0
+            out["t"][upd] = t[r, local][better]
+            out["proj_lon"][upd] = proj_lon[r, local][better]
+            out["proj_lat"][upd] = proj_lat[r, local][better]
+
+    # Side of the nearest segment (is_right_side)
+    seg = out["seg"]
+    sdx, sdy = dx[seg], dy[seg]
+    vx = (pts[:, 0] - ax[seg]) * lon_scale
+    vy = (pts[:, 1] - ay[seg]) * lat_scale
+    cross = sdx * vy - sdy * vx
+    seg_len = np.sqrt(sdx * sdx + sdy * sdy)
+    out["cross"] = cross
+    out["cross_dist"] = np.where(
+        seg_len > 0, np.abs(cross) / np.where(seg_len > 0, seg_len, 1.0), 0.0)
+
+    return out
+
+
+def cumulative_lengths(polyline, lon_scale=LON_SCALE, lat_scale=LAT_SCALE):
+    """Cumulative distance (meters) at each vertex, starting at 0."""
+    line = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+    ex = (line[1:, 0] - line[:-1, 0]) * lon_scale
+    ey = (line[1:, 1] - line[:-1, 1]) * lat_scale
+    return np.concatenate(([0.0], np.cumsum(np.sqrt(ex * ex + ey * ey))))
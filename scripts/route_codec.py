@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Compact binary encoding of a transport line GeoJSON (route + stops).
+
+Coordinates are quantised to integers (degrees * 10**precision) and stored
+as zigzag varint deltas from the previous vertex of the file, so a route
+vertex typically costs 2-3 bytes instead of ~25 bytes of JSON text. Stops
+are encoded against the same running cursor and land close to the route.
+Properties stay JSON (compact), they are a small share of the payload.
+
+Layout (all integers are unsigned LEB128 varints unless noted):
+
+    b"MRB1"                       magic + format version
+    precision                     decimals kept (6 -> 1e-6 degree, ~0.1 m)
+    len, bytes                    collection "properties" as UTF-8 JSON
+    n_features
+    per feature:
+        geometry type             1 Point, 2 LineString, 3 MultiPoint,
+                                  4 MultiLineString, 0 no geometry;
+                                  + 0x80 if the feature has other members
+        len, bytes                feature "properties" as UTF-8 JSON
+        [len, bytes]              other members ("id"…) as a JSON object
+        Point                     dx, dy (zigzag)
+        LineString / MultiPoint   n, then n x (dx, dy)
+        MultiLineString           n_parts, then per part a LineString body
+
+The decoder returns coordinates as quantised / 10**precision, which for
+input already at `precision` decimals (what transport_bundle.write_geojson
+writes) is the very same float; everything else round-trips unchanged.
+"""
+
+import json
+
+MAGIC = b"MRB1"
+DEFAULT_PRECISION = 6
+
+_GEOMETRY_CODES = {"Point": 1, "LineString": 2, "MultiPoint": 3, "MultiLineString": 4}
+_GEOMETRY_TYPES = {code: name for name, code in _GEOMETRY_CODES.items()}
+
+
+def _uvarint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _svarint(out: bytearray, value: int):
+    _uvarint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+
+
+def _blob(out: bytearray, obj):
+    raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _uvarint(out, len(raw))
+    out += raw
+
+
+class _Cursor:
+    """Running quantised position shared by every geometry of a file."""
+
+    def __init__(self, scale: int):
+        self.scale = scale
+        self.x = 0
+        self.y = 0
+
+
+def _put_points(out: bytearray, cur: _Cursor, coords):
+    scale = cur.scale
+    for c in coords:
+        x = round(c[0] * scale)
+        y = round(c[1] * scale)
+        _svarint(out, x - cur.x)
+        _svarint(out, y - cur.y)
+        cur.x, cur.y = x, y
+
+
+def encode(gj: dict, precision: int = DEFAULT_PRECISION) -> bytes:
+    """Binary form of a line GeoJSON FeatureCollection."""
+    out = bytearray(MAGIC)
+    _uvarint(out, precision)
+    _blob(out, gj.get("properties", {}))
+    features = gj.get("features", [])
+    _uvarint(out, len(features))
+    cur = _Cursor(10 ** precision)
+    for feat in features:
+        geom = feat.get("geometry")
+        gtype = geom.get("type") if geom else None
+        if geom and gtype not in _GEOMETRY_CODES:
+            raise ValueError(f"Unsupported geometry type: {gtype}")
+        code = _GEOMETRY_CODES.get(gtype, 0)
+        extra = {k: v for k, v in feat.items()
+                 if k not in ("type", "geometry", "properties")}
+        _uvarint(out, code | 0x80 if extra else code)
+        _blob(out, feat.get("properties", {}))
+        if extra:
+            _blob(out, extra)
+        if code == 1:
+            _put_points(out, cur, [geom["coordinates"]])
+        elif code in (2, 3):
+            _uvarint(out, len(geom["coordinates"]))
+            _put_points(out, cur, geom["coordinates"])
+        elif code == 4:
+            _uvarint(out, len(geom["coordinates"]))
+            for part in geom["coordinates"]:
+                _uvarint(out, len(part))
+                _put_points(out, cur, part)
+    return bytes(out)
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def uvarint(self) -> int:
+        data, pos = self.data, self.pos
+        result = shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        self.pos = pos
+        return result
+
+    def blob(self):
+        n = self.uvarint()
+        raw = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return json.loads(raw.decode("utf-8"))
+
+    def points(self, n: int, cur: _Cursor) -> list:
+        data, pos = self.data, self.pos
+        x, y = cur.x, cur.y
+        scale = cur.scale
+        coords = []
+        for _ in range(n):
+            # Two zigzag varints, inlined: this loop is the decoder's hot path
+            for axis in (0, 1):
+                v = shift = 0
+                while True:
+                    b = data[pos]
+                    pos += 1
+                    v |= (b & 0x7F) << shift
+                    if b < 0x80:
+                        break
+                    shift += 7
+                d = (v >> 1) ^ -(v & 1)
+                if axis == 0:
+                    x += d
+                else:
+                    y += d
+            coords.append([x / scale, y / scale])
+        self.pos = pos
+        cur.x, cur.y = x, y
+        return coords
+
+
+def decode(data: bytes) -> dict:
+    """GeoJSON FeatureCollection back from encode() output."""
+    if data[:4] != MAGIC:
+        raise ValueError("Not a MRB1 route file")
+    r = _Reader(data)
+    r.pos = 4
+    precision = r.uvarint()
+    properties = r.blob()
+    cur = _Cursor(10 ** precision)
+    features = []
+    for _ in range(r.uvarint()):
+        code = r.uvarint()
+        feat = {"type": "Feature", "geometry": None, "properties": r.blob()}
+        if code & 0x80:
+            feat.update(r.blob())
+            code &= 0x7F
+        if code == 1:
+            feat["geometry"] = {"type": "Point", "coordinates": r.points(1, cur)[0]}
+        elif code in (2, 3):
+            feat["geometry"] = {"type": _GEOMETRY_TYPES[code],
+                                "coordinates": r.points(r.uvarint(), cur)}
+        elif code == 4:
+            parts = [r.points(r.uvarint(), cur) for _ in range(r.uvarint())]
+            feat["geometry"] = {"type": "MultiLineString", "coordinates": parts}
+        features.append(feat)
+    return {"type": "FeatureCollection", "properties": properties, "features": features}
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Checkpoint journal for the long-running pipeline scripts.
+
+A run appends one JSON line per completed unit (a line direction such as
+"009_aller") with its output file, the output's sha256 and whatever the
+script needs to carry over (e.g. the stops chosen for an aller, reused
+reversed for its retour). Each line is flushed and fsynced before the
+run moves on, so after a crash or a network failure a restart knows what
+was done and continues from there. A unit counts as done while its output
+exists: a file edited since (e.g. by a later pipeline step) is kept, only
+a missing one is redone. A torn last line (crash mid-append) is cut off
+when the journal is opened, so the next record starts on a fresh line.
+
+The journal is removed once a run completes; --restart discards it.
+Journals live in JOURNAL_DIR (git-ignored build output).
+"""
+
+import hashlib
+import json
+import os
+import time
+
+JOURNAL_DIR = "build/journal"
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def unit_name(line_number: str, direction: str) -> str:
+    return f"{line_number}_{direction}"
+
+
+class RunJournal:
+    """Append-only JSON Lines record of completed units."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = {}
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                data = data[:data.rfind(b"\n") + 1]   # torn write of a crashed run
+                f.truncate(len(data))
+        for line in data.decode("utf-8", "replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._entries[entry["unit"]] = entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, unit: str) -> dict:
+        """Entry of a completed unit, or None (also when its output is
+        gone since it was recorded)."""
+        entry = self._entries.get(unit)
+        if entry is None:
+            return None
+        output = entry.get("output")
+        if output and not os.path.exists(output):
+            return None
+        return entry
+
+    def done(self, unit: str) -> bool:
+        return self.get(unit) is not None
+
+    def entries(self) -> list:
+        """Entries of every unit still counted as done."""
+        return [entry for entry in map(self.get, list(self._entries)) if entry]
+
+    def missing(self) -> set:
+        """Units recorded as done whose output has since gone."""
+        return {unit for unit in self._entries if not self.done(unit)}
+
+    def record(self, unit: str, output: str = None, **data):
+        """Mark `unit` done (durably) with its output file and extra data."""
+        entry = {"unit": unit, "at": time.strftime("%Y-%m-%dT%H:%M:%S"), **data}
+        if output:
+            entry["output"] = output
+            entry["sha256"] = file_sha256(output)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._entries[unit] = entry
+
+    def finish(self):
+        """Forget every unit: the run completed (or is restarted)."""
+        self._entries.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def open_journal(name: str, restart: bool = False) -> RunJournal:
+    """Journal of script `name` in JOURNAL_DIR, emptied first if `restart`."""
+    journal = RunJournal(os.path.join(JOURNAL_DIR, f"{name}.jsonl"))
+    if restart:
+        journal.finish()
+    return journal
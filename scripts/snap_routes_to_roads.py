@@ -5,193 +5,244 @@ Snap transport route GeoJSON coordinates to actual roads using OSRM.
 Takes raw OSM coordinates and routes them through OSRM to ensure they follow
 real roads instead of cutting through buildings/terrain.
 
+Files are processed by a bounded worker pool sharing keep-alive connections
+and a token-bucket rate limiter (see osrm_client.py).
+
 Usage:
     python3 scripts/snap_routes_to_roads.py
+    python3 scripts/snap_routes_to_roads.py --workers 8 --rate 20
+    python3 scripts/snap_routes_to_roads.py --waypoints 200   # denser, chunked
+    python3 scripts/snap_routes_to_roads.py --osrm-url http://127.0.0.1:5000
 """
 
+import heapq
 import json
+import math
 import os
 import sys
-import time
-import urllib.request
-import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from douglas_peucker import HAVE_NUMPY, farthest, np
+from geo_index import LAT_SCALE, LON_SCALE
+from osrm_cache import open_default_cache
+from osrm_client import OSRM_URL, DEFAULT_RATE, OsrmClient
+from transport_bundle import write_geojson
 
-OSRM_URL = "https://osrm2.misy.app"
 GEOJSON_DIR = "assets/transport_lines/core"
 MAX_WAYPOINTS_PER_REQUEST = 80
+WAYPOINT_BUDGET = MAX_WAYPOINTS_PER_REQUEST   # sampled waypoints per route (--waypoints)
+SAMPLE_TOLERANCE_M = 2.0   # deviation below which a vertex is not a turning point
+DEFAULT_WORKERS = 8
+USER_AGENT = "MisyTransportSnapper/1.0"
 
 
-def osrm_route(coords: list, retries: int = 3) -> list:
+def osrm_route(client: OsrmClient, coords: list) -> list:
     """Route through OSRM and return snapped coordinates.
 
     Args:
+        client: OsrmClient shared by the workers
         coords: list of [lon, lat] pairs
     Returns:
         list of [lon, lat] snapped to roads
     """
-    coords_str = ";".join(f"{c[0]},{c[1]}" for c in coords)
-    url = f"{OSRM_URL}/route/v1/driving/{coords_str}?overview=full&geometries=geojson"
-
-    for attempt in range(retries):
-        try:
-            req = urllib.request.Request(url)
-            req.add_header("User-Agent", "MisyTransportSnapper/1.0")
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                result = json.loads(resp.read().decode("utf-8"))
-
-            if result.get("code") == "Ok" and result.get("routes"):
-                return result["routes"][0]["geometry"]["coordinates"]
-            else:
-                print(f"    OSRM returned: {result.get('code', 'unknown')}")
-                return None
-        except Exception as e:
-            if attempt < retries - 1:
-                time.sleep(2)
-            else:
-                print(f"    OSRM error: {e}")
-                return None
-    return None
+    return client.route(coords)
 
 
 def sample_coords(coords: list, max_points: int) -> list:
-    """Sample coordinates evenly, always keeping first and last."""
-    if len(coords) <= max_points:
+    """Pick at most max_points waypoints, always keeping first and last.
+
+    Turning points go first: spans are split Douglas-Peucker style at the
+    vertex farthest from their chord, largest deviation first, so each
+    waypoint is the one that most reduces how far the sampled polyline
+    strays from the route. Once no vertex deviates by more than
+    SAMPLE_TOLERANCE_M, the remaining budget splits the longest spans so
+    long straight stretches still get waypoints.
+    """
+    n = len(coords)
+    if n <= max_points:
         return coords
 
-    # Always keep first and last, sample evenly in between
-    step = (len(coords) - 1) / (max_points - 1)
-    indices = [int(round(i * step)) for i in range(max_points)]
-    # Ensure last index is included
-    indices[-1] = len(coords) - 1
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_indices = []
-    for idx in indices:
-        if idx not in seen:
-            seen.add(idx)
-            unique_indices.append(idx)
+    # Local metres, projected once (as arrays when NumPy is available, so
+    # douglas_peucker.farthest vectorises the long spans)
+    xs = [c[0] * LON_SCALE for c in coords]
+    ys = [c[1] * LAT_SCALE for c in coords]
+    if HAVE_NUMPY:
+        xs, ys = np.asarray(xs), np.asarray(ys)
 
-    return [coords[i] for i in unique_indices]
+    def chord(lo, hi):
+        return math.hypot(xs[hi] - xs[lo], ys[hi] - ys[lo])
 
+    keep = {0, n - 1}
+    spans = []   # (-deviation, lo, hi, farthest index)
 
-def snap_route_coords(coords: list) -> list:
-    """Snap a full route to roads, splitting into chunks if needed."""
+    def push(lo, hi):
+        if hi - lo > 1:
+            d, k = farthest(xs, ys, lo, hi)
+            heapq.heappush(spans, (-d, lo, hi, k))
+
+    push(0, n - 1)
+    while spans and len(keep) < max_points:
+        if -spans[0][0] < SAMPLE_TOLERANCE_M:
+            break
+        _, lo, hi, k = heapq.heappop(spans)
+        keep.add(k)
+        push(lo, k)
+        push(k, hi)
+
+    # Fill up the budget on what is left (all nearly straight), longest first
+    flat = [(-chord(lo, hi), lo, hi) for _, lo, hi, _ in spans]
+    heapq.heapify(flat)
+    while flat and len(keep) < max_points:
+        _, lo, hi = heapq.heappop(flat)
+        mid = (lo + hi) // 2
+        keep.add(mid)
+        for a, b in ((lo, mid), (mid, hi)):
+            if b - a > 1:
+                heapq.heappush(flat, (-chord(a, b), a, b))
+
+    return [coords[i] for i in sorted(keep)]
+
+
+def snap_route_coords(client: OsrmClient, coords: list,
+                      max_waypoints: int = WAYPOINT_BUDGET) -> list:
+    """Snap a full route to roads, splitting into chunks if needed.
+
+    The route is sampled to max_waypoints (--waypoints). Past
+    MAX_WAYPOINTS_PER_REQUEST, consecutive chunks share one boundary
+    waypoint and are routed leg by leg (OsrmClient.route_legs), so the
+    geometries join exactly at that waypoint's snapped position.
+    """
     if len(coords) < 3:
         return coords
 
     # Sample to manageable number of waypoints
-    sampled = sample_coords(coords, MAX_WAYPOINTS_PER_REQUEST)
-
-    # If still too many, split into overlapping chunks
-    if len(sampled) > MAX_WAYPOINTS_PER_REQUEST:
-        chunk_size = MAX_WAYPOINTS_PER_REQUEST - 5  # overlap of 5 points
-        all_snapped = []
-        for i in range(0, len(sampled), chunk_size):
-            chunk = sampled[i:i + MAX_WAYPOINTS_PER_REQUEST]
-            if len(chunk) < 2:
-                break
-            snapped_chunk = osrm_route(chunk)
-            if snapped_chunk:
-                if all_snapped:
-                    # Skip first few points to avoid overlap
-                    all_snapped.extend(snapped_chunk[3:])
-                else:
-                    all_snapped.extend(snapped_chunk)
-            else:
-                return None
-            time.sleep(0.3)
-        return all_snapped
-    else:
-        return osrm_route(sampled)
+    sampled = sample_coords(coords, max_waypoints)
+
+    if len(sampled) <= MAX_WAYPOINTS_PER_REQUEST:
+        return osrm_route(client, sampled)
+
+    all_snapped = []
+    step = MAX_WAYPOINTS_PER_REQUEST - 1
+    for start in range(0, len(sampled) - 1, step):
+        legs = client.route_legs(sampled[start:start + step + 1])
+        if legs is None:
+            return None
+        for leg in legs:
+            for c in leg:
+                if not all_snapped or all_snapped[-1] != c:
+                    all_snapped.append(c)
+    return all_snapped
+
+
+def find_route_feature(gj: dict) -> dict:
+    """Return the route LineString feature of a line GeoJSON, or None."""
+    for feat in gj.get("features", []):
+        if feat.get("properties", {}).get("type") == "route":
+            return feat
+    return None
+
 
+def process_geojson(client: OsrmClient, filepath: str,
+                    max_waypoints: int = WAYPOINT_BUDGET) -> tuple:
+    """Process a single GeoJSON file, snapping its route to roads.
 
-def process_geojson(filepath: str) -> bool:
-    """Process a single GeoJSON file, snapping its route to roads."""
+    Returns (status, orig_count, new_count) where status is one of
+    "snapped", "skipped" (already road_snapped) or "failed".
+    """
     with open(filepath) as f:
         gj = json.load(f)
 
-    # Find the route feature
-    route_feature = None
-    for feat in gj.get("features", []):
-        if feat.get("properties", {}).get("type") == "route":
-            route_feature = feat
-            break
+    if gj.get("properties", {}).get("road_snapped"):
+        return "skipped", 0, 0
 
+    route_feature = find_route_feature(gj)
     if not route_feature:
-        return False
+        return "failed", 0, 0
 
     original_coords = route_feature["geometry"]["coordinates"]
     if len(original_coords) < 3:
-        return False
+        return "failed", len(original_coords), 0
 
     # Snap to roads
-    snapped = snap_route_coords(original_coords)
+    snapped = snap_route_coords(client, original_coords, max_waypoints)
     if not snapped or len(snapped) < 3:
-        return False
+        return "failed", len(original_coords), 0
 
     # Update the coordinates
     route_feature["geometry"]["coordinates"] = snapped
     gj["properties"]["num_coordinates"] = len(snapped)
     gj["properties"]["road_snapped"] = True
 
-    with open(filepath, "w") as f:
-        json.dump(gj, f, indent=2)
+    write_geojson(filepath, gj)
+
+    return "snapped", len(original_coords), len(snapped)
+
 
-    return True
+def parse_args(args: list) -> dict:
+    """Parse --workers / --rate / --waypoints / --osrm-url from argv."""
+    opts = {"workers": DEFAULT_WORKERS, "rate": DEFAULT_RATE,
+            "waypoints": WAYPOINT_BUDGET, "osrm_url": None}
+    for flag, key, cast in (("--workers", "workers", int),
+                            ("--rate", "rate", float),
+                            ("--waypoints", "waypoints", int),
+                            ("--osrm-url", "osrm_url", str)):
+        if flag in args:
+            idx = args.index(flag)
+            if idx + 1 < len(args):
+                opts[key] = cast(args[idx + 1])
+    return opts
 
 
 def main():
+    opts = parse_args(sys.argv[1:])
+    budget = max(2, opts["waypoints"])
+    client = OsrmClient(opts["osrm_url"] or OSRM_URL, rate=opts["rate"],
+                        user_agent=USER_AGENT,
+                        cache=open_default_cache())
+
     geojson_files = sorted([
         f for f in os.listdir(GEOJSON_DIR)
         if f.endswith(".geojson")
     ])
 
-    print(f"Found {len(geojson_files)} GeoJSON files to process")
+    print(f"Found {len(geojson_files)} GeoJSON files to process "
+          f"({opts['workers']} workers, {opts['rate']:g} req/s)")
 
     snapped = 0
     skipped = 0
     failed = 0
 
-    for i, filename in enumerate(geojson_files):
-        filepath = os.path.join(GEOJSON_DIR, filename)
-
-        # Check if already snapped
-        with open(filepath) as f:
-            gj = json.load(f)
-        if gj.get("properties", {}).get("road_snapped"):
-            skipped += 1
-            continue
-
-        # Get original coord count
-        route_feat = None
-        for feat in gj.get("features", []):
-            if feat.get("properties", {}).get("type") == "route":
-                route_feat = feat
-                break
-        orig_count = len(route_feat["geometry"]["coordinates"]) if route_feat else 0
-
-        print(f"[{i+1}/{len(geojson_files)}] {filename} ({orig_count} coords)...", end=" ", flush=True)
-
-        if process_geojson(filepath):
-            # Re-read to get new count
-            with open(filepath) as f:
-                new_gj = json.load(f)
-            new_route = None
-            for feat in new_gj.get("features", []):
-                if feat.get("properties", {}).get("type") == "route":
-                    new_route = feat
-                    break
-            new_count = len(new_route["geometry"]["coordinates"]) if new_route else 0
-            print(f"OK ({orig_count} -> {new_count} coords)")
-            snapped += 1
-        else:
-            print("FAILED")
-            failed += 1
-
-        # Rate limit
-        time.sleep(0.5)
+    with ThreadPoolExecutor(max_workers=max(1, opts["workers"])) as pool:
+        futures = {
+            pool.submit(process_geojson, client,
+                        os.path.join(GEOJSON_DIR, filename), budget): filename
+            for filename in geojson_files
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            try:
+                status, orig_count, new_count = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(geojson_files)}] {filename}: FAILED ({e})")
+                failed += 1
+                continue
+
+            if status == "skipped":
+                skipped += 1
+            elif status == "snapped":
+                print(f"[{done}/{len(geojson_files)}] {filename}: "
+                      f"OK ({orig_count} -> {new_count} coords)")
+                snapped += 1
+            else:
+                print(f"[{done}/{len(geojson_files)}] {filename} ({orig_count} coords): FAILED")
+                failed += 1
 
+    client.close()
     print(f"\nDone: {snapped} snapped, {skipped} already done, {failed} failed")
+    print(f"OSRM: {client.stats['requests']} requests, "
+          f"{client.stats['bytes'] / 1024:.0f} KB, {client.stats['errors']} errors")
+    if client.cache is not None:
+        print(f"OSRM {client.cache.summary()}")
 
 
 if __name__ == "__main__":
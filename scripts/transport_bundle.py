@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Shared loader for the transport line bundle (manifest.json + per-line
+GeoJSON files) used by the pipeline scripts.
+
+Every JSON file is parsed at most once per process: load_json memoises
+the parsed document by path and (mtime, size), and write_json refreshes
+the memo with what it wrote, so a script that writes a line and then
+audits it does not read it back. Bundle walks the manifest and hands out
+LineFile entries whose GeoJSON is only loaded when first asked for.
+
+Writes are atomic (temp file in the same directory, then rename), so an
+interrupted run never leaves a half-written file. Line GeoJSON is written
+by write_geojson: compact separators and coordinates rounded to
+GEOJSON_PRECISION decimals (1e-6 degree is ~0.1 m, far below what the
+map shows).
+
+Documents are shared between callers: mutate one only to write it back
+with write_json.
+
+Usage:
+    python3 scripts/transport_bundle.py compact                 # core/ in place
+    python3 scripts/transport_bundle.py compact assets/transport_lines_public/core
+    python3 scripts/transport_bundle.py compact --precision 5 --indent FILE...
+"""
+
+import contextlib
+import glob
+import json
+import math
+import os
+import sys
+import tempfile
+
+from geo_index import LAT_SCALE, LON_SCALE
+
+GEOJSON_DIR = "assets/transport_lines/core"
+MANIFEST_PATH = "assets/transport_lines/manifest.json"
+DIRECTIONS = ("aller", "retour")
+GEOJSON_PRECISION = 6   # decimals kept in written coordinates (~0.1 m)
+
+_memo = {}   # absolute path -> ((mtime_ns, size), document)
+stats = {"parsed": 0, "reused": 0}
+
+
+def _signature(path: str):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def load_json(path: str):
+    """Parsed JSON document at `path`, parsed again only if the file changed."""
+    key = os.path.abspath(path)
+    sig = _signature(path)
+    hit = _memo.get(key)
+    if hit is not None and hit[0] == sig:
+        stats["reused"] += 1
+        return hit[1]
+    with open(path) as f:
+        doc = json.load(f)
+    _memo[key] = (sig, doc)
+    stats["parsed"] += 1
+    return doc
+
+
+def quantize_coords(doc, precision: int):
+    """Copy of a GeoJSON document with every geometry coordinate rounded;
+    `doc` is left untouched (only the containers leading to coordinates
+    are copied, properties are shared)."""
+    def walk(c):
+        if c and isinstance(c[0], (int, float)):
+            return [round(v, precision) for v in c]
+        return [walk(part) for part in c]
+
+    def geometry(geom):
+        if geom and geom.get("coordinates") is not None:
+            return {**geom, "coordinates": walk(geom["coordinates"])}
+        return geom
+
+    features = doc.get("features")
+    if features is not None:
+        return {**doc, "features": [
+            {**f, "geometry": geometry(f["geometry"])} if f.get("geometry") else f
+            for f in features]}
+    if "geometry" in doc:
+        return {**doc, "geometry": geometry(doc["geometry"])}
+    return geometry(doc)
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = "wb", **open_kwargs):
+    """Open a temp file next to `path`; on a clean exit it is fsynced and
+    renamed over `path` (keeping its permissions), otherwise removed."""
+    directory = os.path.dirname(os.path.abspath(path))
+    perm = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.",
+                               suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, perm)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def write_json(path: str, doc, precision: int = None, compact: bool = False,
+               **dump_kwargs) -> tuple:
+    """Atomically write `doc` and memoise it. `precision` rounds GeoJSON
+    coordinates, `compact` drops all whitespace; otherwise json.dump kwargs
+    apply, indent=2 by default. Rounding works on a copy, so the caller's
+    `doc` is never modified.
+    Returns (previous size, new size) in bytes (0 if the file was new)."""
+    if precision is not None:
+        doc = quantize_coords(doc, precision)
+    if compact:
+        dump_kwargs["indent"] = None
+        dump_kwargs["separators"] = (",", ":")
+    else:
+        dump_kwargs.setdefault("indent", 2)
+    old_size = os.path.getsize(path) if os.path.exists(path) else 0
+    with atomic_open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, **dump_kwargs)
+    _memo[os.path.abspath(path)] = (_signature(path), doc)
+    return old_size, os.path.getsize(path)
+
+
+def write_geojson(path: str, gj: dict, precision: int = GEOJSON_PRECISION,
+                  compact: bool = True) -> tuple:
+    """write_json with the bundle's GeoJSON defaults (compact, quantised)."""
+    return write_json(path, gj, precision=precision, compact=compact,
+                      ensure_ascii=False)
+
+
+def forget(path: str = None):
+    """Drop the memo for `path`, or for every file."""
+    if path is None:
+        _memo.clear()
+    else:
+        _memo.pop(os.path.abspath(path), None)
+
+
+def count_stops(gj: dict) -> int:
+    """Number of stop Point features in a line GeoJSON."""
+    return sum(
+        1 for feat in gj.get("features", [])
+        if feat.get("geometry", {}).get("type") == "Point" and
+        feat.get("properties", {}).get("type") == "stop"
+    )
+
+
+def route_coords(gj: dict) -> list:
+    """Coordinates of the first LineString feature ([] if none)."""
+    for feat in gj.get("features", []):
+        if feat.get("geometry", {}).get("type") == "LineString":
+            return feat["geometry"].get("coordinates", [])
+    return []
+
+
+def audit_file(path: str) -> dict:
+    """Metrics of one line GeoJSON for the audit report (picklable, so it
+    can run in a process pool): stop and coordinate counts, bbox
+    [min_lon, min_lat, max_lon, max_lat], route length and the largest
+    gap between consecutive vertices (meters, local equirectangular)."""
+    if not os.path.exists(path):
+        return {"exists": False}
+    gj = load_json(path)
+    coords = route_coords(gj)
+    length = 0.0
+    gap, gap_index = 0.0, None
+    for i in range(1, len(coords)):
+        dx = (coords[i][0] - coords[i - 1][0]) * LON_SCALE
+        dy = (coords[i][1] - coords[i - 1][1]) * LAT_SCALE
+        d = math.sqrt(dx * dx + dy * dy)
+        length += d
+        if d > gap:
+            gap, gap_index = d, i
+    bbox = None
+    if coords:
+        lons = [c[0] for c in coords]
+        lats = [c[1] for c in coords]
+        bbox = [min(lons), min(lats), max(lons), max(lats)]
+    return {
+        "exists": True,
+        "stops": count_stops(gj),
+        "coords": len(coords),
+        "bbox": bbox,
+        "length_m": round(length, 1),
+        "largest_gap_m": round(gap, 1),
+        "largest_gap_index": gap_index,
+    }
+
+
+class LineFile:
+    """One line direction of the manifest and its (lazily loaded) GeoJSON."""
+
+    def __init__(self, line: dict, direction: str, geojson_dir: str = GEOJSON_DIR):
+        self.line = line
+        self.direction = direction
+        self.entry = line[direction]
+        self.line_number = line["line_number"]
+        self.default_path = os.path.join(
+            geojson_dir, f"{self.line_number}_{direction}.geojson")
+        self.path = self.entry.get("asset_path", self.default_path)
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    @property
+    def geojson(self) -> dict:
+        return load_json(self.path)
+
+    @property
+    def num_stops(self) -> int:
+        return count_stops(self.geojson)
+
+
+def line_files(manifest: dict, geojson_dir: str = GEOJSON_DIR,
+               line_number: str = None):
+    """LineFile for every declared direction of `manifest`, in order."""
+    for line in manifest["lines"]:
+        if line_number is not None and line["line_number"] != line_number:
+            continue
+        for direction in DIRECTIONS:
+            if line.get(direction):
+                yield LineFile(line, direction, geojson_dir)
+
+
+class Bundle:
+    """The manifest plus lazy access to each line direction's GeoJSON."""
+
+    def __init__(self, manifest_path: str = MANIFEST_PATH,
+                 geojson_dir: str = GEOJSON_DIR):
+        self.manifest_path = manifest_path
+        self.geojson_dir = geojson_dir
+
+    @property
+    def manifest(self) -> dict:
+        return load_json(self.manifest_path)
+
+    def files(self, line_number: str = None):
+        """LineFile for every declared direction, in manifest order."""
+        return line_files(self.manifest, self.geojson_dir, line_number)
+
+    def save_manifest(self, manifest: dict = None, **dump_kwargs):
+        write_json(self.manifest_path,
+                   manifest if manifest is not None else self.manifest,
+                   **dump_kwargs)
+
+
+def _max_shift_m(before: dict, after: dict) -> float:
+    """Largest vertex displacement between two versions of a line (m)."""
+    shift = 0.0
+    for a, b in zip(route_coords(before), route_coords(after)):
+        dx = (a[0] - b[0]) * LON_SCALE
+        dy = (a[1] - b[1]) * LAT_SCALE
+        shift = max(shift, math.sqrt(dx * dx + dy * dy))
+    return shift
+
+
+def compact_files(paths, precision: int = GEOJSON_PRECISION,
+                  compact: bool = True) -> tuple:
+    """Rewrite GeoJSON files with write_geojson, printing bytes saved and
+    the largest vertex shift per file. Returns (bytes before, after)."""
+    total_old = total_new = 0
+    for path in paths:
+        with open(path) as f:
+            before = json.load(f)
+        old, new = write_geojson(path, before, precision, compact)
+        total_old += old
+        total_new += new
+        shift = _max_shift_m(before, load_json(path))
+        print(f"  {os.path.basename(path)}: {old} -> {new} bytes "
+              f"(-{old - new}, max shift {shift:.3f} m)")
+    if total_old:
+        print(f"Total: {total_old} -> {total_new} bytes "
+              f"({(total_old - total_new) * 100 / total_old:.1f}% saved)")
+    return total_old, total_new
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != "compact":
+        print(__doc__)
+        return 1
+    args = args[1:]
+    precision = GEOJSON_PRECISION
+    compact = "--indent" not in args
+    if "--precision" in args:
+        idx = args.index("--precision")
+        precision = int(args[idx + 1])
+        del args[idx:idx + 2]
+    targets = [a for a in args if not a.startswith("--")] or [GEOJSON_DIR]
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            paths.extend(sorted(glob.glob(os.path.join(target, "*.geojson"))))
+        else:
+            paths.append(target)
+    compact_files(paths, precision, compact)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
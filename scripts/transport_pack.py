@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Pack the transport bundle (manifest.json, every core/*.geojson and the
+network_strands.json) into one file with a byte-offset index, so a client
+fetches the whole network once, or range-requests / mmaps single lines,
+instead of one request per line direction.
+
+Layout:
+
+    b"MPK2"                 magic + format version
+    data                    entry bytes, unchanged from the source files,
+                            appended in build order
+    index                   UTF-8 JSON: {"version": 2, "dead": bytes,
+                            "entries": {name: {"offset", "length",
+                            "sha256", "mtime_ns"}}}; offsets are absolute
+    trailer (16 bytes)      uint64 LE index offset, uint32 LE index
+                            length, b"MPK2"
+
+Entry names are paths relative to the bundle root ("manifest.json",
+"core/009_aller.geojson"), plus "network_strands.json". Reading one entry
+is two small reads (trailer, i.e. an HTTP `Range: bytes=-16`, then the
+index) and one seek, whatever the pack size; Pack keeps the index, so
+later lookups are a dict hit + seek.
+
+Building is incremental and append-only: an entry whose source has the
+same mtime and size as recorded (or, once read, the same sha256) stays
+where it is, without being read; only changed or new entries are
+appended, followed by a new index and trailer. Unchanged entries thus
+keep their offsets. The bytes left behind (replaced or removed entries,
+old indexes) are counted in "dead"; past MAX_DEAD_RATIO of the file, the
+pack is rewritten compact (atomically). An interrupted append is cut
+back to the previous trailer; a pack without a valid trailer (or an
+MPK1 pack) is rebuilt from scratch. When nothing changed the pack is
+left as is.
+
+Usage:
+    python3 scripts/transport_pack.py build
+    python3 scripts/transport_pack.py build --root assets/transport_lines --out build/core.pack
+    python3 scripts/transport_pack.py list build/transport_lines.pack
+    python3 scripts/transport_pack.py extract build/transport_lines.pack 009 aller
+    python3 scripts/transport_pack.py extract build/transport_lines.pack manifest.json
+"""
+
+import glob
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from transport_bundle import atomic_open
+
+MAGIC = b"MPK2"
+VERSION = 2
+ROOT_DIR = "assets/transport_lines_public"
+STRANDS_PATH = "web/transport_network/network_strands.json"
+PACK_PATH = "build/transport_lines.pack"
+MAX_DEAD_RATIO = 0.5   # share of dead bytes above which a build rewrites the pack
+
+_TRAILER = struct.Struct("<QI4s")
+
+
+def line_entry(line_number: str, direction: str) -> str:
+    """Entry name of a line direction's GeoJSON."""
+    return f"core/{line_number}_{direction}.geojson"
+
+
+class Pack:
+    """Read access to a pack file: the index is parsed once on open,
+    each entry is then one seek + read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._read_index()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _read_index(self):
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path}: not a transport pack (version {VERSION})")
+        self.size = self._file.seek(0, os.SEEK_END)
+        if self.size < len(MAGIC) + _TRAILER.size:
+            raise ValueError(f"{self.path}: truncated pack")
+        self._file.seek(self.size - _TRAILER.size)
+        offset, length, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if magic != MAGIC or offset + length + _TRAILER.size != self.size:
+            raise ValueError(f"{self.path}: no valid index trailer (interrupted build?)")
+        self._file.seek(offset)
+        index = json.loads(self._file.read(length).decode("utf-8"))
+        if index.get("version") != VERSION:
+            raise ValueError(f"{self.path}: unsupported pack version {index.get('version')}")
+        self.entries = index["entries"]
+        self.dead = index.get("dead", 0)
+        self.index_offset, self.index_length = offset, length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __contains__(self, name) -> bool:
+        return name in self.entries
+
+    def names(self) -> list:
+        return list(self.entries)
+
+    def byte_range(self, name: str) -> tuple:
+        """(first, last) absolute byte positions of an entry, inclusive, as
+        used in an HTTP Range header."""
+        entry = self.entries[name]
+        return entry["offset"], entry["offset"] + entry["length"] - 1
+
+    def read(self, name: str, verify: bool = False) -> bytes:
+        entry = self.entries[name]
+        self._file.seek(entry["offset"])
+        data = self._file.read(entry["length"])
+        if verify and hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise ValueError(f"{self.path}: {name} does not match its checksum")
+        return data
+
+    def load(self, name: str):
+        """Parsed JSON of an entry."""
+        return json.loads(self.read(name).decode("utf-8"))
+
+    def line(self, line_number: str, direction: str) -> dict:
+        """GeoJSON of one line direction."""
+        return self.load(line_entry(line_number, direction))
+
+
+def pack_sources(root: str = ROOT_DIR, strands_path: str = STRANDS_PATH) -> list:
+    """(entry name, source path) of everything that goes in the pack."""
+    sources = [("manifest.json", os.path.join(root, "manifest.json"))]
+    for path in sorted(glob.glob(os.path.join(root, "core", "*.geojson"))):
+        sources.append((os.path.relpath(path, root).replace(os.sep, "/"), path))
+    if strands_path and os.path.exists(strands_path):
+        sources.append(("network_strands.json", strands_path))
+    return sources
+
+
+def _write_tail(f, entries: dict, blobs: dict, dead: int):
+    """Append `blobs` (name -> bytes), then the index of `entries` (blobs'
+    offsets filled in here) and the trailer, at the current position of f."""
+    index = {}
+    for name, entry in entries.items():
+        if name in blobs:
+            entry = dict(entry, offset=f.tell())
+            f.write(blobs[name])
+        index[name] = entry
+    offset = f.tell()
+    data = json.dumps({"version": VERSION, "dead": dead, "entries": index},
+                      ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    f.write(data)
+    f.write(_TRAILER.pack(offset, len(data), MAGIC))
+
+
+def _rewrite(out_path: str, entries: dict, blobs: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with atomic_open(out_path) as f:
+        f.write(MAGIC)
+        _write_tail(f, entries, blobs, 0)
+
+
+def _append(out_path: str, entries: dict, blobs: dict, dead: int):
+    with open(out_path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        try:
+            _write_tail(f, entries, blobs, dead)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(end)   # back to the previous trailer
+            raise
+
+
+def build_pack(sources: list, out_path: str = PACK_PATH) -> dict:
+    """Bring the pack at `out_path` up to date with `sources`, appending
+    only what changed (see the module docstring). Returns counts: kept
+    (not read from the source), unchanged, changed, removed, dead bytes,
+    and written: None (up to date), "appended" or "rewritten"."""
+    try:
+        old = Pack(out_path) if os.path.exists(out_path) else None
+    except ValueError:
+        old = None   # other format or interrupted append: start over
+    counts = {"kept": 0, "unchanged": 0, "changed": 0, "removed": 0,
+              "dead": 0, "written": None}
+    entries, blobs = {}, {}   # name -> index entry; name -> bytes to write
+    try:
+        for name, path in sources:
+            st = os.stat(path)
+            prev = old.entries.get(name) if old else None
+            if prev and prev["mtime_ns"] == st.st_mtime_ns and prev["length"] == st.st_size:
+                entries[name] = prev
+                counts["kept"] += 1
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            if prev and prev["sha256"] == digest:
+                entries[name] = dict(prev, mtime_ns=st.st_mtime_ns)
+                counts["unchanged"] += 1
+            else:
+                entries[name] = {"length": len(data), "sha256": digest,
+                                 "mtime_ns": st.st_mtime_ns}
+                blobs[name] = data
+                counts["changed"] += 1
+
+        if old is None:
+            _rewrite(out_path, entries, blobs)
+            counts["written"] = "rewritten"
+            return counts
+
+        counts["removed"] = len(set(old.entries) - set(entries))
+        counts["dead"] = old.dead
+        if not (counts["changed"] or counts["removed"] or counts["unchanged"]) \
+                and list(old.entries) == list(entries):
+            return counts
+
+        dead = old.dead + old.index_length + _TRAILER.size + sum(
+            entry["length"] for name, entry in old.entries.items()
+            if name not in entries or name in blobs)
+        if dead > (old.size + sum(map(len, blobs.values()))) * MAX_DEAD_RATIO:
+            for name in entries:
+                if name not in blobs:
+                    blobs[name] = old.read(name)
+            _rewrite(out_path, entries, blobs)
+            counts["written"] = "rewritten"
+            counts["dead"] = 0
+        else:
+            _append(out_path, entries, blobs, dead)
+            counts["written"] = "appended"
+            counts["dead"] = dead
+        return counts
+    finally:
+        if old:
+            old.close()
+
+
+def _option(args: list, flag: str, default):
+    if flag in args:
+        idx = args.index(flag)
+        value = args[idx + 1]
+        del args[idx:idx + 2]
+        return value
+    return default
+
+
+def main():
+    args = sys.argv[1:]
+    command = args.pop(0) if args else None
+    if command == "build":
+        root = _option(args, "--root", ROOT_DIR)
+        strands = _option(args, "--strands", STRANDS_PATH)
+        out = _option(args, "--out", PACK_PATH)
+        counts = build_pack(pack_sources(root, strands), out)
+        total = counts["kept"] + counts["unchanged"] + counts["changed"]
+        print(f"{out}: {total} entries ({counts['changed']} changed, "
+              f"{counts['removed']} removed, {counts['kept']} kept without "
+              f"reading the source) - {counts['written'] or 'up to date'}, "
+              f"{os.path.getsize(out)} bytes ({counts['dead']} dead)")
+        return 0
+    if command == "list" and args:
+        with Pack(args[0]) as pack:
+            for name in pack.names():
+                first, last = pack.byte_range(name)
+                print(f"{first:>10} {last - first + 1:>9}  {name}")
+        return 0
+    if command == "extract" and len(args) >= 2:
+        with Pack(args[0]) as pack:
+            name = args[1] if len(args) == 2 else line_entry(args[1], args[2])
+            if name not in pack:
+                print(f"{name}: not in {args[0]}", file=sys.stderr)
+                return 1
+            sys.stdout.buffer.write(pack.read(name, verify=True))
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
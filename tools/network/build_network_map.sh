@@ -26,39 +26,14 @@ set -euo pipefail
 HERE="$(cd "$(dirname "$0")" && pwd)"
 REPO="$(cd "$HERE/../.." && pwd)"
 SCHEMA="$REPO/tools/schema"
-LOOM_BUILD="${LOOM_BUILD:-$HOME/StudioProjects/_tools/loom/build}"
-
-for bin in topo loom transitmap; do
-  [ -x "$LOOM_BUILD/$bin" ] || { echo "❌ LOOM introuvable: $LOOM_BUILD/$bin (voir tools/schema/build_schema.sh)"; exit 1; }
-done
 
 if [ "${1:-}" = "--pull" ]; then
+  shift
   echo "→ pull Firestore prod → bundle (publish-bundle)"
   (cd "$REPO" && node scripts/transport_editor_pull_cli.js publish-bundle)
 fi
 
-DESTDIR="$REPO/web/transport_network"
-mkdir -p "$DESTDIR"
-
-echo "→ bundle → graphe LOOM (ids complets, réseau entier)"
-MISY_FULL_LINE_IDS=1 python3 "$SCHEMA/misy2loom.py" > "$HERE/network_graph.json"
-
-echo "→ topo | loom (géographique, sans octi/eau)"
-cat "$HERE/network_graph.json" \
-  | "$LOOM_BUILD/topo" \
-  | "$LOOM_BUILD/loom" \
-      --same-seg-cross-pen 25 --diff-seg-cross-pen 15 \
-      --in-stat-cross-pen-same-seg 40 --in-stat-cross-pen-diff-seg 20 \
-      --sep-pen 20 --in-stat-sep-pen 30 \
-  > "$HERE/network_loom.json"
-
-echo "→ loom2strands → $DESTDIR/network_strands.json"
-python3 "$HERE/loom2strands.py" "$HERE/network_loom.json" "$DESTDIR/network_strands.json"
-
-echo "→ SVG de contrôle visuel (transitmap, géographique)"
-cat "$HERE/network_loom.json" \
-  | "$LOOM_BUILD/transitmap" -l --line-width 14 --line-spacing 4 \
-  > "$HERE/network_control.svg"
-
-echo "✓ $DESTDIR/network_strands.json + $HERE/network_control.svg (QA visuelle)"
-echo "Ensuite : ouvrir network_control.svg, puis flutter run -d chrome --dart-define=LOOM_NETWORK=true"
+# bundle → graphe (ids complets) → topo|loom → loom2strands + SVG de contrôle
+# transitmap (tools/network/network_control.svg, QA visuelle) : cf.
+# tools/schema/run_pipeline.py. Args restants passés tels quels (--cache…).
+exec python3 "$SCHEMA/run_pipeline.py" network "$@"
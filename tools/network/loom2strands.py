@@ -26,6 +26,7 @@ Pièges gérés (cf. tools/network/README.md et mémoire projet) :
     faisceau (comportement historique du runtime).
 
 Usage : loom2strands.py <network_loom.json> <network_strands.json>
+(en Python : build_strands(gj, tier1), cf. tools/schema/run_pipeline.py)
 """
 import json
 import math
@@ -57,9 +58,10 @@ def dist_m(a, b, mlng):
     return math.hypot((b[0] - a[0]) * mlng, (b[1] - a[1]) * M_LAT)
 
 
-def load_tier1_labels():
+def load_tier1_labels(man=None):
     """Lignes tier 1 du manifest (train, téléphérique) → exclues de l'émission."""
-    man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
+    if man is None:
+        man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
     return {ln["line_number"].strip() for ln in man["lines"]
             if ln.get("importance_tier", 2) == 1}
 
@@ -100,12 +102,9 @@ def edge_perps(coords, mlng):
     return out
 
 
-def main():
-    if len(sys.argv) != 3:
-        print(__doc__, file=sys.stderr)
-        sys.exit(2)
-    gj = json.load(open(sys.argv[1]))
-    tier1 = load_tier1_labels()
+def build_strands(gj, tier1):
+    """Sortie LOOM géographique (GeoJSON chargé) → network_strands.json
+    (dict) ; `tier1` : labels exclus (load_tier1_labels)."""
 
     # ── 1. Arêtes canonicalisées + entrées par GROUPE ────────────────────
     # FUSION LATÉRALE des variantes co-localisées (demande 05/06) : sur
@@ -417,11 +416,21 @@ def main():
         "lines": out_lines,
         "aliases": aliases,
     }
+    return out
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__, file=sys.stderr)
+        sys.exit(2)
+    gj = json.load(open(sys.argv[1]))
+    out = build_strands(gj, load_tier1_labels())
+    out_lines = out["lines"]
     json.dump(out, open(sys.argv[2], "w"), separators=(",", ":"))
     npts = sum(len(r["pts"]) for l in out_lines.values() for r in l["runs"])
     nruns = sum(len(l["runs"]) for l in out_lines.values())
     print("OK lines=%d runs=%d pts=%d maxCorridor=%d → %s (%.0f Ko)" % (
-        len(out_lines), nruns, npts, max_corridor, sys.argv[2],
+        len(out_lines), nruns, npts, out["meta"]["maxCorridor"], sys.argv[2],
         os.path.getsize(sys.argv[2]) / 1024), file=sys.stderr)
 
 
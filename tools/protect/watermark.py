@@ -26,6 +26,10 @@ import math
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "scripts"))
+from transport_bundle import write_json  # noqa: E402
+
 AMP_M = 1.5          # amplitude max du déplacement perpendiculaire (mètres)
 M_LAT = 111320.0
 REGISTRY = os.path.expanduser("~/.misy/watermark-registry.jsonl")
@@ -93,7 +97,7 @@ def apply(build_dir, version):
                 coords[i][0] = round(coords[i][0] + dlng, 7)
                 coords[i][1] = round(coords[i][1] + dlat, 7)
         gj.setdefault("properties", {})["_wm"] = {"v": version, "c": COPYRIGHT}
-        json.dump(gj, open(f, "w"), separators=(",", ":"))
+        write_json(f, gj, compact=True)   # atomique : pas de tracé tronqué si interrompu
         touched += 1
 
     # © dans le manifest servi
@@ -102,7 +106,7 @@ def apply(build_dir, version):
     if os.path.exists(man):
         m = json.load(open(man))
         m["_wm"] = {"v": version, "c": COPYRIGHT}
-        json.dump(m, open(man, "w"), separators=(",", ":"))
+        write_json(man, m, compact=True)
 
     # © dans les faisceaux LOOM (pas de filigrane géo : géométrie dérivée,
     # déjà couverte par le bundle ; on marque juste la propriété)
@@ -111,7 +115,7 @@ def apply(build_dir, version):
     if os.path.exists(strands):
         s = json.load(open(strands))
         s.setdefault("meta", {})["_wm"] = {"v": version, "c": COPYRIGHT}
-        json.dump(s, open(strands, "w"), separators=(",", ":"))
+        write_json(strands, s, compact=True)
 
     os.makedirs(os.path.dirname(REGISTRY), exist_ok=True)
     with open(REGISTRY, "a") as r:
@@ -15,6 +15,7 @@ Convention d'id (parsée par octi2json.py) : `W_<KIND>__<Label_avec_underscores>
 - `MISY_BBOX="W,S,E,N"` (env, plan centre) : clippe l'eau à la zone.
 
 Usage : … | topo | python3 inject_water.py | loom | octi | …
+(en Python : inject(graph, bbox), cf. run_pipeline.py)
 """
 import json
 import math
@@ -30,11 +31,11 @@ COLOR = "9FC7E8"
 MLAT = 111320.0
 
 
-def main():
-    graph = json.load(sys.stdin)
+def inject(graph, bbox=""):
+    """Ajoute l'eau (clippée à bbox="W,S,E,N" si donnée) au graphe post-topo,
+    en place ; renvoie le graphe."""
     water = json.load(open(WATER))
 
-    bbox = os.environ.get("MISY_BBOX", "").strip()
     clip = None
     if bbox:
         W, S, E, N = (float(v) for v in bbox.split(","))
@@ -119,6 +120,12 @@ def main():
 
     print("EAU injectée: %d chaînes (clip=%s)" % (n_chains, bbox or "non"),
           file=sys.stderr)
+    return graph
+
+
+def main():
+    graph = json.load(sys.stdin)
+    inject(graph, os.environ.get("MISY_BBOX", "").strip())
     json.dump(graph, sys.stdout)
 
 
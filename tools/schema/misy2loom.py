@@ -9,14 +9,19 @@ Sortie (stdout) : FeatureCollection avec
 On clusterise les arrêts globalement (proximité ~35 m ou même nom) → un même
 arrêt partagé par plusieurs lignes = un seul nœud (correspondance). Chaque arête
 = portion de la polyligne entre 2 arrêts consécutifs (sliced sur le tracé réel
-pour que `topo` fusionne correctement les corridors partagés).
+pour que `topo` fusionne correctement les corridors partagés). Aller et retour
+sont traités ; une arête empruntée par plusieurs lignes (ou par les 2 sens)
+n'est émise qu'une fois, avec toutes ses lignes.
+
+Étapes appelables en Python (tools/schema/run_pipeline.py) : load_bundle →
+build_edges → clip_zone → graph ; main() = la même chose sur env/stdout.
 """
 import json
 import math
 import os
 import re
 import sys
-from collections import OrderedDict
+from collections import defaultdict
 
 BUNDLE = os.path.expanduser(
     "~/StudioProjects/misy_booking_web/assets/transport_lines_public")
@@ -43,28 +48,191 @@ def norm(s):
         s = s.replace(x, y)
     return " ".join(s.split())
 
-clusters = []  # {pos:[lng,lat], name, namenorm, id}
+# Index des clusters : grille de cellules SAME_NAME_M (rayon max d'une fusion →
+# seuls les 3×3 voisins sont testés, pour les deux règles). Projection
+# équirectangulaire avec le cos de GRID_LAT_MAX (≥ |latitude| du réseau) :
+# les distances projetées minorent la haversine, donc la recherche 3×3 ne
+# rate aucun cluster à ≤ SAME_NAME_M.
+GRID_LAT_MAX = 20.0
+_KY = 6371000.0 * math.pi / 180.0
+_KX = _KY * math.cos(math.radians(GRID_LAT_MAX))
+
+clusters = []  # {pos:[lng,lat], name, namenorm, id, seq}
+grid = defaultdict(list)  # cellule (gx, gy) → clusters
+
+def reset_clusters():
+    """Repart d'un index vide (la clusterisation dépend de l'ordre des
+    arrêts : chaque build_edges la refait depuis zéro)."""
+    clusters.clear(); grid.clear()
+
+def cell(pos):
+    return (math.floor(pos[0] * _KX / SAME_NAME_M),
+            math.floor(pos[1] * _KY / SAME_NAME_M))
+
 def find_or_make(pos, name):
+    """Cluster qualifiant le plus proche (même nom à ≤ SAME_NAME_M ou tout
+    cluster à ≤ PROX_M), le plus ancien à distance égale ; sinon un nouveau.
+    Indépendant de l'ordre de parcours des clusters existants."""
     nn = norm(name)
-    for c in clusters:
-        d = hav(c["pos"], pos)
-        if nn and c["namenorm"] == nn and d <= SAME_NAME_M:
-            return c
-        if d <= PROX_M:
-            if len(name) > len(c["name"]):
-                c["name"] = name; c["namenorm"] = nn
-            return c
-    c = {"pos": pos, "name": name, "namenorm": nn, "id": "n%d" % len(clusters)}
+    best = None   # (distance, seq, cluster, même nom)
+    gx, gy = cell(pos)
+    for x in (gx - 1, gx, gx + 1):
+        for y in (gy - 1, gy, gy + 1):
+            for c in grid.get((x, y), ()):
+                d = hav(c["pos"], pos)
+                same = bool(nn) and c["namenorm"] == nn
+                if (d <= PROX_M or (same and d <= SAME_NAME_M)) \
+                        and (best is None or (d, c["seq"]) < best[:2]):
+                    best = (d, c["seq"], c, same)
+    if best is not None:
+        c = best[2]
+        if not best[3] and len(name) > len(c["name"]):
+            c["name"] = name; c["namenorm"] = nn
+        return c
+    c = {"pos": pos, "name": name, "namenorm": nn, "id": "n%d" % len(clusters),
+         "seq": len(clusters)}
     clusters.append(c)
+    grid[cell(pos)].append(c)
     return c
 
-def nearest_idx(pt, coords):
-    best, bi = 1e18, 0
-    for i, c in enumerate(coords):
-        d = (c[0]-pt[0])**2 + (c[1]-pt[1])**2
-        if d < best:
-            best, bi = d, i
-    return bi
+# Position d'un arrêt sur sa ligne : (segment i, t ∈ [0, 1]) en mètres locaux,
+# cherchée dans une grille cellule → segments propre à la ligne.
+SEG_CELL_M = 100.0   # cellule de l'index de segments
+SNAP_M = 150.0       # distance max arrêt → tracé pour la recherche indexée
+
+def line_index(coords):
+    """Index d'une polyligne (≥ 2 sommets) : sommets projetés en mètres
+    locaux + grille cellule → segments dont la bbox élargie de SNAP_M la
+    touche."""
+    lat0 = sum(c[1] for c in coords) / len(coords)
+    kx = _KY * math.cos(math.radians(lat0))
+    xy = [(c[0] * kx, c[1] * _KY) for c in coords]
+    g = defaultdict(list)
+    for i in range(len(xy) - 1):
+        (ax, ay), (bx, by) = xy[i], xy[i + 1]
+        for x in range(math.floor((min(ax, bx) - SNAP_M) / SEG_CELL_M),
+                       math.floor((max(ax, bx) + SNAP_M) / SEG_CELL_M) + 1):
+            for y in range(math.floor((min(ay, by) - SNAP_M) / SEG_CELL_M),
+                           math.floor((max(ay, by) + SNAP_M) / SEG_CELL_M) + 1):
+                g[(x, y)].append(i)
+    return {"coords": coords, "xy": xy, "kx": kx, "grid": g}
+
+def _nearest(xy, segs, px, py, after):
+    """(d, i, t) de la projection la plus proche sur les segments `segs`,
+    sans revenir avant la position `after` = (i, t)."""
+    best = None
+    for i in segs:
+        if i < after[0]:
+            continue
+        (ax, ay), (bx, by) = xy[i], xy[i + 1]
+        dx, dy = bx - ax, by - ay
+        l2 = dx * dx + dy * dy
+        t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / l2))
+        if i == after[0] and t < after[1]:
+            t = after[1]
+        d = math.hypot(ax + t * dx - px, ay + t * dy - py)
+        if best is None or (d, i) < best[:2]:
+            best = (d, i, t)
+    return best
+
+def project(li, pt, after=(0, 0.0)):
+    """Position (i, t) de pt sur la ligne indexée `li`, recherche monotone :
+    la projection la plus proche à partir de `after` (arrêt précédent).
+    Sans candidat à ≤ SNAP_M devant, la plus proche de tout le tracé
+    (l'arrêt est hors tracé ou dans le désordre : l'appelant voit b <= a)."""
+    xy = li["xy"]
+    px, py = pt[0] * li["kx"], pt[1] * _KY
+    key = (math.floor(px / SEG_CELL_M), math.floor(py / SEG_CELL_M))
+    best = _nearest(xy, li["grid"].get(key, ()), px, py, after)
+    if best is None or best[0] > SNAP_M:
+        best = _nearest(xy, range(len(xy) - 1), px, py, (0, 0.0))
+    return best[1], best[2]
+
+def point_at(coords, p):
+    i, t = p
+    a, b = coords[i], coords[i + 1]
+    return [round(a[0] + (b[0] - a[0]) * t, 7), round(a[1] + (b[1] - a[1]) * t, 7)]
+
+def slice_line(coords, a, b):
+    """Portion de la polyligne entre les positions a <= b, coupée
+    exactement aux projections (sommets intermédiaires inchangés)."""
+    out = []
+    for c in [point_at(coords, a)] + coords[a[0] + 1:b[0] + 1] + [point_at(coords, b)]:
+        if not out or out[-1] != c:
+            out.append(c)
+    return out
+
+def stop_edges(gj):
+    """Arêtes (from, to, coords) d'un sens de ligne : arrêts clusterisés,
+    tracé coupé entre arrêts consécutifs à leurs projections."""
+    line_coords = None
+    stops = []
+    for ft in gj["features"]:
+        g = ft["geometry"]
+        if g["type"] == "LineString":
+            line_coords = g["coordinates"]
+        elif g["type"] == "Point" and ft.get("properties", {}).get("type") == "stop":
+            stops.append((ft["properties"].get("order", 0),
+                          g["coordinates"], ft["properties"].get("name", "")))
+    if not line_coords or len(line_coords) < 2 or len(stops) < 2:
+        return []
+    stops.sort(key=lambda s: s[0])
+    # cluster chaque arrêt + position projetée sur la polyligne
+    li = line_index(line_coords)
+    nodeids = []
+    idxs = []
+    after = (0, 0.0)
+    for _, pos, name in stops:
+        c = find_or_make(pos, name)
+        nodeids.append(c["id"])
+        p = project(li, pos, after)
+        idxs.append(p)
+        after = max(after, p)
+    # arêtes = portion de tracé entre arrêts consécutifs
+    out = []
+    for i in range(len(stops) - 1):
+        a, b = idxs[i], idxs[i+1]
+        if b <= a:
+            seg = [stops[i][1], stops[i+1][1]]
+        else:
+            seg = slice_line(line_coords, a, b)
+        if len(seg) < 2:
+            seg = [stops[i][1], stops[i+1][1]]
+        if nodeids[i] == nodeids[i+1]:
+            continue
+        out.append((nodeids[i], nodeids[i+1], seg))
+    return out
+
+# Arêtes uniques : clé = paire de nœuds + empreinte du tracé, orientés dans un
+# sens canonique (le retour parcourt l'arête de l'aller à l'envers). L'empreinte
+# ignore les 2 extrémités (coupées aux projections propres à chaque ligne) et
+# arrondit à GEOM_DECIMALS : même route entre mêmes arrêts = même arête.
+GEOM_DECIMALS = 5      # ~1 m
+
+def geom_key(coords):
+    key = []
+    for c in coords[1:-1]:
+        p = (round(c[0], GEOM_DECIMALS), round(c[1], GEOM_DECIMALS))
+        if not key or key[-1] != p:
+            key.append(p)
+    return tuple(key)
+
+def add_edge(edges, index, frm, to, coords, line):
+    """Ajoute le passage de `line` sur l'arête frm→to, créée au besoin ;
+    `index` : (from, to, empreinte) → arête."""
+    if cluster_seq(frm) > cluster_seq(to):
+        frm, to, coords = to, frm, coords[::-1]
+    key = (frm, to, geom_key(coords))
+    e = index.get(key)
+    if e is None:
+        e = {"from": frm, "to": to, "coords": coords, "lines": []}
+        index[key] = e
+        edges.append(e)
+    if all(l["id"] != line["id"] for l in e["lines"]):
+        e["lines"].append(line)
+
+def cluster_seq(cid):
+    return int(cid[1:])
 
 def line_base(num):
     """Numéro de base d'une ligne : '133A'/'133B'→'133', '147 Bleu'→'147',
@@ -73,9 +241,27 @@ def line_base(num):
     m = re.match(r"^(\d+)", (num or "").strip())
     return m.group(1) if m else (num or "").strip()
 
-def main():
-    man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
+def load_bundle(bundle=BUNDLE):
+    """(manifest, routes) : routes = [(ligne du manifest, GeoJSON d'un sens)]
+    dans l'ordre manifest, aller puis retour. Lu une fois, réutilisable par
+    plusieurs build_edges (plan global, centre, vue réseau)."""
+    man = json.load(open(os.path.join(bundle, "manifest.json")))
+    root = os.path.expanduser("~/StudioProjects/misy_booking_web")
+    routes = []
+    for ln in man["lines"]:
+        for direction in ("aller", "retour"):
+            ap = (ln.get(direction) or {}).get("asset_path")
+            if not ap:
+                continue
+            path = os.path.join(root, ap)
+            if not os.path.exists(path):
+                print("MISS " + path, file=sys.stderr); continue
+            routes.append((ln, json.load(open(path))))
+    return man, routes
 
+def build_edges(man, routes, full_ids=FULL_IDS):
+    """Arêtes uniques {from,to,coords,lines:[{id,label,color}]} du réseau
+    entier ; remet à zéro puis remplit `clusters`."""
     # Couleur par numéro de base : on privilégie la ligne « nue » (line_number
     # == base) ; sinon la 1re variante rencontrée.
     base_color = {}
@@ -87,11 +273,12 @@ def main():
         if b not in base_color or num.strip() == b:
             base_color[b] = hx
 
-    edges = []  # {from,to,coords,lineid,label,color}
-    for ln in man["lines"]:
+    reset_clusters()
+    edges, index = [], {}
+    for ln, gj in routes:
         num = ln["line_number"]
         base = line_base(num)
-        if FULL_IDS:
+        if full_ids:
             col = ln.get("color", "0xFF1565C0")
             hexcol = col[-6:] if col.startswith("0x") else col.lstrip("#")
             lineid = "L_" + re.sub(r"[^A-Za-z0-9]+", "_", num.strip())
@@ -100,107 +287,69 @@ def main():
             hexcol = base_color.get(base, "1565C0")
             lineid = "L_" + base.replace(" ", "_")
             label = base
-        # On utilise l'aller comme séquence canonique (le retour recouvre le
-        # tronc ; topo fusionnera). Couvre l'essentiel pour un schéma V1.
-        ap = ln.get("aller", {}).get("asset_path")
-        if not ap:
-            continue
-        path = os.path.join(os.path.dirname(BUNDLE), ap) if not ap.startswith("assets") \
-            else os.path.join(os.path.dirname(os.path.dirname(BUNDLE)), ap)
-        path = os.path.join(os.path.expanduser("~/StudioProjects/misy_booking_web"), ap)
-        if not os.path.exists(path):
-            print("MISS " + path, file=sys.stderr); continue
-        gj = json.load(open(path))
-        line_coords = None
-        stops = []
-        for ft in gj["features"]:
-            g = ft["geometry"]
-            if g["type"] == "LineString":
-                line_coords = g["coordinates"]
-            elif g["type"] == "Point" and ft.get("properties", {}).get("type") == "stop":
-                stops.append((ft["properties"].get("order", 0),
-                              g["coordinates"], ft["properties"].get("name", "")))
-        if not line_coords or len(stops) < 2:
-            continue
-        stops.sort(key=lambda s: s[0])
-        # cluster chaque arrêt + indice sur la polyligne
-        nodeids = []
-        idxs = []
-        for _, pos, name in stops:
-            c = find_or_make(pos, name)
-            nodeids.append(c["id"])
-            idxs.append(nearest_idx(pos, line_coords))
-        # arêtes = portion de tracé entre arrêts consécutifs
-        for i in range(len(stops) - 1):
-            a, b = idxs[i], idxs[i+1]
-            if b <= a:
-                seg = [stops[i][1], stops[i+1][1]]
-            else:
-                seg = line_coords[a:b+1]
-            if len(seg) < 2:
-                seg = [stops[i][1], stops[i+1][1]]
-            if nodeids[i] == nodeids[i+1]:
-                continue
-            edges.append({"from": nodeids[i], "to": nodeids[i+1], "coords": seg,
-                          "lineid": lineid, "label": label, "color": hexcol})
+        line = {"id": lineid, "label": label, "color": hexcol}
+        # Aller ET retour : les arêtes communes (même paire de nœuds, même
+        # tracé, dans un sens ou l'autre) sont fusionnées par add_edge.
+        for frm, to, seg in stop_edges(gj):
+            add_edge(edges, index, frm, to, seg, line)
+    print("ARÊTES : %d uniques pour %d passages de ligne"
+          % (len(edges), sum(len(e["lines"]) for e in edges)), file=sys.stderr)
+    return edges
+
+def clip_zone(edges, bbox):
+    """Filtrage par ZONE bbox="W,S,E,N" : (arêtes gardées, continuations).
 
-    # --- Filtrage par ZONE (optionnel) : MISY_BBOX="W,S,E,N" -------------------
-    # Pour les plans zoomés (centre-ville…), on ne garde que le sous-graphe
-    # induit par les arrêts DANS la bbox → LOOM tourne sur un réseau réduit.
+    Pour les plans zoomés (centre-ville…), on ne garde que le sous-graphe
+    induit par les arrêts DANS la bbox → LOOM tourne sur un réseau réduit."""
     cl_by_id = {c["id"]: c for c in clusters}
-    bbox = os.environ.get("MISY_BBOX", "").strip()
-    if bbox:
-        W, S, E, N = (float(v) for v in bbox.split(","))
-
-        def _in(i):
-            x, y = cl_by_id[i]["pos"]
-            return W <= x <= E and S <= y <= N
-
-        # Arêtes coupées → CONTINUATIONS (flèches « la ligne continue ») :
-        # par nœud-frontière, direction sortante moyenne groupée par secteur de
-        # 30° (1 flèche par sortie de corridor) + nb de lignes concernées.
-        # Écrites en sidecar si MISY_CONT_OUT est défini (lu par octi2json).
-        latc = (S + N) / 2.0
-        mlng = 111320.0 * math.cos(math.radians(latc))
-        mlat = 111320.0
-        kept, conts = [], {}
-        for e in edges:
-            fi, ti = _in(e["from"]), _in(e["to"])
-            if fi and ti:
-                kept.append(e)
-                continue
-            if not (fi or ti):
-                continue
-            innid = e["from"] if fi else e["to"]
-            outid = e["to"] if fi else e["from"]
-            ip = cl_by_id[innid]["pos"]
-            op = cl_by_id[outid]["pos"]
-            dx = (op[0] - ip[0]) * mlng       # est (m)
-            dy = (op[1] - ip[1]) * mlat       # nord (m)
-            d = math.hypot(dx, dy)
-            if d < 1e-6:
-                continue
-            bucket = round(math.atan2(dy, dx) / (math.pi / 6.0))  # secteurs 30°
-            c = conts.setdefault((innid, bucket),
-                                 {"station_id": innid, "dx": 0.0, "dy": 0.0,
-                                  "lines": set()})
-            c["dx"] += dx / d
-            c["dy"] += dy / d
-            c["lines"].add(e["lineid"])
-        edges = kept
-        cont_out = os.environ.get("MISY_CONT_OUT", "").strip()
-        if cont_out:
-            data = []
-            for c in conts.values():
-                d = math.hypot(c["dx"], c["dy"]) or 1.0
-                data.append({"station_id": c["station_id"],
-                             "dir": [c["dx"] / d, c["dy"] / d],  # [est, nord] unitaire
-                             "n": len(c["lines"])})
-            json.dump(data, open(cont_out, "w"))
-            print("CONTINUATIONS: %d groupes → %s" % (len(data), cont_out),
-                  file=sys.stderr)
-        print("ZONE %s → %d arêtes" % (bbox, len(edges)), file=sys.stderr)
+    W, S, E, N = (float(v) for v in bbox.split(","))
+
+    def _in(i):
+        x, y = cl_by_id[i]["pos"]
+        return W <= x <= E and S <= y <= N
 
+    # Arêtes coupées → CONTINUATIONS (flèches « la ligne continue ») :
+    # par nœud-frontière, direction sortante moyenne groupée par secteur de
+    # 30° (1 flèche par sortie de corridor) + nb de lignes concernées.
+    # Sidecar lu par octi2json.
+    latc = (S + N) / 2.0
+    mlng = 111320.0 * math.cos(math.radians(latc))
+    mlat = 111320.0
+    kept, conts = [], {}
+    for e in edges:
+        fi, ti = _in(e["from"]), _in(e["to"])
+        if fi and ti:
+            kept.append(e)
+            continue
+        if not (fi or ti):
+            continue
+        innid = e["from"] if fi else e["to"]
+        outid = e["to"] if fi else e["from"]
+        ip = cl_by_id[innid]["pos"]
+        op = cl_by_id[outid]["pos"]
+        dx = (op[0] - ip[0]) * mlng       # est (m)
+        dy = (op[1] - ip[1]) * mlat       # nord (m)
+        d = math.hypot(dx, dy)
+        if d < 1e-6:
+            continue
+        bucket = round(math.atan2(dy, dx) / (math.pi / 6.0))  # secteurs 30°
+        c = conts.setdefault((innid, bucket),
+                             {"station_id": innid, "dx": 0.0, "dy": 0.0,
+                              "lines": set()})
+        c["dx"] += dx / d
+        c["dy"] += dy / d
+        c["lines"].update(l["id"] for l in e["lines"])
+    data = []
+    for c in conts.values():
+        d = math.hypot(c["dx"], c["dy"]) or 1.0
+        data.append({"station_id": c["station_id"],
+                     "dir": [c["dx"] / d, c["dy"] / d],  # [est, nord] unitaire
+                     "n": len(c["lines"])})
+    print("ZONE %s → %d arêtes" % (bbox, len(kept)), file=sys.stderr)
+    return kept, data
+
+def graph(edges):
+    """FeatureCollection LOOM : nœuds-stations utilisés + arêtes."""
     feats = []
     used = set(e["from"] for e in edges) | set(e["to"] for e in edges)
     for c in clusters:
@@ -214,10 +363,24 @@ def main():
         feats.append({"type": "Feature",
                       "geometry": {"type": "LineString", "coordinates": e["coords"]},
                       "properties": {"from": e["from"], "to": e["to"],
-                                     "lines": [{"id": e["lineid"], "label": e["label"],
-                                                "color": e["color"]}]}})
-    json.dump({"type": "FeatureCollection", "features": feats}, sys.stdout)
+                                     "lines": e["lines"]}})
     print("OK nodes=%d edges=%d" % (len(used), len(edges)), file=sys.stderr)
+    return {"type": "FeatureCollection", "features": feats}
+
+def main():
+    man, routes = load_bundle()
+    edges = build_edges(man, routes)
+    # MISY_BBOX="W,S,E,N" : sous-graphe de la zone ; MISY_CONT_OUT : sidecar
+    # des continuations.
+    bbox = os.environ.get("MISY_BBOX", "").strip()
+    if bbox:
+        edges, conts = clip_zone(edges, bbox)
+        cont_out = os.environ.get("MISY_CONT_OUT", "").strip()
+        if cont_out:
+            json.dump(conts, open(cont_out, "w"))
+            print("CONTINUATIONS: %d groupes → %s" % (len(conts), cont_out),
+                  file=sys.stderr)
+    json.dump(graph(edges), sys.stdout)
 
 if __name__ == "__main__":
     main()
@@ -16,6 +16,7 @@ Sortie JSON :
     "continuations":[{"x","y","dx","dy","n"}], "centreRect":[x,y,w,h] }
 
 Usage : python3 octi2json.py <octi.json> <out.json> [continuations_sidecar.json]
+(en Python : convert(octi, man, continuations), cf. run_pipeline.py)
 """
 import collections
 import json
@@ -24,6 +25,10 @@ import os
 import re
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "scripts"))
+from douglas_peucker import simplify  # noqa: E402
+
 BUNDLE = os.path.expanduser(
     "~/StudioProjects/misy_booking_web/assets/transport_lines_public")
 TARGET_W = 1600.0
@@ -55,23 +60,10 @@ def line_base(num):
 
 def dp(pts, tol=6.0):
     """Douglas-Peucker (espace canvas) — garde les vrais coudes, tue le
-    micro-wobble géographique résiduel d'octi."""
-    if len(pts) < 3:
-        return pts
-    ax, ay = pts[0]
-    bx, by = pts[-1]
-    dmax, idx = 0.0, 0
-    for i in range(1, len(pts) - 1):
-        px, py = pts[i]
-        dx, dy = bx - ax, by - ay
-        l2 = dx * dx + dy * dy
-        t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / l2))
-        d = math.hypot(px - (ax + t * dx), py - (ay + t * dy))
-        if d > dmax:
-            dmax, idx = d, i
-    if dmax > tol:
-        return dp(pts[:idx + 1], tol)[:-1] + dp(pts[idx:], tol)
-    return [pts[0], pts[-1]]
+    micro-wobble géographique résiduel d'octi. Itératif, sur indices
+    (scripts/douglas_peucker.py) : ni copies ni récursion sur les longues
+    arêtes."""
+    return simplify(pts, tol)
 
 
 def parse_water_id(lid):
@@ -84,12 +76,10 @@ def parse_water_id(lid):
     return (kind, label)
 
 
-def main():
-    octi = json.load(open(sys.argv[1]))
-    out = sys.argv[2]
-    cont_path = sys.argv[3] if len(sys.argv) > 3 else None
-
-    man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
+def convert(octi, man, continuations=None, cts=CTS):
+    """Sortie octi (GeoJSON chargé) → données du painter. `man` : manifest du
+    bundle ; `continuations` : sidecar misy2loom déjà chargé (plan centre) ;
+    `cts` : enrichissements CTS (défaut : env MISY_CTS)."""
     tier_of = {}
     for ln in man["lines"]:
         b = line_base(ln["line_number"])
@@ -159,7 +149,7 @@ def main():
             kind = "interchange"
         else:
             kind = "stop"
-        if CTS:
+        if cts:
             nn = norm_name(name)
             if len(lns) >= POLE_N or any(p in nn for p in POLE_PINNED):
                 kind = "pole"  # candidat — dédup spatiale plus bas
@@ -167,7 +157,7 @@ def main():
         stations.append({"x": x, "y": y, "name": name, "kind": kind,
                          "tier": tier, "n": len(lns)})
 
-    if CTS:
+    if cts:
         # Dédup spatiale des pôles : le seuil/épinglage marque tout le
         # QUARTIER (4× Anosy, 4× Soarano…) ; on ne garde que le meilleur
         # (n max) dans un rayon canvas, les autres redeviennent des
@@ -194,7 +184,7 @@ def main():
     edges = []
     for f in net_lines:
         pts = dp([proj(c[0], c[1]) for c in f["geometry"]["coordinates"]])
-        if CTS:
+        if cts:
             # `label` conservé : pastilles de numéro le long des brins.
             ll = [{"color": "#" + l["color"],
                    "tier": tier_of.get(l["label"], 2),
@@ -250,10 +240,10 @@ def main():
                 wlist.append({"kind": kind, "label": label, "pts": chain})
 
     # ---- continuations (sidecar misy2loom, plan centre) ----
-    continuations = []
-    if cont_path and os.path.exists(cont_path):
+    conts = []
+    if continuations:
         miss = 0
-        for c in json.load(open(cont_path)):
+        for c in continuations:
             f = by_station_id.get(str(c["station_id"]))
             if f is None:
                 miss += 1
@@ -261,9 +251,9 @@ def main():
             x, y = proj(*f["geometry"]["coordinates"])
             dx, dy = c["dir"][0], -c["dir"][1]   # [est,nord] → canvas (y vers le bas)
             d = math.hypot(dx, dy) or 1.0
-            continuations.append({"x": x, "y": y,
-                                  "dx": round(dx / d, 3), "dy": round(dy / d, 3),
-                                  "n": int(c.get("n", 1))})
+            conts.append({"x": x, "y": y,
+                          "dx": round(dx / d, 3), "dy": round(dy / d, 3),
+                          "n": int(c.get("n", 1))})
         if miss:
             sys.stderr.write("⚠ %d continuations sans nœud octi (fusion topo)\n" % miss)
 
@@ -287,8 +277,8 @@ def main():
 
     data = {"size": [round(W, 1), round(H, 1)], "edges": edges,
             "stations": stations, "water": wlist,
-            "continuations": continuations, "centreRect": centre_rect}
-    if CTS:
+            "continuations": conts, "centreRect": centre_rect}
+    if cts:
         # Liste globale des lignes (légende) : dédup par label, tri tier
         # puis numéro de base (numériques d'abord), pastille = couleur ligne.
         # `name` = display_name du manifest quand il diffère du label
@@ -317,10 +307,24 @@ def main():
                     int(m.group(1)) if m else 0, e["label"])
 
         data["legendLines"] = sorted(seen.values(), key=legend_key)
+    return data
+
+
+def main():
+    octi = json.load(open(sys.argv[1]))
+    out = sys.argv[2]
+    cont_path = sys.argv[3] if len(sys.argv) > 3 else None
+
+    man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
+    conts = None
+    if cont_path and os.path.exists(cont_path):
+        conts = json.load(open(cont_path))
+    data = convert(octi, man, conts)
     json.dump(data, open(out, "w"), separators=(",", ":"))
     sys.stderr.write(
         "JSON %s : %d edges, %d stations, %d water, %d continuations\n"
-        % (out, len(edges), len(stations), len(wlist), len(continuations)))
+        % (out, len(data["edges"]), len(data["stations"]), len(data["water"]),
+           len(data["continuations"])))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Orchestrateur Python des chaînes LOOM : remplace les pipes JSON de
+build_schema.sh, build_schema_cts.sh et tools/network/build_network_map.sh.
+
+Avant, chaque étape Python (misy2loom, inject_water, octi2json, tier_style,
+loom2strands) était un processus qui re-parsait puis re-sérialisait tout le
+graphe, et misy2loom relisait le bundle pour chaque plan. Ici :
+
+  - le bundle est lu UNE fois ; les arêtes misy2loom sont calculées une fois
+    par jeu d'ids (fusion par base / ids complets), le plan centre n'est
+    qu'un clip_zone du plan global ;
+  - les étapes Python tournent en processus sur les objets partagés ; seuls
+    les binaires LOOM voient du JSON, et deux binaires consécutifs sont
+    reliés par un pipe OS direct (topo|loom, loom|octi) ;
+  - avec --cache, la sortie de chaque chaîne de binaires est gardée dans
+    build/loom_cache/ sous le sha256 (binaires, options, entrée) : entrée
+    inchangée → LOOM n'est pas relancé (et, LOOM étant non déterministe, le
+    rendu reste celui déjà contrôlé) ; sans --cache, LOOM tourne toujours ;
+  - les rendus (global, centre, vue réseau…) tournent en parallèle
+    (threads : le temps est dans les binaires, hors GIL) ;
+  - timings par étape → stderr + build/pipeline_timings.json.
+
+Usage :
+  python3 tools/schema/run_pipeline.py schema            # = build_schema.sh
+  python3 tools/schema/run_pipeline.py cts               # = build_schema_cts.sh
+  python3 tools/schema/run_pipeline.py network           # = build_network_map.sh
+  python3 tools/schema/run_pipeline.py schema cts network [--cache] [--keep] [--jobs N]
+
+  --cache : réutilise / alimente build/loom_cache/ (cf. ci-dessus).
+  --keep : écrit aussi les graphes intermédiaires (graphes, sidecars) aux
+           emplacements des anciens scripts (gitignorés). Les sorties octi /
+           loom (*_octi.json, network_loom.json : QA) sont toujours écrites.
+Env : LOOM_BUILD, CENTRE_BBOX, GEO_PEN, GRID_PCT (mêmes défauts que les .sh).
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+NETWORK = os.path.join(REPO, "tools", "network")
+sys.path.insert(0, NETWORK)
+sys.path.insert(0, os.path.join(REPO, "scripts"))
+
+import inject_water  # noqa: E402
+import loom2strands  # noqa: E402
+import misy2loom  # noqa: E402
+import octi2json  # noqa: E402
+import tier_style  # noqa: E402
+from transport_bundle import atomic_open  # noqa: E402
+
+LOOM_BUILD = os.environ.get(
+    "LOOM_BUILD", os.path.expanduser("~/StudioProjects/_tools/loom/build"))
+# Bbox du centre-ville (pic de densité ±2000 m, élargie ~1.5 km au NORD) : W,S,E,N
+CENTRE_BBOX = os.environ.get("CENTRE_BBOX", "47.49055,-18.93339,47.52853,-18.88399")
+SCHEMA_DEST = os.path.join(REPO, "web", "transport_schema")
+NETWORK_DEST = os.path.join(REPO, "web", "transport_network")
+CACHE_DIR = os.path.join(REPO, "build", "loom_cache")
+TIMINGS_PATH = os.path.join(REPO, "build", "pipeline_timings.json")
+
+LOOM = ["loom",
+        "--same-seg-cross-pen", "25", "--diff-seg-cross-pen", "15",
+        "--in-stat-cross-pen-same-seg", "40", "--in-stat-cross-pen-diff-seg", "20",
+        "--sep-pen", "20", "--in-stat-sep-pen", "30"]
+TRANSITMAP = ["transitmap", "-l", "--line-width", "14", "--line-spacing", "4"]
+# Tuning octi GÉOSCHÉMATIQUE du plan CTS (cf. build_schema_cts.sh)
+OCTI_CTS = ["octi",
+            "--geo-pen", os.environ.get("GEO_PEN", "1.0"),
+            "-g", os.environ.get("GRID_PCT", "130%"),
+            "--pen-180", "0", "--pen-135", "1", "--pen-90", "2", "--pen-45", "1",
+            "--max-grid-dist", "3", "--density-pen", "10",
+            "--retry-on-error"]
+
+# Plans octilinéaires : base des sorties, octi, rendu CTS, dossier des SVG,
+# préfixe des graphes intermédiaires (--keep).
+OCTI_PIPELINES = {
+    "schema": {"base": "misy_octilineaire", "octi": ["octi"], "cts": False,
+               "svg_dir": SCHEMA_DEST, "graph": "misy_graph"},
+    "cts": {"base": "misy_cts", "octi": OCTI_CTS, "cts": True,
+            "svg_dir": HERE, "graph": "misy_cts_graph"},
+}
+PIPELINES = ("schema", "cts", "network")
+# Étapes manuelles après un run réussi (les anciens `echo "Ensuite…"` des .sh)
+NEXT_STEPS = {
+    "schema": ["Ensuite : git add web/transport_schema && commit && "
+               "flutter build web --release && ./deploy.sh"],
+    "cts": ["Ensuite : QA sur les SVG, puis git add web/transport_schema/misy_cts*.json",
+            "Test app : flutter run -d chrome --dart-define=SCHEMATIC_CTS=true"],
+    "network": ["Ensuite : ouvrir network_control.svg, puis "
+                "flutter run -d chrome --dart-define=LOOM_NETWORK=true"],
+}
+
+
+class Timings:
+    """Durées par (rendu, étape), partagées entre threads."""
+
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, render, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self.stages.append({"render": render, "stage": name,
+                                    "s": round(dt, 3)})
+            print("  [%s] %-12s %7.2f s" % (render, name, dt), file=sys.stderr)
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def write(path, data):
+    """Écriture atomique (transport_bundle.atomic_open) : un rendu
+    interrompu ne laisse pas d'artefact tronqué."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_open(path) as f:
+        f.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+
+def missing_binaries(names):
+    return [n for n in names if not os.access(os.path.join(LOOM_BUILD, n), os.X_OK)]
+
+
+def run_loom(chain, data, use_cache=False):
+    """(sortie, depuis_cache) de la chaîne de binaires LOOM `chain` =
+    [[binaire, options…], …] alimentée par `data` (bytes). Binaires reliés
+    par des pipes OS ; cache indexé par binaires (chemin + mtime), options
+    et entrée (lu / écrit seulement si use_cache)."""
+    key = hashlib.sha256()
+    for cmd in chain:
+        st = os.stat(os.path.join(LOOM_BUILD, cmd[0]))
+        key.update(dumps([cmd, st.st_mtime_ns, st.st_size]))
+    key.update(data)
+    path = os.path.join(CACHE_DIR, key.hexdigest() + ".out")
+    if use_cache and os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read(), True
+
+    procs = []
+    for cmd in chain:
+        procs.append(subprocess.Popen(
+            [os.path.join(LOOM_BUILD, cmd[0])] + cmd[1:],
+            stdin=procs[-1].stdout if procs else subprocess.PIPE,
+            stdout=subprocess.PIPE))
+        if len(procs) > 1:
+            procs[-2].stdout.close()   # SIGPIPE vers l'amont si l'aval meurt
+
+    def feed():
+        try:
+            procs[0].stdin.write(data)
+        except BrokenPipeError:
+            pass
+        finally:
+            procs[0].stdin.close()
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    out = procs[-1].stdout.read()
+    procs[-1].stdout.close()
+    writer.join()
+    for cmd, p in zip(chain, procs):
+        if p.wait() != 0:
+            raise RuntimeError("%s a échoué (code %d)" % (cmd[0], p.returncode))
+    if use_cache:
+        write(path, out)
+    return out, False
+
+
+def render_octi(ctx, name, spec, graph, bbox="", conts=None):
+    """topo → eau → loom|octi → JSON painter + SVG (render() des .sh)."""
+    t, base = ctx["timings"], spec["base"] + name
+    with t.stage(base, "topo"):
+        raw, hit = run_loom([["topo"]], dumps(graph), ctx["cache"])
+        topo = json.loads(raw)
+    with t.stage(base, "eau"):
+        inject_water.inject(topo, bbox)
+    with t.stage(base, "loom|octi"):
+        octi_raw, hit_o = run_loom([LOOM, spec["octi"]], dumps(topo), ctx["cache"])
+        octi = json.loads(octi_raw)
+    write(os.path.join(HERE, base + "_octi.json"), octi_raw)
+    with t.stage(base, "octi2json"):
+        data = octi2json.convert(octi, ctx["man"], conts, spec["cts"])
+        write(os.path.join(SCHEMA_DEST, base + ".json"), dumps(data))
+    with t.stage(base, "transitmap"):
+        svg, hit_s = run_loom([TRANSITMAP], octi_raw, ctx["cache"])
+    with t.stage(base, "tier_style"):
+        write(os.path.join(spec["svg_dir"], base + ".svg"),
+              tier_style.restyle(svg.decode("utf-8"), ctx["man"]))
+    print("✓ %s : %d edges, %d stations, %d water, %d continuations%s"
+          % (base, len(data["edges"]), len(data["stations"]), len(data["water"]),
+             len(data["continuations"]),
+             " (LOOM en cache)" if hit and hit_o and hit_s else ""),
+          file=sys.stderr)
+
+
+def render_network(ctx, graph):
+    """topo|loom (géographique, sans octi ni eau) → network_strands.json +
+    SVG de contrôle (build_network_map.sh)."""
+    t, base = ctx["timings"], "network"
+    with t.stage(base, "topo|loom"):
+        raw, hit = run_loom([["topo"], LOOM], dumps(graph), ctx["cache"])
+        gj = json.loads(raw)
+    write(os.path.join(NETWORK, "network_loom.json"), raw)
+    with t.stage(base, "loom2strands"):
+        out = loom2strands.build_strands(gj, loom2strands.load_tier1_labels(ctx["man"]))
+        write(os.path.join(NETWORK_DEST, "network_strands.json"), dumps(out))
+    with t.stage(base, "transitmap"):
+        svg, hit_s = run_loom([TRANSITMAP], raw, ctx["cache"])
+        write(os.path.join(NETWORK, "network_control.svg"), svg)
+    meta = out["meta"]
+    print("✓ network_strands.json : %d lignes, %d alias, maxCorridor=%d%s"
+          % (meta["nLines"], meta["nAliases"], meta["maxCorridor"],
+             " (LOOM en cache)" if hit and hit_s else ""), file=sys.stderr)
+
+
+def parse_args(args):
+    opts = {"pipelines": [], "cache": False, "keep": False, "jobs": None}
+    it = iter(args)
+    for a in it:
+        if a == "--cache":
+            opts["cache"] = True
+        elif a == "--keep":
+            opts["keep"] = True
+        elif a == "--jobs":
+            n = next(it, "")
+            if not n.isdigit():
+                return None
+            opts["jobs"] = max(1, int(n))
+        elif a in PIPELINES and a not in opts["pipelines"]:
+            opts["pipelines"].append(a)
+        else:
+            return None
+    return opts if opts["pipelines"] else None
+
+
+def main():
+    opts = parse_args(sys.argv[1:])
+    if opts is None:
+        print(__doc__, file=sys.stderr)
+        return 2
+    needed = {"topo", "loom", "transitmap"}
+    if set(opts["pipelines"]) & set(OCTI_PIPELINES):
+        needed.add("octi")
+    missing = missing_binaries(sorted(needed))
+    if missing:
+        print("❌ LOOM introuvable: %s (voir l'en-tête de tools/schema/build_schema.sh)"
+              % ", ".join(os.path.join(LOOM_BUILD, m) for m in missing), file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    timings = Timings()
+    with timings.stage("bundle", "lecture"):
+        man, routes = misy2loom.load_bundle()
+    ctx = {"man": man, "timings": timings, "cache": opts["cache"], "keep": opts["keep"]}
+
+    # Graphes préparés dans le thread principal (misy2loom garde ses clusters
+    # en global) ; un seul build_edges par jeu d'ids.
+    jobs = []   # (fonction, arguments)
+    octi_names = [p for p in opts["pipelines"] if p in OCTI_PIPELINES]
+    if octi_names:
+        with timings.stage("bundle", "graphe base"):
+            edges = misy2loom.build_edges(man, routes, full_ids=False)
+            full = misy2loom.graph(edges)
+            centre_edges, conts = misy2loom.clip_zone(edges, CENTRE_BBOX)
+            centre = misy2loom.graph(centre_edges)
+        for p in octi_names:
+            spec = OCTI_PIPELINES[p]
+            if opts["keep"]:
+                write(os.path.join(HERE, spec["graph"] + ".json"), dumps(full))
+                write(os.path.join(HERE, spec["graph"] + "_centre.json"), dumps(centre))
+                write(os.path.join(HERE, spec["graph"] + "_centre_cont.json"), dumps(conts))
+            jobs.append((render_octi, (ctx, "", spec, full)))
+            jobs.append((render_octi, (ctx, "_centre", spec, centre, CENTRE_BBOX, conts)))
+    if "network" in opts["pipelines"]:
+        with timings.stage("bundle", "graphe ids"):
+            network = misy2loom.graph(misy2loom.build_edges(man, routes, full_ids=True))
+        if opts["keep"]:
+            write(os.path.join(NETWORK, "network_graph.json"), dumps(network))
+        jobs.append((render_network, (ctx, network)))
+
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(opts["jobs"] or len(jobs)) as pool:
+        futures = [pool.submit(fn, *args) for fn, args in jobs]
+        for fut in futures:
+            try:
+                fut.result()
+            except Exception as e:  # un rendu raté n'arrête pas les autres
+                print("❌ %s" % e, file=sys.stderr)
+                failed += 1
+
+    wall = time.perf_counter() - t0
+    write(TIMINGS_PATH, json.dumps({"pipelines": opts["pipelines"],
+                                    "cache": opts["cache"],
+                                    "wall_s": round(wall, 3),
+                                    "stages": timings.stages}, indent=1))
+    busy = sum(s["s"] for s in timings.stages)
+    print("Durée : %.1f s (%.1f s cumulées sur les étapes) → %s"
+          % (wall, busy, os.path.relpath(TIMINGS_PATH, REPO)), file=sys.stderr)
+    if failed:
+        return 1
+    for p in opts["pipelines"]:
+        print("\n".join(NEXT_STEPS[p]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
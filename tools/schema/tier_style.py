@@ -12,6 +12,7 @@ chaque trait coloré du SVG.
 
 LOOM fait toute la mise en page ; on ne touche QUE la largeur de rendu.
 Usage : transitmap … | python3 tier_style.py > out.svg
+(en Python : restyle(svg, man), cf. run_pipeline.py)
 """
 import json
 import os
@@ -25,8 +26,9 @@ BUNDLE = os.path.expanduser(
 TIER_FACTOR = {1: 2.4, 2: 1.0, 3: 0.62}
 
 
-def main():
-    man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
+def restyle(svg, man):
+    """SVG transitmap → même SVG, largeurs de trait pondérées par tier
+    (`man` : manifest du bundle)."""
     # couleur hex (maj) → tier le PLUS important (min) vu sur cette couleur
     color_tier = {}
     for ln in man["lines"]:
@@ -35,8 +37,6 @@ def main():
         tier = int(ln.get("importance_tier", 2))
         color_tier[hx] = min(color_tier.get(hx, 9), tier)
 
-    svg = sys.stdin.read()
-
     def repl(m):
         style = m.group(0)
         cm = re.search(r"stroke:#([0-9a-fA-F]{6})", style)
@@ -52,7 +52,12 @@ def main():
         w = float(wm.group(1)) * f
         return style[:wm.start(1)] + ("%.4f" % w) + style[wm.end(1):]
 
-    sys.stdout.write(re.sub(r'style="[^"]*"', repl, svg))
+    return re.sub(r'style="[^"]*"', repl, svg)
+
+
+def main():
+    man = json.load(open(os.path.join(BUNDLE, "manifest.json")))
+    sys.stdout.write(restyle(sys.stdin.read(), man))
 
 
 if __name__ == "__main__":